@@ -0,0 +1,765 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器性能基准测试脚本
+用法: python benchmark.py [测试名 ...]，不带参数时运行全部测试
+"""
+
+import contextlib
+import io
+import logging
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from itertools import islice
+
+from message_store import BroadcastLog, Mailbox, MailboxTable, RequestIndex, next_seq
+
+
+def measure(func, repeat=1000):
+    """重复执行 func，返回平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def free_port():
+    """找一个空闲的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_test_server(with_gateway=False):
+    """在后台线程启动服务器，返回 (friend_server 模块, HTTP 地址)"""
+    from werkzeug.serving import make_server
+    import friend_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = free_port()
+    server = make_server('127.0.0.1', port, friend_server.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    if with_gateway and not friend_server.push_gateway.running:
+        friend_server.WS_PORT = friend_server.push_gateway.port = free_port()
+        friend_server.push_gateway.start()
+    return friend_server, f"http://127.0.0.1:{port}"
+
+
+def make_couple(base_url, user_a, user_b):
+    """注册两个用户并结成情侣"""
+    import requests
+
+    for user_id in (user_a, user_b):
+        requests.post(f"{base_url}/register_user", json={'user_id': user_id, 'user_name': user_id})
+    requests.post(f"{base_url}/send_couple_request",
+                  json={'from_user_id': user_a, 'from_user_name': user_a, 'to_user_id': user_b})
+    requests.post(f"{base_url}/accept_couple_request", json={'user_id': user_b, 'from_user_id': user_a})
+
+
+def bench_mailbox_poll():
+    """轮询延迟 vs 信箱历史长度：序号游标读取 vs 旧版全量时间戳扫描"""
+    print("\n📬 信箱轮询延迟（每次读取最新 5 条）")
+    print(f"{'历史条数':>10} {'after=seq (μs)':>16} {'timestamp 扫描 (μs)':>20}")
+
+    for history in (1_000, 10_000, 100_000):
+        mailbox = Mailbox(capacity=history)
+        legacy = []  # 旧版: defaultdict(list) 中的一个列表
+        for i in range(history):
+            message = {'type': 'pet_action', 'message': f'1:emotion:{i}', 'timestamp': float(i)}
+            mailbox.append(message)
+            legacy.append(message)
+
+        cursor = mailbox.last_seq - 5
+        last_timestamp = float(history - 6)
+
+        seq_cost = measure(lambda: mailbox.read_after(cursor))
+        scan_cost = measure(lambda: [m for m in legacy if m['timestamp'] > last_timestamp],
+                            repeat=max(10, 1_000_000 // history))
+        print(f"{history:>10} {seq_cost:>16.2f} {scan_cost:>20.2f}")
+
+
+def bench_push_latency(rounds=200, poll_interval=5):
+    """宠物动作端到端延迟：/send + 轮询 vs 长轮询 vs WebSocket"""
+    import requests
+    from websockets.sync.client import connect as ws_connect
+
+    server_module, base_url = start_test_server(with_gateway=True)
+    ws_url = f"ws://127.0.0.1:{server_module.WS_PORT}"
+    session = requests.Session()
+    send_body = {'user_id': 'bench_a', 'type': 'pet_action', 'message': '1:interaction:抚摸'}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        make_couple(base_url, 'bench_a', 'bench_b')
+
+        # 旧路径：POST /send，对方每 poll_interval 秒 GET /messages 一次
+        send_costs, poll_costs = [], []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            session.post(f"{base_url}/send", json=send_body)
+            send_costs.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            last_seq = session.get(f"{base_url}/messages",
+                                   params={'user_id': 'bench_b', 'after': 0}).json()['last_seq']
+            poll_costs.append(time.perf_counter() - start)
+
+        # 长轮询：对方挂起 GET /messages?wait=，发送方 POST /send
+        long_poll = []
+        for _ in range(rounds):
+            received = threading.Event()
+
+            def waiter(cursor=last_seq):
+                requests.get(f"{base_url}/messages",
+                             params={'user_id': 'bench_b', 'after': cursor, 'wait': 5})
+                received.set()
+
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            time.sleep(0.005)  # 确保对方已经挂起
+            start = time.perf_counter()
+            session.post(f"{base_url}/send", json=send_body)
+            received.wait()
+            long_poll.append(time.perf_counter() - start)
+            thread.join()
+            last_seq = server_module.messages['bench_b'].last_seq
+
+        # WebSocket：双方各一条长连接，帧直接转发
+        websocket_costs = []
+        with ws_connect(f"{ws_url}/?user_id=bench_a&after={last_seq}") as sender, \
+                ws_connect(f"{ws_url}/?user_id=bench_b&after={last_seq}") as receiver:
+            frame = '{"type": "pet_action", "message": "1:interaction:抚摸"}'
+            for _ in range(rounds):
+                start = time.perf_counter()
+                sender.send(frame)
+                receiver.recv()
+                websocket_costs.append(time.perf_counter() - start)
+
+    old_path = statistics.mean(send_costs) + poll_interval / 2 + statistics.mean(poll_costs)
+    print(f"\n⚡ 宠物动作端到端延迟（{rounds} 次，本机回环）")
+    print(f"{'路径':<24} {'平均 (ms)':>10} {'p95 (ms)':>10}")
+    print(f"{'/send + 5 秒轮询（估算）':<20} {old_path * 1000:>10.1f} {'':>10}")
+    for name, costs in (('/send + 长轮询', long_poll), ('WebSocket 网关', websocket_costs)):
+        p95 = sorted(costs)[int(len(costs) * 0.95) - 1]
+        print(f"{name:<20} {statistics.mean(costs) * 1000:>10.2f} {p95 * 1000:>10.2f}")
+    print(f"（轮询路径 = 发送耗时 {statistics.mean(send_costs) * 1000:.2f} ms"
+          f" + 平均等待 {poll_interval / 2:.1f} s + 拉取耗时 {statistics.mean(poll_costs) * 1000:.2f} ms）")
+
+
+def bench_broadcast_fanout(broadcasts=10):
+    """无目标广播的写入开销 vs 好友数：逐个信箱复制 vs 写一份广播日志"""
+    print(f"\n📢 广播写入开销（每次写入 {broadcasts} 条广播）")
+    print(f"{'好友数':>10} {'逐个复制 (ms)':>14} {'复制内存 (KB)':>14} {'广播日志 (μs)':>14} {'日志内存 (KB)':>14}")
+
+    for friend_count in (1_000, 10_000, 100_000):
+        mailboxes = [Mailbox() for _ in range(friend_count)]
+        log = BroadcastLog()
+
+        def fan_out_on_write(i):
+            message = {'type': 'chat', 'message': f'广播 {i}', 'timestamp': time.time()}
+            for mailbox in mailboxes:
+                mailbox.append(dict(message))
+
+        def fan_out_on_read(i):
+            log.append({'type': 'chat', 'message': f'广播 {i}', 'timestamp': time.time()})
+
+        results = []
+        for write in (fan_out_on_write, fan_out_on_read):
+            # 先计时，再单独开 tracemalloc 统计同样数量广播新增的内存
+            start = time.perf_counter()
+            for i in range(broadcasts):
+                write(i)
+            cost = (time.perf_counter() - start) / broadcasts
+            tracemalloc.start()
+            for i in range(broadcasts):
+                write(i)
+            memory = tracemalloc.get_traced_memory()[0] / 1024
+            tracemalloc.stop()
+            results.append((cost, memory))
+
+        (copy_cost, copy_memory), (log_cost, log_memory) = results
+        print(f"{friend_count:>10} {copy_cost * 1000:>14.2f} {copy_memory:>14.0f}"
+              f" {log_cost * 1e6:>14.2f} {log_memory:>14.1f}")
+
+
+def bench_request_storage(request_count=10_000, recipients=100):
+    """每条好友申请占用的内存：申请列表 + 信箱通知各存一份 vs 统一记录
+
+    用户ID、昵称在用户表里本来就有一份，事先建好不计入，只比较申请本身的存储结构。
+    """
+    requests = [(f'sender_{i}', f'发送者{i}', f'user_{i % recipients}') for i in range(request_count)]
+
+    def store_twice():
+        pending, mailboxes = defaultdict(list), MailboxTable()
+        for from_user_id, from_user_name, to_user_id in requests:
+            # 与旧版服务器一样，两份 dict 引用同一批请求参数字符串
+            pending[to_user_id].append({
+                'from_user_id': from_user_id, 'from_user_name': from_user_name,
+                'to_user_id': to_user_id, 'message': '我想和你成为好友', 'timestamp': time.time()
+            })
+            mailboxes[to_user_id].append({
+                'type': 'friend_request', 'from_user_id': from_user_id, 'from_user_name': from_user_name,
+                'message': '我想和你成为好友', 'timestamp': time.time()
+            })
+        return pending, mailboxes
+
+    def store_once():
+        index = RequestIndex('friend_request', MailboxTable())
+        for from_user_id, from_user_name, to_user_id in requests:
+            index.submit(from_user_id, from_user_name, to_user_id, '我想和你成为好友')
+        return index
+
+    print(f"\n📨 好友申请存储（{request_count} 条申请，{recipients} 个收件人，不含用户ID和昵称字符串）")
+    print(f"{'方式':<22} {'每条 (B)':>10} {'相对旧版':>10}")
+    baseline = None
+    for name, store in (('申请列表 + 信箱通知各一份', store_twice), ('统一记录 + 二级索引', store_once)):
+        tracemalloc.start()
+        kept = store()
+        memory = tracemalloc.get_traced_memory()[0] / request_count
+        tracemalloc.stop()
+        del kept
+        baseline = baseline or memory
+        print(f"{name:<18} {memory:>10.0f} {memory / baseline:>10.0%}")
+
+
+def bench_pending_requests():
+    """申请查重 + 接受的开销 vs 待处理申请数：列表扫描 + pop vs 按键索引"""
+    print("\n🔑 接受一条好友申请（查找 + 移除）")
+    print(f"{'待处理申请':>10} {'列表扫描 (μs)':>14} {'按键索引 (μs)':>14}")
+
+    for pending_count in (10, 1_000, 10_000):
+        legacy = [{'from_user_id': f'sender_{i}'} for i in range(pending_count)]
+        index = RequestIndex('friend_request', MailboxTable())
+        for i in range(pending_count):
+            index.submit(f'sender_{i}', f'发送者{i}', 'popular', '我想和你成为好友')
+
+        # 接受列表中间的一条，同一个人再发一条新申请（序号更大，排到末尾），保持待处理数量不变
+        target = f'sender_{pending_count // 2}'
+
+        def accept_legacy():
+            for i, request_data in enumerate(legacy):
+                if request_data['from_user_id'] == target:
+                    legacy.append(legacy.pop(i))
+                    break
+
+        def accept_indexed():
+            index._index(dict(index.remove('popular', target), seq=next_seq()))
+
+        repeat = max(100, 100_000 // pending_count)
+        print(f"{pending_count:>10} {measure(accept_legacy, repeat):>14.2f} {measure(accept_indexed, repeat):>14.2f}")
+
+
+def bench_pet_action_coalescing(actions=500):
+    """点击密集的宠物动作回放：对方离线期间信箱大小和一次拉取的数据量"""
+    import random
+    import friend_server
+
+    emotions = ["开心", "难过", "愤怒", "骄傲", "害羞", "惊讶"]
+    interactions = ["抚摸", "拥抱", "亲吻", "捏脸", "敲打"]
+    rng = random.Random(0)
+    workload = []
+    for _ in range(actions):
+        roll, pet_id = rng.random(), rng.choice((1, 2))
+        if roll < 0.75:
+            workload.append(f"{pet_id}:emotion:{rng.choice(emotions)}")
+        elif roll < 0.8:
+            workload.append(f"{pet_id}:control:bench_c")
+        else:
+            workload.append(f"{pet_id}:interaction:{rng.choice(interactions)}")
+
+    client = friend_server.app.test_client()
+    print(f"\n🐾 宠物动作合并（{actions} 次点击，75% 表情 / 5% 控制 / 20% 互动）")
+    print(f"{'方式':<10} {'信箱条数':>10} {'拉取大小 (KB)':>14}")
+    original = friend_server.COALESCED_PET_ACTIONS
+    try:
+        for name, coalesced, receiver in (('逐条保留', (), 'bench_d'), ('合并状态', original, 'bench_f')):
+            friend_server.COALESCED_PET_ACTIONS = coalesced
+            sender = receiver + '_sender'
+            with contextlib.redirect_stdout(io.StringIO()):
+                for user_id in (sender, receiver):
+                    client.post('/register_user', json={'user_id': user_id, 'user_name': user_id})
+                client.post('/send_couple_request',
+                            json={'from_user_id': sender, 'from_user_name': sender, 'to_user_id': receiver})
+                client.post('/accept_couple_request', json={'user_id': receiver, 'from_user_id': sender})
+                after = friend_server.messages[receiver].last_seq
+                for message in workload:
+                    client.post('/send', json={'user_id': sender, 'type': 'pet_action', 'message': message})
+            response = client.get('/messages', query_string={'user_id': receiver, 'after': after})
+            print(f"{name:<8} {len(friend_server.messages[receiver]):>10} {len(response.data) / 1024:>14.1f}")
+    finally:
+        friend_server.COALESCED_PET_ACTIONS = original
+
+
+def bench_mailbox_budget(users=2_000, per_user=200, global_capacity=50_000):
+    """离线用户被灌满时的信箱内存：只有单用户容量 vs 加上全局预算和各溢出策略"""
+    from message_store import OVERFLOW_POLICIES
+
+    print(f"\n🧺 信箱预算（{users} 个离线用户，每人收到 {per_user} 条，单用户容量 1000）")
+    print(f"{'配置':<26} {'保留条数':>10} {'内存 (MB)':>10} {'溢出次数':>10} {'移出/拒收':>10}")
+    configs = [('不限全局', 'drop_oldest', 0)]
+    configs += [(f'全局 {global_capacity} / {policy}', policy, global_capacity) for policy in OVERFLOW_POLICIES]
+    for name, policy, capacity in configs:
+        tracemalloc.start()
+        table = MailboxTable(1000, policy, capacity)
+        for i in range(users * per_user):
+            table[f'user_{i % users}'].append({'type': 'chat', 'message': f'消息 {i}', 'timestamp': float(i)})
+        memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+        tracemalloc.stop()
+        stats = table.budget.stats()
+        print(f"{name:<26} {stats['messages']:>10} {memory:>10.1f} {stats['overflows'][policy]:>10}"
+              f" {stats['evicted'] + stats['rejected']:>10}")
+        del table
+
+
+def bench_retention_sweep(users=5_000, per_user=100):
+    """后台清理一轮的耗时，以及清理期间另一个线程读取信箱的最长停顿"""
+    from retention import RetentionSweeper
+
+    table = MailboxTable(1000)
+    old = time.time() - 30 * 86400
+    for i in range(users * per_user):
+        table[f'user_{i % users}'].append({'type': 'pet_action', 'message': '1:emotion:开心', 'timestamp': old})
+    sweeper = RetentionSweeper([('messages', lambda: list(table),
+                                 lambda user_id, now: table[user_id].expire({}, now - 86400))])
+
+    # 模拟请求线程：清理期间不停读取信箱，记录单次读取的最长耗时
+    stalls, done = [], threading.Event()
+
+    def reader():
+        mailbox = table['user_0']
+        while not done.is_set():
+            start = time.perf_counter()
+            mailbox.read_after(0)
+            stalls.append(time.perf_counter() - start)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    start = time.perf_counter()
+    reclaimed = sweeper.run_once()['messages']
+    wall = time.perf_counter() - start
+    done.set()
+    thread.join()
+
+    stats = sweeper.stats()
+    print(f"\n🧹 过期清理（{users} 个信箱，每个 {per_user} 条过期消息）")
+    print(f"清理条数 {reclaimed}，工作时间 {stats['last_run_ms']:.1f} ms，"
+          f"分 {stats['last_run_slices']} 个时间片，总耗时 {wall * 1000:.1f} ms")
+    print(f"请求线程单次读取最长 {max(stalls) * 1000:.2f} ms，p99 {sorted(stalls)[int(len(stalls) * 0.99)] * 1000:.3f} ms")
+
+
+def bench_presence_tick(users=100_000, active=1_000, ticks=20):
+    """在线状态过期检查：每个刻度扫描全部用户 vs 时间轮只处理到期的格子"""
+    from presence import PresenceTracker
+
+    # 旧做法：每个刻度遍历所有用户的最后心跳时间
+    last_seen = {f'user_{i}': 0.0 for i in range(users)}
+    timeout = 15
+    scan = measure(lambda: [user_id for user_id, seen in last_seen.items() if 100.0 - seen > timeout], repeat=ticks)
+
+    # 时间轮：用可控的刻度代替真实时间，每个刻度有 active 个用户发心跳
+    clock = [0]
+    tracker = PresenceTracker(lambda user_id, online: None, tick_seconds=5, missed_heartbeats=3)
+    tracker._now_tick = lambda: clock[0]
+    tracker.tick = 0
+    for i in range(users):
+        tracker.touch(f'user_{i}')
+    timings = []
+    for tick in range(1, ticks + 1):
+        clock[0] = tick
+        for i in range(active):
+            tracker.touch(f'user_{(tick * active + i) % users}')
+        start = time.perf_counter()
+        tracker.advance()
+        timings.append(time.perf_counter() - start)
+
+    print(f"\n💓 在线状态过期检查（{users} 个用户，每个刻度 {active} 个心跳）")
+    print(f"全量扫描: {scan / 1000:.2f} ms/刻度")
+    timings.sort()
+    print(f"时间轮:   中位数 {timings[len(timings) // 2] * 1000:.3f} ms/刻度，"
+          f"最长 {timings[-1] * 1000:.2f} ms（初始用户集中下线的那个刻度）")
+    print(f"在线 {tracker.online_count}，累计下线 {tracker.expired}")
+
+
+def bench_friends_status_delta(churn=5):
+    """好友状态：完整列表 vs since 增量，好友数不同、只有少数好友变化时的响应大小和耗时"""
+    import friend_server
+
+    client = friend_server.app.test_client()
+    print(f"\n👀 好友状态（每次只有 {churn} 个好友变化）")
+    print(f"{'好友数':>8} {'完整 (B)':>10} {'增量 (B)':>10} {'完整 (μs)':>10} {'增量 (μs)':>10}")
+
+    for friend_count in (10, 1_000, 10_000):
+        user_id = f'watcher_{friend_count}'
+        friend_server.users.add(user_id, user_id)
+        for i in range(friend_count):
+            friend_id = f'friend_{friend_count}_{i}'
+            friend_server.users.add(friend_id, friend_id)
+            friend_server.friend_graph.add_edge(user_id, friend_id)
+            friend_server._record_status_change(user_id, friend_id)
+            friend_server._refresh_views(friend_id)
+
+        since = client.get('/friends_status', query_string={'user_id': user_id}).get_json()['version']
+        for i in range(churn):
+            friend_server._bump_watchers(f'friend_{friend_count}_{i}')
+
+        full_args = {'user_id': user_id}
+        delta_args = {'user_id': user_id, 'since': since}
+        full_size = len(client.get('/friends_status', query_string=full_args).get_data())
+        delta_size = len(client.get('/friends_status', query_string=delta_args).get_data())
+        repeat = max(10, 10_000 // friend_count)
+        full_time = measure(lambda: client.get('/friends_status', query_string=full_args), repeat)
+        delta_time = measure(lambda: client.get('/friends_status', query_string=delta_args), repeat)
+        print(f"{friend_count:>8} {full_size:>10} {delta_size:>10} {full_time:>10.0f} {delta_time:>10.0f}")
+
+
+def bench_friend_view():
+    """读取好友列表：每次查 users 生成字典再 jsonify vs 预先编码好的好友列表视图"""
+    from flask import Flask, jsonify
+    from friend_view import FriendView
+
+    app = Flask(__name__)
+    print("\n📇 读取好友列表（生成响应体）")
+    print(f"{'好友数':>8} {'逐个生成 (μs)':>14} {'视图 (μs)':>10} {'变化后首次读取 (μs)':>20}")
+
+    with app.app_context():
+        for friend_count in (10, 1_000, 10_000):
+            users = {f'friend_{i}': {'user_id': f'friend_{i}', 'user_name': f'好友{i}'} for i in range(friend_count)}
+            online = {friend_id: i % 2 == 0 for i, friend_id in enumerate(users)}
+            friend_ids = set(users)
+            view = FriendView()
+            for friend_id, user in users.items():
+                view.put(friend_id, user['user_name'], online[friend_id])
+
+            def build_legacy():
+                return jsonify({'friends': [{
+                    'user_id': friend_id,
+                    'user_name': users[friend_id]['user_name'],
+                    'online': online[friend_id]
+                } for friend_id in friend_ids if friend_id in users]}).get_data()
+
+            # 一个好友上下线后的第一次读取：更新一项并重新拼接
+            def read_after_change():
+                view.put('friend_0', '好友0', not view.entries['friend_0']['online'])
+                return view.response_body()
+
+            repeat = max(20, 20_000 // friend_count)
+            print(f"{friend_count:>8} {measure(build_legacy, repeat):>14.1f} "
+                  f"{measure(view.response_body, repeat):>10.2f} {measure(read_after_change, repeat):>20.1f}")
+
+
+def build_search_index(users):
+    """用 (user_id, user_name) 序列一次性建立搜索索引：逐个加入后只排序一次，比逐个 put 快"""
+    from search_index import UserSearchIndex
+
+    index = UserSearchIndex()
+    for user_id, user_name in users:
+        if user_id in index.numbers:
+            continue
+        number = len(index.user_ids)
+        index.numbers[user_id] = number
+        index.user_ids.append(user_id)
+        index.names.append(index._key(user_name))
+        index.ids.append(index._key(user_id))
+        index._add_grams(number)
+    index.by_name = sorted(range(len(index.user_ids)), key=lambda n: (index.names[n], index.user_ids[n]))
+    index.by_id = sorted(range(len(index.user_ids)), key=lambda n: (index.ids[n], index.user_ids[n]))
+    return index
+
+
+def bench_user_search(user_count=1_000_000, queries=200):
+    """按昵称搜索用户：逐个扫描全部用户 vs 前缀数组 + 三元组索引（建索引耗时、内存、查询延迟）"""
+    from search_index import normalize
+
+    rng = random.Random(0)
+    # 拼音音节、常见汉字和数字随机组合成昵称
+    syllables = [initial + final for initial in ('', 'b', 'ch', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n',
+                                                 'p', 'q', 'r', 's', 'sh', 't', 'w', 'x', 'y', 'zh')
+                 for final in ('a', 'ai', 'an', 'ang', 'ao', 'e', 'ei', 'en', 'i', 'ian', 'in', 'o', 'ong', 'u', 'un')]
+    syllables += list('小大明花猫狗宝贝月星云雨晴阳光心爱乐安欣怡子琪佳雪冰')
+    users = [(f'user_{i:07d}', ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+              + (str(rng.randint(0, 999)) if rng.random() < 0.3 else ''))
+             for i in range(user_count)]
+
+    print(f"\n🔎 用户搜索（{user_count} 个用户）")
+    start = time.perf_counter()
+    index = build_search_index(users)
+    build_seconds = time.perf_counter() - start
+
+    # 内存单独统计（tracemalloc 会拖慢建索引）
+    del index
+    tracemalloc.start()
+    index = build_search_index(users)
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    print(f"建索引 {build_seconds:.1f} s，索引占用 {memory:.0f} MB，三元组 {len(index.grams)} 个")
+
+    def scan(query):
+        query = normalize(query)
+        return [user_id for user_id, user_name in users if normalize(user_name).startswith(query)][:20]
+
+    # 各类查询词：完整用户ID、短前缀（匹配很多人）、长前缀、打错一个字母的昵称（走模糊匹配）
+    names = [user_name for _, user_name in rng.sample(users, queries)]
+    cases = [
+        ('用户ID', [user_id for user_id, _ in rng.sample(users, queries)]),
+        ('短前缀', [name[:2] for name in names]),
+        ('长前缀', [name[:6] for name in names]),
+        ('模糊（错一个字母）', ['x' + name[1:] for name in names]),
+    ]
+    print(f"{'查询':<14} {'逐个扫描 (ms)':>14} {'索引 p50 (ms)':>14} {'索引 p99 (ms)':>14} {'平均结果数':>10}")
+    for label, words in cases:
+        scan_ms = measure(lambda: scan(words[0]), 3) / 1000
+        latencies = []
+        found = 0
+        for word in words:
+            start = time.perf_counter()
+            results, _ = index.search(word, 0, 20)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += len(results)
+        latencies.sort()
+        print(f"{label:<12} {scan_ms:>14.1f} {statistics.median(latencies):>14.3f} "
+              f"{latencies[int(len(latencies) * 0.99) - 1]:>14.3f} {found / len(words):>10.1f}")
+
+    renames = [(user_id, user_name + 'x') for user_id, user_name in users[:1000]]
+    start = time.perf_counter()
+    for user_id, user_name in renames:
+        index.put(user_id, user_name)
+    print(f"改昵称（增量更新）: {(time.perf_counter() - start) / len(renames) * 1000:.3f} ms/次")
+
+
+def load_friend_graph(graph, friends):
+    """用 user_id -> 好友集合 的映射为新建的空 graph 一次性建立 CSR 快照，比逐条 add_edge 快"""
+    from array import array
+
+    for user_id in friends:
+        graph._number(user_id)
+    offsets = array('I', [0])
+    targets = array('I')
+    number = 0
+    while number < len(graph.user_ids):  # 只出现在别人好友集合里的用户编号排在后面
+        targets.extend(sorted(graph._number(friend_id) for friend_id in friends.get(graph.user_ids[number], ())))
+        offsets.append(len(targets))
+        number += 1
+    graph.offsets = offsets
+    graph.targets = targets
+    graph.since = array('Q', bytes(8 * len(targets)))
+    return graph
+
+
+def bench_friend_suggestions(user_count=100_000, average_degree=40):
+    """按共同好友数推荐好友：遍历 defaultdict(set) 的二重循环 vs CSR 邻接数组 vs 缓存"""
+    from friend_graph import FriendGraph
+
+    rng = random.Random(0)
+    friends = defaultdict(set)
+    for _ in range(user_count * average_degree // 2):
+        a, b = rng.randrange(user_count), rng.randrange(user_count)
+        if a != b:
+            friends[f'user_{a}'].add(f'user_{b}')
+            friends[f'user_{b}'].add(f'user_{a}')
+    # 好友数不同的几个用户，二度好友从几百到几万
+    for degree in (50, 500, 2_000):
+        hub = f'hub_{degree}'
+        for friend_id in rng.sample(list(friends), degree):
+            friends[hub].add(friend_id)
+            friends[friend_id].add(hub)
+
+    print(f"\n🧑‍🤝‍🧑 好友推荐（{user_count} 个用户，平均 {average_degree} 个好友）")
+    start = time.perf_counter()
+    graph = load_friend_graph(FriendGraph(), friends)
+    print(f"建立 CSR 快照 {time.perf_counter() - start:.1f} s")
+
+    tracemalloc.start()
+    copy = {user_id: set(friend_ids) for user_id, friend_ids in friends.items()}
+    set_memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    del copy
+    tracemalloc.start()
+    copy = load_friend_graph(FriendGraph(), friends)
+    graph_memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    del copy
+    print(f"内存：defaultdict(set) {set_memory:.0f} MB，CSR 快照（含编号表）{graph_memory:.0f} MB")
+
+    def nested_loop(user_id):
+        counts = defaultdict(int)
+        for friend_id in friends[user_id]:
+            for candidate in friends[friend_id]:
+                if candidate != user_id and candidate not in friends[user_id]:
+                    counts[candidate] += 1
+        return sorted(counts.items(), key=lambda item: -item[1])[:50]
+
+    print(f"{'好友数':>6} {'二度好友':>8} {'二重循环 (ms)':>14} {'CSR (ms)':>10} {'缓存 (μs)':>10}")
+    for degree in (50, 500, 2_000):
+        hub = f'hub_{degree}'
+        second_degree = sum(len(friends[friend_id]) for friend_id in friends[hub])
+        naive_ms = measure(lambda: nested_loop(hub), 5) / 1000
+
+        def cold():
+            graph._cache.clear()
+            return graph.suggestions(hub)
+
+        cold_ms = measure(cold, 5) / 1000
+        graph.suggestions(hub)
+        cached_us = measure(lambda: graph.suggestions(hub, 10), 1000)
+        print(f"{degree:>6} {second_degree:>8} {naive_ms:>14.1f} {cold_ms:>10.1f} {cached_us:>10.1f}")
+
+    edges = [(f'user_{rng.randrange(user_count)}', f'user_{rng.randrange(user_count)}') for _ in range(10_000)]
+    start = time.perf_counter()
+    for user_a, user_b in edges:
+        graph.add_edge(user_a, user_b)
+    print(f"新增好友关系: {(time.perf_counter() - start) / len(edges) * 1e6:.1f} μs/条（含 {graph.rebuilds} 次合并快照）")
+
+
+class RingFriends:
+    """确定性的对称好友关系：用户 i 与 i ± 1、7、31、127 号用户是好友，不必先生成整张图"""
+
+    OFFSETS = (1, 7, 31, 127)
+
+    def __init__(self, user_count):
+        self.user_count = user_count
+
+    def __iter__(self):
+        return (f'user_{i}' for i in range(self.user_count))
+
+    def get(self, user_id, default=()):
+        i = int(user_id[5:])
+        return [f'user_{(i + sign * offset) % self.user_count}' for offset in self.OFFSETS for sign in (1, -1)]
+
+
+def bench_user_storage(user_counts=(10_000, 100_000), active=10_000):
+    """用户和好友关系占用的内存：字典 + 字符串集合 + 每人一份好友列表视图 + (用户, 好友) -> 序号 的字典
+    vs __slots__ 用户表 + 共用编号、边上带序号的 CSR 邻接数组 + 只给最近活跃的 active 个用户保留的视图"""
+    from friend_graph import FriendGraph
+    from friend_view import FriendView, FriendViewCache
+    from user_store import UserTable
+
+    print(f"\n🗃️ 用户与好友关系存储（每人 {len(RingFriends.OFFSETS) * 2} 个好友，一半用户结成情侣，"
+          f"紧凑存储保留 {active} 个活跃用户的好友列表视图）")
+    print(f"{'用户数':>10} {'字典 + 集合 (MB)':>16} {'紧凑存储 (MB)':>14} {'每用户 (B)':>16}")
+    base_seq = int(time.time() * 1000)
+    for user_count in user_counts:
+        ring = RingFriends(user_count)
+
+        # 原来的结构：每个用户一个四个键的字典，好友集合和情侣字典里的 ID 是各个请求解析出来的独立字符串，
+        # 每个用户都有好友列表视图，成为好友时的序号存在以 (用户, 好友) 为键的字典里
+        tracemalloc.start()
+        users = {}
+        friends = defaultdict(set)
+        couples = {}
+        friend_views = defaultdict(FriendView)
+        friend_since = {}
+        for user_id in ring:
+            users[user_id] = {'user_id': user_id, 'user_name': f'昵称{user_id[5:]}',
+                              'online': False, 'last_seen': time.time()}
+        for number, user_id in enumerate(ring):
+            friends[user_id].update(ring.get(user_id))
+            for friend_id in ring.get(user_id):
+                friend_views[user_id].put(friend_id, users[friend_id]['user_name'], False)
+                friend_since[(user_id, friend_id)] = base_seq + number
+        for i in range(0, user_count - 1, 2):
+            couples[f'user_{i}'] = f'user_{i + 1}'
+            couples[f'user_{i + 1}'] = f'user_{i}'
+        legacy = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del users, friends, couples, friend_views, friend_since
+
+        tracemalloc.start()
+        table = UserTable()
+        for user_id in ring:
+            table.add(user_id, f'昵称{user_id[5:]}')
+        graph = load_friend_graph(FriendGraph(numbering=table), ring)
+        for i in range(len(graph.since)):
+            graph.since[i] = base_seq + i
+        for i in range(0, user_count - 1, 2):
+            table.pair(f'user_{i}', f'user_{i + 1}')
+
+        def build(user_id):
+            view = FriendView()
+            for friend_id in graph.friends_of(user_id):
+                view.put(friend_id, table[friend_id].user_name, False)
+            return view
+
+        views = FriendViewCache(build, active)
+        for user_id in islice(ring, active):
+            views.get(user_id)
+        compact = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del table, graph, views
+
+        print(f"{user_count:>10} {legacy / 1024 / 1024:>16.0f} {compact / 1024 / 1024:>14.0f} "
+              f"{legacy // user_count:>8} → {compact // user_count:<6}")
+
+
+def bench_spam_blocking(spam=5_000, legit=20):
+    """骚扰用户不停给同一个人发定向消息：不屏蔽时信箱被塞满、正常消息被挤掉，屏蔽后在分配前直接拒绝"""
+    import friend_server
+
+    client = friend_server.app.test_client()
+    print(f"\n🚫 骚扰消息（{spam} 条定向消息，期间好友发 {legit} 条正常消息）")
+    print(f"{'':<8} {'信箱条数':>8} {'内存增长 (KB)':>14} {'保留的正常消息':>14}")
+
+    for blocked in (False, True):
+        victim, spammer, friend = (f'{name}_{blocked:d}' for name in ('victim', 'spammer', 'friend'))
+        for user_id in (victim, spammer, friend):
+            friend_server.users.add(user_id, user_id)
+        if blocked:
+            client.post('/block_user', json={'user_id': victim, 'target_user_id': spammer})
+
+        spam_body = {'user_id': spammer, 'type': 'note', 'target_user_id': victim, 'message': '广告' * 20}
+        legit_body = {'user_id': friend, 'type': 'note', 'target_user_id': victim, 'message': '在吗'}
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            for i in range(spam):
+                client.post('/send', json=spam_body)
+                if i % (spam // legit) == 0:
+                    client.post('/send', json=legit_body)
+            growth = tracemalloc.get_traced_memory()[0] / 1024
+            tracemalloc.stop()
+
+        inbox = friend_server.messages[victim].read_after(0)
+        kept = sum(1 for message in inbox if message['from_user_id'] == friend)
+        label = '屏蔽后' if blocked else '不屏蔽'
+        print(f"{label:<6} {len(inbox):>8} {growth:>14.0f} {kept:>10}/{legit}")
+
+
+BENCHMARKS = {
+    'mailbox_poll': bench_mailbox_poll,
+    'push_latency': bench_push_latency,
+    'broadcast_fanout': bench_broadcast_fanout,
+    'request_storage': bench_request_storage,
+    'pending_requests': bench_pending_requests,
+    'pet_action_coalescing': bench_pet_action_coalescing,
+    'mailbox_budget': bench_mailbox_budget,
+    'retention_sweep': bench_retention_sweep,
+    'presence_tick': bench_presence_tick,
+    'friends_status_delta': bench_friends_status_delta,
+    'friend_view': bench_friend_view,
+    'user_search': bench_user_search,
+    'friend_suggestions': bench_friend_suggestions,
+    'user_storage': bench_user_storage,
+    'spam_blocking': bench_spam_blocking,
+}
+
+
+def main():
+    """主函数"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    print("🚀 LovePetty 服务器基准测试")
+    print("=" * 50)
+
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ 未知的测试: {name}（可选: {', '.join(BENCHMARKS)}）")
+            continue
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,15 @@ def check_deployment_files():
     
     required_files = [
         'friend_server.py',
+        'message_store.py',
+        'ws_gateway.py',
+        'retention.py',
+        'idempotency.py',
+        'presence.py',
+        'friend_view.py',
+        'search_index.py',
+        'friend_graph.py',
+        'user_store.py',
         'requirements_server.txt', 
         'render.yaml'
     ]
@@ -100,7 +109,7 @@ def generate_deployment_guide():
     print("   - Name: lovepetty-friend-server")
     print("   - Environment: Python 3")
     print("   - Build Command: pip install -r requirements_server.txt")
-    print("   - Start Command: gunicorn friend_server:app --bind 0.0.0.0:$PORT")
+    print("   - Start Command: gunicorn friend_server:app --bind 0.0.0.0:$PORT --worker-class gthread --workers 1 --threads 64")
     print("5. 点击 'Create Web Service' 开始部署")
     print("6. 等待部署完成，获取服务URL")
     print("7. 更新客户端代码中的服务器URL")
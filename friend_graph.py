@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友关系图 - 紧凑的 CSR 邻接数组（连同每条关系建立时的消息序号），按共同好友数推荐可能认识的人
+每个用户的推荐结果缓存起来，新增好友关系时只让受影响的用户的缓存失效
+"""
+
+import bisect
+import threading
+from array import array
+from collections import Counter, OrderedDict
+
+
+class FriendGraph:
+    """好友关系图
+
+    用户第一次出现时分配一个内部编号，也可以与用户表共用编号（numbering）；邻接关系存成 CSR 快照：
+    编号 n 的好友编号为 targets[offsets[n]:offsets[n + 1]]，两者都是 array('I')；
+    since 是与 targets 平行的 array('Q')，为成为好友时已提交的消息序号（更早的广播不投递给新好友）。
+    快照之后新增的关系先记在 added（编号 -> {好友编号: since}）里，删除的快照中的关系记在 removed 里
+    （删除后又加回来的关系两边都有，since 以 added 里的为准），
+    两者累计到快照边数的 rebuild_ratio（至少 rebuild_min 条）时合并成新的快照。
+
+    推荐结果为按共同好友数从多到少排列的前 top_k 个非好友，按用户缓存最多 cache_size 个；
+    新增或删除 a-b 关系时 a、b 以及两人的好友的推荐会变，只让这些用户的缓存失效。
+    """
+
+    def __init__(self, top_k=50, cache_size=10000, rebuild_ratio=0.125, rebuild_min=1024, numbering=None):
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.rebuild_ratio = rebuild_ratio
+        self.rebuild_min = rebuild_min
+        self.numbering = numbering  # 共用编号的用户表（有 number() 和 user_ids），None 时自己分配编号
+        self.numbers = {}  # user_id -> 内部编号（自己分配编号时）
+        self.user_ids = numbering.user_ids if numbering is not None else []  # 内部编号 -> user_id
+        self.offsets = array('I', [0])
+        self.targets = array('I')
+        self.since = array('Q')  # 与 targets 平行：成为好友时的消息序号
+        self.added = {}  # 编号 -> {快照之后新增的好友编号: since}
+        self.removed = {}  # 编号 -> 快照之后删除的（快照中的）好友编号集合
+        self.added_count = 0  # added 和 removed 中的条目数
+        self._cache = OrderedDict()  # 编号 -> [(user_id, 共同好友数)]，按最近使用排列
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _number(self, user_id):
+        """用户的内部编号，第一次出现时分配；共用编号时用户必须已在用户表里（需持有锁）"""
+        if self.numbering is not None:
+            return self.numbering.number(user_id)
+        number = self.numbers.get(user_id)
+        if number is None:
+            number = len(self.user_ids)
+            self.numbers[user_id] = number
+            self.user_ids.append(user_id)
+        return number
+
+    def _lookup(self, user_id):
+        """用户的内部编号，不存在时返回 None（需持有锁）"""
+        try:
+            return self._number(user_id) if self.numbering is not None else self.numbers.get(user_id)
+        except KeyError:
+            return None
+
+    def _snapshot(self, number):
+        """快照中的好友编号（需持有锁）"""
+        if number + 1 < len(self.offsets):
+            return self.targets[self.offsets[number]:self.offsets[number + 1]]
+        return ()
+
+    def _snapshot_since(self, number):
+        """快照中的 (好友编号, since)（需持有锁）"""
+        if number + 1 < len(self.offsets):
+            start, end = self.offsets[number], self.offsets[number + 1]
+            return zip(self.targets[start:end], self.since[start:end])
+        return ()
+
+    def _neighbors(self, number):
+        """全部好友编号（需持有锁）"""
+        neighbors = set(self._snapshot(number))
+        neighbors.difference_update(self.removed.get(number, ()))
+        neighbors.update(self.added.get(number, ()))
+        return neighbors
+
+    def _rebuild(self):
+        """把快照和新增的关系合并成新的快照（需持有锁）"""
+        offsets = array('I', [0])
+        targets = array('I')
+        since = array('Q')
+        for number in range(len(self.user_ids)):
+            gone = self.removed.get(number)
+            extra = self.added.get(number)
+            if gone or extra:
+                entries = {friend: seq for friend, seq in self._snapshot_since(number) if not gone or friend not in gone}
+                entries.update(extra or ())
+                for friend in sorted(entries):
+                    targets.append(friend)
+                    since.append(entries[friend])
+            elif number + 1 < len(self.offsets):
+                start, end = self.offsets[number], self.offsets[number + 1]
+                targets.extend(self.targets[start:end])
+                since.extend(self.since[start:end])
+            offsets.append(len(targets))
+        self.offsets = offsets
+        self.targets = targets
+        self.since = since
+        self.added = {}
+        self.removed = {}
+        self.added_count = 0
+        self.rebuilds += 1
+
+    def add_edge(self, user_a, user_b, since=0):
+        """新增好友关系（双向），since 为成为好友时的消息序号；已经是好友时不变"""
+        with self._lock:
+            a, b = self._number(user_a), self._number(user_b)
+            self._invalidate(a, b)
+            for source, target in ((a, b), (b, a)):
+                if target in self.added.get(source, ()) or \
+                        (self._in_snapshot(source, target) and target not in self.removed.get(source, ())):
+                    continue
+                # 删除后又加回来的快照中的关系仍留在 removed 里，新的 since 记在 added 里
+                self.added.setdefault(source, {})[target] = since
+                self.added_count += 1
+            self._maybe_rebuild()
+
+    def remove_edge(self, user_a, user_b):
+        """删除好友关系（双向）"""
+        with self._lock:
+            a, b = self._lookup(user_a), self._lookup(user_b)
+            if a is None or b is None:
+                return
+            self._invalidate(a, b)
+            for source, target in ((a, b), (b, a)):
+                extra = self.added.get(source)
+                if extra and target in extra:
+                    del extra[target]
+                    self.added_count -= 1
+                elif self._in_snapshot(source, target) and target not in self.removed.setdefault(source, set()):
+                    self.removed[source].add(target)
+                    self.added_count += 1
+            self._maybe_rebuild()
+
+    def _invalidate(self, a, b):
+        """a-b 关系变化，清除受影响用户的推荐缓存（需持有锁）"""
+        affected = self._neighbors(a) | self._neighbors(b)
+        affected.update((a, b))
+        for number in affected:
+            self._cache.pop(number, None)
+
+    def _maybe_rebuild(self):
+        if self.added_count >= max(self.rebuild_min, len(self.targets) * self.rebuild_ratio):
+            self._rebuild()
+
+    def _in_snapshot(self, a, b):
+        """快照中 a 的好友是否包含 b，每个用户的好友编号有序，二分查找（需持有锁）"""
+        if a + 1 >= len(self.offsets):
+            return False
+        start, end = self.offsets[a], self.offsets[a + 1]
+        position = bisect.bisect_left(self.targets, b, start, end)
+        return position < end and self.targets[position] == b
+
+    def are_friends(self, user_a, user_b):
+        """两人是否是好友"""
+        with self._lock:
+            a, b = self._lookup(user_a), self._lookup(user_b)
+            if a is None or b is None:
+                return False
+            if b in self.added.get(a, ()):
+                return True
+            return self._in_snapshot(a, b) and b not in self.removed.get(a, ())
+
+    def friends_of(self, user_id):
+        """用户的全部好友 user_id"""
+        with self._lock:
+            number = self._lookup(user_id)
+            if number is None:
+                return []
+            return [self.user_ids[friend] for friend in self._neighbors(number)]
+
+    def friends_since(self, user_id):
+        """用户的全部好友及成为好友时的消息序号，返回 [(user_id, since)]"""
+        with self._lock:
+            number = self._lookup(user_id)
+            if number is None:
+                return []
+            gone = self.removed.get(number, ())
+            extra = self.added.get(number, {})
+            result = [(self.user_ids[friend], seq) for friend, seq in self._snapshot_since(number)
+                      if friend not in gone and friend not in extra]
+            result.extend((self.user_ids[friend], seq) for friend, seq in extra.items())
+            return result
+
+    def degree(self, user_id):
+        """用户的好友数"""
+        with self._lock:
+            number = self._lookup(user_id)
+            if number is None:
+                return 0
+            snapshot = self.offsets[number + 1] - self.offsets[number] if number + 1 < len(self.offsets) else 0
+            return snapshot - len(self.removed.get(number, ())) + len(self.added.get(number, ()))
+
+    def suggestions(self, user_id, limit=None):
+        """按共同好友数推荐的非好友，返回 [(user_id, 共同好友数)]，最多 limit（不超过 top_k）个"""
+        limit = self.top_k if limit is None else min(limit, self.top_k)
+        with self._lock:
+            number = self._lookup(user_id)
+            if number is None:
+                return []
+            cached = self._cache.get(number)
+            if cached is not None:
+                self._cache.move_to_end(number)
+                self.hits += 1
+                return cached[:limit]
+
+            self.misses += 1
+            neighbors = self._neighbors(number)
+            counts = Counter()
+            for friend in neighbors:
+                counts.update(self._snapshot(friend))
+                counts.update(self.added.get(friend, {}).keys())
+                gone = self.removed.get(friend)
+                if gone:
+                    counts.subtract(gone)
+            counts.pop(number, None)
+            for friend in neighbors:
+                counts.pop(friend, None)
+            if self.removed:
+                counts = +counts  # 去掉删除关系后减到 0 的
+            result = [(self.user_ids[candidate], mutual) for candidate, mutual in counts.most_common(self.top_k)]
+
+            self._cache[number] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return result[:limit]
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {
+            'users': len(self.user_ids),
+            'edges': (len(self.targets) + sum(map(len, self.added.values()))
+                      - sum(map(len, self.removed.values()))) // 2,
+            'rebuilds': self.rebuilds,
+            'cached': len(self._cache),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses
+        }
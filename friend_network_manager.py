@@ -5,10 +5,83 @@
 包含好友申请、情侣配对等所有功能
 """
 
+import json
 import requests
 import threading
 import time
+import uuid
+from urllib.parse import urlencode
 from PyQt5.QtCore import QObject, pyqtSignal
+from websockets.exceptions import ConnectionClosedOK
+from websockets.sync.client import connect as ws_connect
+
+POLL_INTERVAL = 5  # 普通轮询间隔（秒）
+LONG_POLL_WAIT = 25  # 长轮询单次等待时间（秒），服务器上限更小时以服务器为准
+HEARTBEAT_INTERVAL = 5  # 心跳包最小间隔（秒）
+STREAM_READ_TIMEOUT = 60  # SSE 读超时（秒），服务器每 15 秒发一次保活
+STREAM_MAX_FAILURES = 3  # SSE 连续失败次数达到后退回轮询
+SOCKET_MAX_FAILURES = 3  # WebSocket 连续失败次数达到后退回 HTTP
+ACK_INTERVAL = 5  # SSE 模式下单独发送消息确认的最小间隔（秒）
+PAGE_SIZE = 50  # 好友、申请列表每页条数
+MESSAGE_PAGE_SIZE = 100  # 每次拉取消息的最多条数，积压的消息分页拉取，第一页尽快交给界面
+ETAG_CACHE_SIZE = 100  # 带 ETag 的只读接口最多缓存的响应数
+SEARCH_PAGE_SIZE = 20  # 搜索用户时显示的结果数
+POST_RETRIES = 2  # 修改数据的 POST 请求超时或连接失败时，用同一个 Idempotency-Key 重试的次数
+POST_DEADLINE = 10  # 一次 POST 调用（包括重试和退避）最多占用的秒数，界面线程不会被卡太久
+GAP_RESEND_DELAY = 1  # WebSocket 上有宠物动作缺口时，空闲这么多秒后再请求补发
+
+# 批量操作中 GET 类型的接口，其余按 POST 发送
+BATCH_GET_OPERATIONS = {
+    'search_user', 'friends', 'friend_suggestions', 'blocked_users', 'couple_status', 'couple_requests',
+    'friend_requests', 'friends_status', 'messages', 'pet_state', 'resend'
+}
+
+def _subtract_range(ranges, first, last):
+    """从 [start, end] 区间列表中去掉 [first, last]，返回新列表"""
+    result = []
+    for start, end in ranges:
+        if end < first or start > last:
+            result.append([start, end])
+            continue
+        if start < first:
+            result.append([start, first - 1])
+        if end > last:
+            result.append([last + 1, end])
+    return result
+
+class RequestBatch:
+    """批量请求上下文 - with 块内登记的操作在退出时合并成一次 /batch 请求
+    
+    用法:
+        with manager.batch() as batch:
+            batch.add('accept_friend_request', body={'user_id': ..., 'from_user_id': ...})
+            batch.add('friends', args={'user_id': ...})
+        for result in batch.results:
+            print(result['status'], result['body'])
+    """
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self.operations = []
+        self.results = []
+        
+    def add(self, op: str, body: dict = None, args: dict = None) -> int:
+        """登记一个操作，返回它在 results 中的下标"""
+        operation = {'op': op}
+        if body is not None:
+            operation['body'] = body
+        if args is not None:
+            operation['args'] = args
+        self.operations.append(operation)
+        return len(self.operations) - 1
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.operations:
+            self.results = self.manager._execute_batch(self.operations)
+        return False
 
 class FriendNetworkManager(QObject):
     """好友网络管理器 - 最终修复版本"""
@@ -30,21 +103,111 @@ class FriendNetworkManager(QObject):
         self.registered = False
         self.logged_in = False
         self.last_message_timestamp = 0
+        self.last_message_seq = 0  # 已收到的最大消息序号
+        self.acked_seq = 0  # 已向服务器确认的消息序号
+        self.last_ack_time = 0
         self.polling_thread = None
         self.running = False
+        self.server_features = set()  # 服务器在首页声明的功能
+        self.server_boot = None  # 服务器的运行标识，变化说明服务器重启过
+        self.long_poll_wait = 0  # 0 表示服务器不支持长轮询
+        self.last_heartbeat = 0
+        self.ws_url = None  # 服务器声明的 WebSocket 网关地址
+        self.socket = None  # 当前的 WebSocket 连接
+        self.couple_partner_id = None
+        self.sync_versions = {}  # /sync 各分区的版本号
+        self.sync_cache = {}  # /sync 各分区的最新数据，getter 优先使用
+        self.pet_state_version = 0  # 已应用的服务器端宠物状态快照的版本号
+        self.pet_field_versions = {}  # (pet_id, 动作类型) -> 已应用的状态版本号
+        self.pet_action_seqs = {}  # 发送者 -> 已收到的最大宠物动作序号
+        self.sender_gaps = {}  # 发送者 -> 待补发的宠物动作序号区间 [[first, last]]
+        self.friends_status_version = 0  # 已应用的好友状态版本号
+        self.friend_online = {}  # 好友 -> 最近一次通知的在线状态
+        self.couple_online = {}  # 情侣 -> 最近一次通知的在线状态
+        self.etag_cache = {}  # (接口, 参数) -> (ETag, 响应体)，服务器返回 304 时沿用
+        
+    def _reset_sync_state(self):
+        """清空消息游标和各种增量同步的状态，下次全部从服务器重新拉取"""
+        self.last_message_timestamp = 0
+        self.last_message_seq = 0
+        self.acked_seq = 0
+        self.sync_versions = {}
+        self.sync_cache = {}
+        self.pet_state_version = 0
+        self.pet_field_versions = {}
+        self.pet_action_seqs = {}
+        self.sender_gaps = {}
+        self.friends_status_version = 0
+        self.friend_online = {}
+        self.couple_online = {}
+        self.etag_cache = {}
+        
+    def _check_boot(self, boot):
+        """记录服务器的运行标识；服务器重启过时旧的序号和版本号都失效，清空同步状态"""
+        if not boot or boot == self.server_boot:
+            return
+        if self.server_boot is not None:
+            print("🔄 服务器已重启，重新同步")
+            friend_online, couple_online = self.friend_online, self.couple_online
+            self._reset_sync_state()
+            # 在线状态保留，重新拉取完整列表时只通知有变化的
+            self.friend_online, self.couple_online = friend_online, couple_online
+        self.server_boot = boot
+        
+    def _post(self, path: str, payload: dict, idempotency_key: str = None):
+        """发送修改数据的 POST 请求
+        
+        请求带 Idempotency-Key，超时或连接失败时用同一个键重试，服务器只执行一次；
+        同一个操作需要发多次（如换格式重试）时由调用方传入同一个键。
+        每次请求的超时为剩余时间，退避后剩下的时间不够再发一次时不再重试，
+        整个调用不超过 POST_DEADLINE 秒。
+        """
+        headers = {'Idempotency-Key': idempotency_key or uuid.uuid4().hex}
+        deadline = time.monotonic() + POST_DEADLINE
+        for attempt in range(POST_RETRIES + 1):
+            try:
+                return requests.post(f"{self.server_url}{path}", json=payload, 
+                                     headers=headers, timeout=max(deadline - time.monotonic(), 1))
+            except (requests.Timeout, requests.ConnectionError) as e:
+                # 退避 attempt + 1 秒后至少还要留 1 秒给下一次请求
+                if attempt == POST_RETRIES or deadline - time.monotonic() < attempt + 2:
+                    raise
+                print(f"请求 {path} 失败，重试: {e}")
+                time.sleep(attempt + 1)
+        
+    def _get_json(self, path: str, params: dict):
+        """GET 只读接口，返回 (状态码, 响应体)
+        
+        带上次响应的 ETag 发送 If-None-Match，服务器返回 304 时沿用上次的响应体。
+        """
+        key = (path, tuple(sorted(params.items())))
+        cached = self.etag_cache.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = requests.get(f"{self.server_url}{path}", params=params, 
+                                headers=headers, timeout=10)
+        
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+        body = response.json()
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag:
+            if len(self.etag_cache) >= ETAG_CACHE_SIZE:
+                self.etag_cache.clear()
+            self.etag_cache[key] = (etag, body)
+        return response.status_code, body
         
     def register_user(self, user_id: str, user_name: str) -> bool:
         """注册用户"""
         try:
-            response = requests.post(f"{self.server_url}/register_user", 
-                                   json={
-                                       'user_id': user_id,
-                                       'user_name': user_name
-                                   }, timeout=10)
+            response = self._post("/register_user", {
+                'user_id': user_id,
+                'user_name': user_name
+            })
             
             if response.status_code == 200:
                 self.user_id = user_id
                 self.user_name = user_name
+                self._reset_sync_state()
                 self.registered = True
                 self.logged_in = True
                 self.start_polling()
@@ -63,15 +226,15 @@ class FriendNetworkManager(QObject):
     def login_user(self, user_id: str, user_name: str) -> bool:
         """用户登录"""
         try:
-            response = requests.post(f"{self.server_url}/login_user", 
-                                   json={
-                                       'user_id': user_id,
-                                       'user_name': user_name
-                                   }, timeout=10)
+            response = self._post("/login_user", {
+                'user_id': user_id,
+                'user_name': user_name
+            })
             
             if response.status_code == 200:
                 self.user_id = user_id
                 self.user_name = user_name
+                self._reset_sync_state()
                 self.logged_in = True
                 self.start_polling()
                 self.login_status_changed.emit(True)
@@ -89,32 +252,67 @@ class FriendNetworkManager(QObject):
     def search_user(self, user_id: str) -> dict:
         """搜索用户"""
         try:
-            response = requests.get(f"{self.server_url}/search_user", 
-                                  params={'user_id': user_id}, timeout=10)
+            status, body = self._get_json("/search_user", {'user_id': user_id, 'from_user_id': self.user_id})
             
-            if response.status_code == 200:
-                return response.json()
+            if status == 200:
+                return body
             else:
-                print(f"搜索用户失败: {response.text}")
+                print(f"搜索用户失败: {body}")
                 return None
                 
         except Exception as e:
             print(f"搜索用户异常: {e}")
             return None
-    
+
+    def search_users(self, query: str, limit: int = SEARCH_PAGE_SIZE) -> list:
+        """按昵称或用户ID（可只输入开头部分）搜索用户，返回排好序的第一页结果
+
+        服务器不支持关键词搜索时按用户ID精确查找。
+        """
+        try:
+            if 'user_search' in self.server_features:
+                status, body = self._get_json("/search_user", {'q': query, 'limit': limit,
+                                                               'from_user_id': self.user_id})
+                if status == 200:
+                    return body.get('users', [])
+                print(f"搜索用户失败: {body}")
+                return []
+
+            result = self.search_user(query)
+            return [result['user']] if result and 'user' in result else []
+
+        except Exception as e:
+            print(f"搜索用户异常: {e}")
+            return []
+
+    def get_friend_suggestions(self, limit: int = 10) -> list:
+        """可能认识的人：按共同好友数排列的非好友，服务器不支持时返回空列表"""
+        if not self.user_id or 'friend_suggestions' not in self.server_features:
+            return []
+
+        try:
+            status, body = self._get_json("/friend_suggestions", {'user_id': self.user_id, 'limit': limit})
+            if status == 200:
+                return body.get('suggestions', [])
+            print(f"获取好友推荐失败: {body}")
+            return []
+
+        except Exception as e:
+            print(f"获取好友推荐异常: {e}")
+            return []
+
     def send_friend_request(self, target_user_id: str, message: str = "我想和你成为好友") -> bool:
         """发送好友申请"""
         if not self.user_id or not self.user_name:
             return False
             
         try:
-            response = requests.post(f"{self.server_url}/send_friend_request", 
-                                   json={
-                                       'from_user_id': self.user_id,
-                                       'from_user_name': self.user_name,
-                                       'to_user_id': target_user_id,
-                                       'message': message
-                                   }, timeout=10)
+            response = self._post("/send_friend_request", {
+                'from_user_id': self.user_id,
+                'from_user_name': self.user_name,
+                'to_user_id': target_user_id,
+                'message': message
+            })
             
             if response.status_code == 200:
                 print(f"好友申请发送成功: {target_user_id}")
@@ -133,13 +331,12 @@ class FriendNetworkManager(QObject):
             return False
             
         try:
-            response = requests.post(f"{self.server_url}/send_couple_request", 
-                                   json={
-                                       'from_user_id': self.user_id,
-                                       'from_user_name': self.user_name,
-                                       'to_user_id': target_user_id,
-                                       'message': message
-                                   }, timeout=10)
+            response = self._post("/send_couple_request", {
+                'from_user_id': self.user_id,
+                'from_user_name': self.user_name,
+                'to_user_id': target_user_id,
+                'message': message
+            })
             
             if response.status_code == 200:
                 print(f"情侣申请发送成功: {target_user_id}")
@@ -179,11 +376,12 @@ class FriendNetworkManager(QObject):
                 }
             ]
             
+            # 各种格式和重试共用一个幂等键，服务器只会执行成功一次
+            idempotency_key = uuid.uuid4().hex
             for i, request_data in enumerate(request_formats):
                 print(f"🔍 尝试格式 {i+1}: {request_data}")
                 
-                response = requests.post(f"{self.server_url}/accept_friend_request", 
-                                       json=request_data, timeout=10)
+                response = self._post("/accept_friend_request", request_data, idempotency_key)
                 
                 print(f"📡 格式 {i+1} 响应:")
                 print(f"   状态码: {response.status_code}")
@@ -233,11 +431,12 @@ class FriendNetworkManager(QObject):
                 }
             ]
             
+            # 各种格式和重试共用一个幂等键，服务器只会执行成功一次
+            idempotency_key = uuid.uuid4().hex
             for i, request_data in enumerate(request_formats):
                 print(f"🔍 尝试情侣申请格式 {i+1}: {request_data}")
                 
-                response = requests.post(f"{self.server_url}/accept_couple_request", 
-                                       json=request_data, timeout=10)
+                response = self._post("/accept_couple_request", request_data, idempotency_key)
                 
                 print(f"📡 情侣申请格式 {i+1} 响应:")
                 print(f"   状态码: {response.status_code}")
@@ -287,11 +486,12 @@ class FriendNetworkManager(QObject):
                 }
             ]
             
+            # 各种格式和重试共用一个幂等键，服务器只会执行成功一次
+            idempotency_key = uuid.uuid4().hex
             for i, request_data in enumerate(request_formats):
                 print(f"🔍 尝试拒绝情侣申请格式 {i+1}: {request_data}")
                 
-                response = requests.post(f"{self.server_url}/reject_couple_request", 
-                                       json=request_data, timeout=10)
+                response = self._post("/reject_couple_request", request_data, idempotency_key)
                 
                 print(f"📡 拒绝情侣申请格式 {i+1} 响应:")
                 print(f"   状态码: {response.status_code}")
@@ -313,23 +513,114 @@ class FriendNetworkManager(QObject):
         except Exception as e:
             print(f"❌ 拒绝情侣申请异常: {e}")
             return False
+
+    def _post_simple(self, path: str, payload: dict, action: str) -> bool:
+        """发送一个只关心成功与否的 POST 请求"""
+        if not self.user_id:
+            return False
+
+        try:
+            response = self._post(path, dict(payload, user_id=self.user_id))
+
+            if response.status_code == 200:
+                print(f"{action}成功")
+                return True
+            else:
+                print(f"{action}失败: {response.text}")
+                return False
+
+        except Exception as e:
+            print(f"{action}异常: {e}")
+            return False
+
+    def remove_friend(self, friend_id: str) -> bool:
+        """删除好友"""
+        return self._post_simple("/remove_friend", {'friend_id': friend_id}, f"删除好友 {friend_id} ")
+
+    def dissolve_couple(self) -> bool:
+        """解除情侣关系"""
+        return self._post_simple("/dissolve_couple", {}, "解除情侣关系")
+
+    def block_user(self, target_user_id: str) -> bool:
+        """屏蔽用户，同时删除好友、解除情侣关系，对方的申请和消息不再送达"""
+        return self._post_simple("/block_user", {'target_user_id': target_user_id}, f"屏蔽用户 {target_user_id} ")
+
+    def unblock_user(self, target_user_id: str) -> bool:
+        """取消屏蔽"""
+        return self._post_simple("/unblock_user", {'target_user_id': target_user_id}, f"取消屏蔽 {target_user_id} ")
+
+    def get_blocked_users(self) -> list:
+        """获取自己屏蔽的用户ID列表"""
+        if not self.user_id:
+            return []
+
+        try:
+            status, body = self._get_json("/blocked_users", {'user_id': self.user_id})
+            if status == 200:
+                return body.get('blocked', [])
+            print(f"获取屏蔽列表失败: {body}")
+            return []
+
+        except Exception as e:
+            print(f"获取屏蔽列表异常: {e}")
+            return []
+
+    def _iter_pages(self, path: str, key: str):
+        """逐页读取列表接口，每次产生一页的列表，调用方处理完一页才请求下一页；
+        服务器不支持分页时只有一页"""
+        params = {'user_id': self.user_id}
+        if 'pagination' in self.server_features:
+            params['limit'] = PAGE_SIZE
+        while True:
+            status, data = self._get_json(path, params)
+            if status != 200:
+                raise RuntimeError(data.get('error', status))
+            yield data.get(key, [])
+            if not data.get('next_cursor'):
+                return
+            params['cursor'] = data['next_cursor']
+    
+    def iter_friends_pages(self):
+        """按页读取好友列表，界面收到第一页即可开始显示"""
+        if not self.user_id:
+            return iter(())
+        if 'friends' in self.sync_cache:
+            return iter([list(self.sync_cache['friends'])])
+        return self._iter_pages("/friends", 'friends')
+    
+    def iter_friend_requests_pages(self):
+        """按页读取好友申请列表"""
+        if not self.user_id:
+            return iter(())
+        if 'friend_requests' in self.sync_cache:
+            return iter([list(self.sync_cache['friend_requests'])])
+        return self._iter_pages("/friend_requests", 'requests')
+    
+    def iter_couple_requests_pages(self):
+        """按页读取情侣申请列表"""
+        if not self.user_id:
+            return iter(())
+        if 'couple_requests' in self.sync_cache:
+            return iter([list(self.sync_cache['couple_requests'])])
+        return self._iter_pages("/couple_requests", 'requests')
+    
+    def _get_list(self, path: str, key: str) -> list:
+        """一次请求读取整个列表（不带 limit，服务器一次返回全部）"""
+        status, data = self._get_json(path, {'user_id': self.user_id})
+        if status != 200:
+            raise RuntimeError(data.get('error', status))
+        return data.get(key, [])
     
     def get_friends_list(self) -> list:
-        """获取好友列表"""
+        """获取好友列表（一次请求）；好友很多时界面用 iter_friends_pages 逐页显示"""
         if not self.user_id:
             return []
             
-        try:
-            response = requests.get(f"{self.server_url}/friends", 
-                                  params={'user_id': self.user_id}, timeout=10)
+        if 'friends' in self.sync_cache:
+            return list(self.sync_cache['friends'])
             
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('friends', [])
-            else:
-                print(f"获取好友列表失败: {response.text}")
-                return []
-                
+        try:
+            return self._get_list("/friends", 'friends')
         except Exception as e:
             print(f"获取好友列表异常: {e}")
             return []
@@ -339,14 +630,17 @@ class FriendNetworkManager(QObject):
         if not self.user_id:
             return {'has_couple': False}
             
+        if 'couple' in self.sync_cache:
+            return dict(self.sync_cache['couple'])
+            
         try:
-            response = requests.get(f"{self.server_url}/couple_status", 
-                                  params={'user_id': self.user_id}, timeout=10)
+            status, data = self._get_json("/couple_status", {'user_id': self.user_id})
             
-            if response.status_code == 200:
-                return response.json()
+            if status == 200:
+                self._update_couple_partner(data)
+                return dict(data)
             else:
-                print(f"获取情侣状态失败: {response.text}")
+                print(f"获取情侣状态失败: {data}")
                 return {'has_couple': False}
                 
         except Exception as e:
@@ -358,17 +652,11 @@ class FriendNetworkManager(QObject):
         if not self.user_id:
             return []
             
-        try:
-            response = requests.get(f"{self.server_url}/couple_requests", 
-                                  params={'user_id': self.user_id}, timeout=10)
+        if 'couple_requests' in self.sync_cache:
+            return list(self.sync_cache['couple_requests'])
             
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('requests', [])
-            else:
-                print(f"获取情侣申请失败: {response.text}")
-                return []
-                
+        try:
+            return self._get_list("/couple_requests", 'requests')
         except Exception as e:
             print(f"获取情侣申请异常: {e}")
             return []
@@ -378,21 +666,46 @@ class FriendNetworkManager(QObject):
         if not self.user_id:
             return []
             
-        try:
-            response = requests.get(f"{self.server_url}/friend_requests", 
-                                  params={'user_id': self.user_id}, timeout=10)
+        if 'friend_requests' in self.sync_cache:
+            return list(self.sync_cache['friend_requests'])
             
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('requests', [])
-            else:
-                print(f"获取好友申请失败: {response.text}")
-                return []
-                
+        try:
+            return self._get_list("/friend_requests", 'requests')
         except Exception as e:
             print(f"获取好友申请异常: {e}")
             return []
     
+    def batch(self) -> RequestBatch:
+        """创建批量请求上下文，把多个接口调用合并成一次往返"""
+        return RequestBatch(self)
+    
+    def _execute_batch(self, operations: list) -> list:
+        """执行批量操作；服务器不支持 /batch 时逐个发送"""
+        if 'batch' in self.server_features:
+            try:
+                response = self._post("/batch", {'operations': operations})
+                if response.status_code == 200:
+                    return response.json().get('results', [])
+                print(f"批量请求失败: {response.text}")
+            except Exception as e:
+                print(f"批量请求异常: {e}")
+            return [{'op': operation['op'], 'status': 0, 'body': None} for operation in operations]
+            
+        results = []
+        for operation in operations:
+            op = operation['op']
+            try:
+                if op in BATCH_GET_OPERATIONS:
+                    response = requests.get(f"{self.server_url}/{op}", 
+                                          params=operation.get('args'), timeout=10)
+                else:
+                    response = self._post(f"/{op}", operation.get('body') or {})
+                results.append({'op': op, 'status': response.status_code, 'body': response.json()})
+            except Exception as e:
+                print(f"批量操作 {op} 异常: {e}")
+                results.append({'op': op, 'status': 0, 'body': None})
+        return results
+    
     def get_user_id(self) -> str:
         """获取用户ID"""
         return self.user_id
@@ -402,17 +715,25 @@ class FriendNetworkManager(QObject):
         return self.user_name
     
     def send_pet_action(self, pet_id: int, action_type: str, action_data: str):
-        """发送宠物动作"""
+        """发送宠物动作 - 有 WebSocket 连接时直接走长连接"""
         if not self.user_id:
             return
             
+        message = f"{pet_id}:{action_type}:{action_data}"
+        socket = self.socket
+        if socket is not None:
+            try:
+                socket.send(json.dumps({'type': 'pet_action', 'message': message}, ensure_ascii=False))
+                return
+            except Exception as e:
+                print(f"WebSocket 发送宠物动作失败，改用 HTTP: {e}")
+            
         try:
-            response = requests.post(f"{self.server_url}/send", 
-                                   json={
-                                       'user_id': self.user_id,
-                                       'type': 'pet_action',
-                                       'message': f"{pet_id}:{action_type}:{action_data}"
-                                   }, timeout=10)
+            response = self._post("/send", {
+                'user_id': self.user_id,
+                'type': 'pet_action',
+                'message': message
+            })
             
             if response.status_code != 200:
                 print(f"发送宠物动作失败: {response.text}")
@@ -428,68 +749,506 @@ class FriendNetworkManager(QObject):
             self.polling_thread.daemon = True
             self.polling_thread.start()
     
+    def _detect_server_features(self):
+        """查询服务器支持的功能，决定使用长轮询还是普通轮询"""
+        try:
+            response = requests.get(f"{self.server_url}/", timeout=10)
+            if response.status_code == 200:
+                data = response.json()
+                self.server_features = set(data.get('features', []))
+                self.ws_url = data.get('ws_url')
+                self._check_boot(data.get('boot'))
+                if 'long_polling' in self.server_features:
+                    self.long_poll_wait = min(LONG_POLL_WAIT, data.get('long_poll_max_wait', LONG_POLL_WAIT))
+                    print(f"📡 服务器支持长轮询，等待时间 {self.long_poll_wait} 秒")
+        except Exception as e:
+            print(f"查询服务器功能异常: {e}")
+    
     def _polling_loop(self):
-        """轮询循环"""
+        """轮询循环
+        
+        依次尝试 WebSocket 网关、SSE 消息流，都连不上再退回轮询。
+        服务器支持长轮询时，请求会挂起到有新消息为止，收到后立即发起下一次；
+        否则每 POLL_INTERVAL 秒轮询一次。
+        """
+        self._detect_server_features()
+        self.fetch_pet_state()
+        self.fetch_friends_status()
+        
+        if 'websocket' in self.server_features and self.ws_url:
+            self._socket_loop()
+        if 'sse' in self.server_features:
+            self._stream_loop()
+        
         while self.running and self.user_id:
+            wait = self.long_poll_wait
             try:
-                # 获取新消息
-                response = requests.get(f"{self.server_url}/messages", 
-                                      params={
-                                          'user_id': self.user_id,
-                                          'timestamp': self.last_message_timestamp
-                                      }, timeout=10)
+                if 'sync' in self.server_features:
+                    ok = self._sync_once(wait)
+                else:
+                    ok = self._poll_messages_once(wait)
+                if not ok:
+                    wait = 0  # 出错时按普通间隔重试
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    messages = data.get('messages', [])
-                    
-                    for message in messages:
-                        self.last_message_timestamp = max(self.last_message_timestamp, message['timestamp'])
-                        
-                        if message['type'] == 'friend_request':
-                            self.friend_request_received.emit(
-                                message['from_user_id'],
-                                message['from_user_name'],
-                                message['message']
-                            )
-                        elif message['type'] == 'couple_request':
-                            self.couple_request_received.emit(
-                                message['from_user_id'],
-                                message['from_user_name'],
-                                message['message']
-                            )
-                        elif message['type'] == 'friend_accepted':
-                            print(f"✅ 收到好友申请接受通知: {message['from_user_name']}")
-                        elif message['type'] == 'couple_accepted':
-                            print(f"💕 收到情侣申请接受通知: {message['from_user_name']}")
-                        elif message['type'] == 'couple_rejected':
-                            print(f"💔 收到情侣申请拒绝通知: {message['from_user_name']}")
-                        elif message['type'] == 'pet_action':
-                            # 解析宠物动作消息
-                            try:
-                                pet_action_data = message['message'].split(':')
-                                if len(pet_action_data) == 3:
-                                    pet_id = int(pet_action_data[0])
-                                    action_type = pet_action_data[1]
-                                    action_data = pet_action_data[2]
-                                    print(f"🐕 收到宠物动作: pet_id={pet_id}, type={action_type}, data={action_data}")
-                                    self.pet_action_received.emit(pet_id, action_type, action_data)
-                                else:
-                                    print(f"⚠️ 宠物动作消息格式错误: {message['message']}")
-                            except Exception as e:
-                                print(f"❌ 解析宠物动作消息失败: {e}")
+            except Exception as e:
+                print(f"轮询异常: {e}")
+                time.sleep(POLL_INTERVAL)  # 出错时退避，避免长轮询空转
+                continue
+            
+            if not wait:
+                time.sleep(POLL_INTERVAL)  # 5秒轮询一次
+    
+    def _sync_once(self, wait):
+        """调用 /sync：一次请求完成心跳、拉取消息和有变化分区的刷新；积压的消息逐页拉取"""
+        payload = {
+            'user_id': self.user_id,
+            'versions': self.sync_versions,
+            'boot': self.server_boot,
+            'wait': wait
+        }
+        if self.last_message_seq:
+            # 还没收到过消息时不带游标，由服务器从投递游标开始
+            payload.update(after=self.last_message_seq, ack=self.last_message_seq)
+        if 'pagination' in self.server_features:
+            payload['limit'] = MESSAGE_PAGE_SIZE
+        while True:
+            response = requests.post(f"{self.server_url}/sync", json=payload, timeout=payload['wait'] + 10)
+            
+            if response.status_code != 200:
+                print(f"同步失败: {response.text}")
+                return False
                 
-                # 心跳包
-                requests.post(f"{self.server_url}/heartbeat", 
-                             json={'user_id': self.user_id}, timeout=5)
+            data = response.json()
+            self._check_boot(data.get('boot'))
+            for message in data.get('messages', []):
+                self._handle_message(message)
+            for section, section_payload in data.get('sections', {}).items():
+                self.sync_versions[section] = section_payload['version']
+                self.sync_cache[section] = section_payload['data']
+                if section == 'couple':
+                    self._update_couple_partner(section_payload['data'])
+            if 'friends' in data.get('sections', {}) or 'couple' in data.get('sections', {}):
+                self.fetch_friends_status()
+            if not data.get('next_cursor'):
+                self._flush_gaps()
+                return True
+            # 还有积压的消息：确认这一页并立即拉取下一页
+            payload.update(cursor=data['next_cursor'], ack=self.last_message_seq, boot=self.server_boot, wait=0)
+    
+    def _poll_messages_once(self, wait):
+        """不支持 /sync 的旧服务器：分别拉取消息和发送心跳"""
+        # 获取新消息
+        params = {'user_id': self.user_id}
+        if self.last_message_seq:
+            # 还没收到过消息时不带游标，由服务器从投递游标开始
+            params.update(after=self.last_message_seq, ack=self.last_message_seq)
+        if 'ack' not in self.server_features:
+            # 旧版服务器只认 timestamp
+            params['timestamp'] = self.last_message_timestamp
+        if self.server_boot:
+            params['boot'] = self.server_boot
+        if wait:
+            params['wait'] = wait
+        if 'pagination' in self.server_features:
+            params['limit'] = MESSAGE_PAGE_SIZE
+        while True:
+            response = requests.get(f"{self.server_url}/messages", 
+                                  params=params, timeout=wait + 10)
+            
+            ok = response.status_code == 200
+            if not ok:
+                print(f"获取消息失败: {response.text}")
+                break
+            data = response.json()
+            self._check_boot(data.get('boot'))
+            for message in data.get('messages', []):
+                self._handle_message(message)
+            if not data.get('next_cursor'):
+                break
+            # 还有积压的消息：确认这一页并立即拉取下一页
+            params.update(cursor=data['next_cursor'], ack=self.last_message_seq)
+            if self.server_boot:
+                params['boot'] = self.server_boot
+            params.pop('wait', None)
+        
+        self._flush_gaps()
+        self.fetch_friends_status()
+        
+        # 心跳包；支持 presence 的服务器把每个请求都当作心跳，不用单独发送
+        if 'presence' not in self.server_features and time.time() - self.last_heartbeat >= HEARTBEAT_INTERVAL:
+            requests.post(f"{self.server_url}/heartbeat", 
+                         json={'user_id': self.user_id}, timeout=5)
+            self.last_heartbeat = time.time()
+        return ok
+    
+    def _update_couple_partner(self, couple_status):
+        """记录情侣伴侣ID，用于区分情侣的上下线通知；换了情侣时重新拉取宠物状态"""
+        previous = self.couple_partner_id
+        if couple_status.get('has_couple'):
+            self.couple_partner_id = couple_status.get('partner', {}).get('user_id')
+        else:
+            self.couple_partner_id = None
+            
+        if self.couple_partner_id != previous and previous is not None:
+            # 服务器在情侣关系变化时清空补发历史，旧情侣的序号和缺口都作废
+            self.pet_action_seqs.pop(previous, None)
+            self.sender_gaps.pop(previous, None)
+        if self.couple_partner_id and self.couple_partner_id != previous:
+            if previous is not None:
+                self.pet_state_version = 0
+                self.pet_field_versions = {}
+            self.fetch_pet_state()
+    
+    def fetch_pet_state(self):
+        """拉取服务器端的宠物状态 - 首次为完整快照，之后只拉取变化的字段"""
+        if not self.user_id or 'pet_state' not in self.server_features:
+            return
+            
+        try:
+            response = requests.get(f"{self.server_url}/pet_state", 
+                                  params={'user_id': self.user_id, 'version': self.pet_state_version},
+                                  timeout=10)
+            
+            if response.status_code != 200:
+                print(f"获取宠物状态失败: {response.text}")
+                return
                 
+            data = response.json()
+            if not data.get('has_couple'):
+                return
+            for pet_id, fields in data.get('pets', {}).items():
+                if 'owner' in fields:
+                    self.pet_action_received.emit(int(pet_id), 'control', fields['owner'])
+                if 'emotion' in fields:
+                    self.pet_action_received.emit(int(pet_id), 'emotion', fields['emotion'])
+            self.pet_state_version = data['version']
+            # 快照之后的宠物动作从这里开始检测序号缺口
+            for sender_id, sender_seq in data.get('action_seqs', {}).items():
+                if sender_id != self.user_id:
+                    self.pet_action_seqs[sender_id] = max(self.pet_action_seqs.get(sender_id, 0), sender_seq)
+            
+        except Exception as e:
+            print(f"获取宠物状态异常: {e}")
+    
+    def _socket_loop(self):
+        """WebSocket 接收循环 - 宠物动作、申请通知和在线状态都从这条连接推送
+        
+        断线后从最后收到的序号重连（先确认服务器没有重启过），
+        连续 SOCKET_MAX_FAILURES 次连不上时返回，由调用方退回 HTTP。
+        """
+        failures = 0
+        reconnect = False
+        while self.running and self.user_id and failures < SOCKET_MAX_FAILURES:
+            if reconnect:
+                self._detect_server_features()
+            reconnect = True
+            query = {'user_id': self.user_id}
+            if self.last_message_seq:
+                query['after'] = self.last_message_seq
+            query = urlencode(query)
+            try:
+                with ws_connect(f"{self.ws_url}/?{query}", open_timeout=10) as socket:
+                    self.socket = socket
+                    print("📡 已连接 WebSocket 网关")
+                    failures = 0
+                    # 连接之前（包括断线期间）的变化不会再推送，先拉取一次情侣和好友状态
+                    self._refresh_statuses()
+                    while True:
+                        try:
+                            # 有待补发的缺口时，空闲 GAP_RESEND_DELAY 秒（后面的消息可能取代了缺口）再补发
+                            raw = socket.recv(timeout=GAP_RESEND_DELAY if self.sender_gaps else None)
+                        except TimeoutError:
+                            self._flush_gaps()
+                            continue
+                        except ConnectionClosedOK:
+                            break
+                        if not self.running:
+                            return
+                        frame = json.loads(raw)
+                        if frame.get('type') == 'presence':
+                            self._handle_presence(frame)
+                        elif frame.get('type') == 'section_changed':
+                            self._handle_section_changed(frame)
+                        else:
+                            self._handle_message(frame)
+                            # 处理完再确认，保证至少投递一次
+                            socket.send(json.dumps({'type': 'ack', 'seq': self.last_message_seq}))
+                            
             except Exception as e:
-                print(f"轮询异常: {e}")
+                print(f"WebSocket 异常: {e}")
+                failures += 1
+                time.sleep(POLL_INTERVAL)
+            finally:
+                self.socket = None
+        
+        if self.running:
+            print("⚠️ WebSocket 不可用，退回 HTTP")
+    
+    def _refresh_statuses(self):
+        """重新拉取情侣状态（更新情侣伴侣ID）和好友状态"""
+        self.sync_cache.pop('couple', None)  # WebSocket 模式下不走 /sync，缓存的情侣状态可能已过期
+        self.get_couple_status()
+        self.fetch_friends_status()
+    
+    def _handle_section_changed(self, frame):
+        """WebSocket 推送的数据分区变化：接受申请、改昵称、解除关系后刷新好友和情侣状态
+        
+        新的申请本身作为消息推送，这里不用处理申请列表分区。
+        """
+        if frame.get('section') == 'couple':
+            self._refresh_statuses()
+        elif frame.get('section') == 'friends':
+            self.fetch_friends_status()
+    
+    def _handle_presence(self, frame):
+        """处理好友/情侣上下线通知"""
+        user_id = frame['user_id']
+        # 通知同时发给好友和情侣；只是情侣、不是好友时只发情侣信号
+        if user_id in self.friend_online or user_id != self.couple_partner_id:
+            self._apply_status(frame, self.friend_online, self.friend_status_changed)
+        if user_id == self.couple_partner_id:
+            self._apply_status(frame, self.couple_online, self.couple_status_changed)
+    
+    def fetch_friends_status(self):
+        """拉取好友/情侣状态 - 首次为完整列表，之后只拉取有变化的好友
+        
+        在线状态与上次通知的不同时发出 friend_status_changed / couple_status_changed。
+        """
+        if not self.user_id:
+            return
+            
+        params = {'user_id': self.user_id}
+        if 'friends_delta' in self.server_features and self.friends_status_version:
+            params['since'] = self.friends_status_version
+        try:
+            status, data = self._get_json("/friends_status", params)
+            
+            if status != 200:
+                print(f"获取好友状态失败: {data}")
+                return
+                
+            entries = list(data.get('friends', []))
+            couple_entries = [data['couple']] if 'couple' in data else []
+            if data.get('full', True):
+                # 完整列表里没有的好友和情侣视为已删除
+                for listed, known in ((entries, self.friend_online), (couple_entries, self.couple_online)):
+                    listed_ids = {entry['user_id'] for entry in listed}
+                    listed.extend([{'user_id': user_id, 'removed': True}
+                                   for user_id in known if user_id not in listed_ids])
+                
+            for entry in entries:
+                self._apply_status(entry, self.friend_online, self.friend_status_changed)
+            for entry in couple_entries:
+                self._apply_status(entry, self.couple_online, self.couple_status_changed)
+            self.friends_status_version = data.get('version', 0)
+            
+        except Exception as e:
+            print(f"获取好友状态异常: {e}")
+    
+    def _apply_status(self, entry, known, signal):
+        """记录一个好友/情侣的在线状态，与上次通知的不同时发出信号"""
+        user_id = entry['user_id']
+        if entry.get('removed'):
+            previous = known.pop(user_id, None)
+            if previous:
+                signal.emit(user_id, False)
+            return
+        online = bool(entry.get('online'))
+        if known.get(user_id) != online:
+            known[user_id] = online
+            signal.emit(user_id, online)
+    
+    def _stream_loop(self):
+        """SSE 接收循环 - 断线后带 Last-Event-ID 重连，从断点继续接收
+        
+        连续 STREAM_MAX_FAILURES 次连不上时返回，由调用方退回轮询。
+        """
+        failures = 0
+        reconnect = False
+        while self.running and self.user_id and failures < STREAM_MAX_FAILURES:
+            if reconnect:
+                self._detect_server_features()  # 服务器重启过时旧的 Last-Event-ID 作废
+            reconnect = True
+            headers = {'Accept': 'text/event-stream'}
+            if self.last_message_seq:
+                headers['Last-Event-ID'] = str(self.last_message_seq)
+            try:
+                with requests.get(f"{self.server_url}/stream", 
+                                  params={'user_id': self.user_id, 'boot': self.server_boot or ''},
+                                  headers=headers, stream=True,
+                                  timeout=(10, STREAM_READ_TIMEOUT)) as response:
+                    if response.status_code == 503:
+                        print("消息流连接数已满，改用长轮询")
+                        return
+                    if response.status_code != 200:
+                        print(f"连接消息流失败: {response.text}")
+                        failures += 1
+                        time.sleep(POLL_INTERVAL)
+                        continue
+                    
+                    print("📡 已连接消息流")
+                    self._check_boot(response.headers.get('X-Boot-Id'))
+                    failures = 0
+                    response.encoding = 'utf-8'
+                    data_lines = []
+                    # chunk_size=1: 不等缓冲区填满，事件一到就处理
+                    for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                        if not self.running:
+                            return
+                        if line:
+                            if line.startswith(':'):
+                                # 保活注释：顺便补发宠物动作的缺口、拉取好友状态的变化
+                                self._flush_gaps()
+                                self.fetch_friends_status()
+                            elif line.startswith('data:'):
+                                data_lines.append(line[5:].lstrip())
+                            continue
+                        # 空行表示一个事件结束
+                        if data_lines:
+                            self._handle_message(json.loads('\n'.join(data_lines)))
+                            data_lines = []
+                            self._maybe_ack()
+                            
+            except Exception as e:
+                print(f"消息流异常: {e}")
+                failures += 1
+                time.sleep(POLL_INTERVAL)
+        
+        if self.running:
+            print("⚠️ 消息流不可用，退回轮询")
+    
+    def _maybe_ack(self):
+        """SSE 模式下定期确认已处理的消息，让服务器释放它们"""
+        if 'ack' not in self.server_features or self.last_message_seq <= self.acked_seq:
+            return
+        if time.time() - self.last_ack_time < ACK_INTERVAL:
+            return
+            
+        try:
+            response = requests.post(f"{self.server_url}/ack", 
+                                   json={'user_id': self.user_id, 'seq': self.last_message_seq,
+                                         'boot': self.server_boot}, timeout=5)
+            if response.status_code == 200:
+                self.acked_seq = self.last_message_seq
+        except Exception as e:
+            print(f"确认消息异常: {e}")
+        self.last_ack_time = time.time()
+    
+    def _handle_message(self, message):
+        """处理一条服务器消息"""
+        self.last_message_timestamp = max(self.last_message_timestamp, message['timestamp'])
+        self.last_message_seq = max(self.last_message_seq, message.get('seq', 0))
+        
+        if message['type'] == 'friend_request':
+            self.friend_request_received.emit(
+                message['from_user_id'],
+                message['from_user_name'],
+                message['message']
+            )
+        elif message['type'] == 'couple_request':
+            self.couple_request_received.emit(
+                message['from_user_id'],
+                message['from_user_name'],
+                message['message']
+            )
+        elif message['type'] == 'friend_accepted':
+            print(f"✅ 收到好友申请接受通知: {message['from_user_name']}")
+        elif message['type'] == 'couple_accepted':
+            print(f"💕 收到情侣申请接受通知: {message['from_user_name']}")
+        elif message['type'] == 'couple_rejected':
+            print(f"💔 收到情侣申请拒绝通知: {message['from_user_name']}")
+        elif message['type'] == 'summary':
+            # 离线太久信箱溢出时，服务器把最早的消息合并成一条摘要
+            print(f"📦 {message['count']} 条较早的消息已被合并: {message['types']}")
+        elif message['type'] == 'pet_action':
+            if message.get('sender_seq') is not None:
+                self._check_sender_seq(message['from_user_id'], message['sender_seq'], message.get('superseded', ()))
+            self._apply_pet_action(message)
+    
+    def _check_sender_seq(self, sender_id, sender_seq, superseded=()):
+        """检查发送者序号是否连续，缺口先记下，这一批消息处理完后由 _flush_gaps 请求补发
+        
+        信箱合并掉的状态类动作列在取代它的消息的 superseded 里，不算缺口；
+        取代它的消息可能排在缺口之后，所以不立即补发。
+        """
+        last = self.pet_action_seqs.get(sender_id)
+        gaps = self.sender_gaps.get(sender_id, [])
+        if last is not None and sender_seq > last + 1:
+            gaps.append([last + 1, sender_seq - 1])
+        for first, end in superseded:
+            gaps = _subtract_range(gaps, first, end)
+        if gaps:
+            self.sender_gaps[sender_id] = gaps
+        else:
+            self.sender_gaps.pop(sender_id, None)
+        if last is None or sender_seq > last:
+            self.pet_action_seqs[sender_id] = sender_seq
+    
+    def _flush_gaps(self):
+        """请求补发记下的宠物动作缺口"""
+        gaps, self.sender_gaps = self.sender_gaps, {}
+        for sender_id, ranges in gaps.items():
+            for first, last in ranges:
+                print(f"⚠️ 宠物动作序号缺口: {sender_id} {first}-{last}")
+                self._request_resend(sender_id, first, last)
+    
+    def _request_resend(self, sender_id, first, last):
+        """请求服务器补发 [first, last] 区间内仍然有效的宠物动作"""
+        if 'resend' not in self.server_features:
+            return
+            
+        try:
+            response = requests.get(f"{self.server_url}/resend", 
+                                  params={
+                                      'user_id': self.user_id,
+                                      'from_user_id': sender_id,
+                                      'first': first,
+                                      'last': last
+                                  }, timeout=10)
             
-            time.sleep(5)  # 5秒轮询一次
+            if response.status_code != 200:
+                print(f"请求补发失败: {response.text}")
+                return
+                
+            resent = response.json().get('messages', [])
+            print(f"🔁 补发宠物动作 {len(resent)} 条")
+            for message in resent:
+                self._apply_pet_action(message)
+                
+        except Exception as e:
+            print(f"请求补发异常: {e}")
+    
+    def _apply_pet_action(self, message):
+        """应用一条宠物动作
+        
+        改变状态的动作带 state_version：已经包含在宠物状态快照里、或者同一只宠物的同一项状态
+        已应用过更新版本的动作不再应用；版本号按 (宠物, 动作类型) 分别记录，补发的旧动作不会被别的字段挡掉。
+        """
+        # 解析宠物动作消息
+        try:
+            pet_action_data = message['message'].split(':')
+            if len(pet_action_data) == 3:
+                pet_id = int(pet_action_data[0])
+                action_type = pet_action_data[1]
+                action_data = pet_action_data[2]
+                state_version = message.get('state_version')
+                if state_version is not None:
+                    field = (pet_id, action_type)
+                    if state_version <= max(self.pet_state_version, self.pet_field_versions.get(field, 0)):
+                        return
+                    self.pet_field_versions[field] = state_version
+                print(f"🐕 收到宠物动作: pet_id={pet_id}, type={action_type}, data={action_data}")
+                self.pet_action_received.emit(pet_id, action_type, action_data)
+            else:
+                print(f"⚠️ 宠物动作消息格式错误: {message['message']}")
+        except Exception as e:
+            print(f"❌ 解析宠物动作消息失败: {e}")
     
     def disconnect(self):
         """断开连接"""
         self.running = False
+        socket = self.socket
+        if socket is not None:
+            socket.close()
         if self.polling_thread and self.polling_thread.is_alive():
             self.polling_thread.join(timeout=1) 
@@ -4,7 +4,7 @@
 好友搜索和申请对话框
 """
 
-from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
+from PyQt5.QtWidgets import (QApplication, QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
                              QLineEdit, QPushButton, QTextEdit, QGroupBox,
                              QMessageBox, QListWidget, QListWidgetItem)
 from PyQt5.QtCore import Qt, pyqtSignal
@@ -24,7 +24,7 @@ class FriendSearchDialog(QDialog):
     def init_ui(self):
         """初始化用户界面"""
         self.setWindowTitle("好友搜索")
-        self.setFixedSize(500, 400)
+        self.setFixedSize(500, 500)
         
         layout = QVBoxLayout()
         
@@ -34,9 +34,10 @@ class FriendSearchDialog(QDialog):
         
         # 搜索输入
         search_input_layout = QHBoxLayout()
-        search_input_layout.addWidget(QLabel("用户ID:"))
+        search_input_layout.addWidget(QLabel("昵称/ID:"))
         self.search_edit = QLineEdit()
-        self.search_edit.setPlaceholderText("输入要搜索的用户ID")
+        self.search_edit.setPlaceholderText("输入昵称或用户ID（可只输入开头部分）")
+        self.search_edit.returnPressed.connect(self.search_user)
         search_input_layout.addWidget(self.search_edit)
         
         self.search_button = QPushButton("搜索")
@@ -46,9 +47,14 @@ class FriendSearchDialog(QDialog):
         search_layout.addLayout(search_input_layout)
         
         # 搜索结果
-        self.result_label = QLabel("输入用户ID进行搜索")
+        self.result_label = QLabel("输入昵称或用户ID进行搜索")
         search_layout.addWidget(self.result_label)
         
+        self.results_list = QListWidget()
+        self.results_list.setMaximumHeight(100)
+        self.results_list.currentRowChanged.connect(self.select_result)
+        search_layout.addWidget(self.results_list)
+        
         search_group.setLayout(search_layout)
         layout.addWidget(search_group)
         
@@ -103,28 +109,29 @@ class FriendSearchDialog(QDialog):
         
         # 初始化数据
         self.current_user = None
+        self.search_results = []
         self.refresh_friends_list()
         
     def search_user(self):
         """搜索用户"""
-        user_id = self.search_edit.text().strip()
+        query = self.search_edit.text().strip()
         
-        if not user_id:
-            QMessageBox.warning(self, "提示", "请输入用户ID")
+        if not query:
+            QMessageBox.warning(self, "提示", "请输入昵称或用户ID")
             return
             
         try:
-            # 调用网络管理器搜索用户
-            search_result = self.network_manager.search_user(user_id)
+            # 调用网络管理器搜索用户，结果按匹配程度排序
+            self.search_results = self.network_manager.search_users(query)
             
-            if search_result and search_result.get('found', False):
-                user_data = search_result.get('user', {})
-                self.current_user = {
-                    'user_id': user_data.get('user_id', user_id),
-                    'user_name': user_data.get('user_name', user_id)
-                }
-                self.result_label.setText(f"找到用户: {self.current_user['user_name']} ({user_id})")
-                self.send_request_button.setEnabled(True)
+            self.results_list.clear()
+            for user_data in self.search_results:
+                user_id = user_data.get('user_id', '')
+                self.results_list.addItem(QListWidgetItem(f"{user_data.get('user_name', user_id)} ({user_id})"))
+                
+            if self.search_results:
+                self.result_label.setText(f"找到 {len(self.search_results)} 个用户，请选择")
+                self.results_list.setCurrentRow(0)
             else:
                 self.result_label.setText("未找到用户")
                 self.send_request_button.setEnabled(False)
@@ -133,6 +140,21 @@ class FriendSearchDialog(QDialog):
         except Exception as e:
             QMessageBox.warning(self, "搜索失败", f"搜索用户时出错: {e}")
             
+    def select_result(self, row):
+        """选中搜索结果中的一个用户"""
+        if row < 0 or row >= len(self.search_results):
+            self.current_user = None
+            self.send_request_button.setEnabled(False)
+            return
+            
+        user_data = self.search_results[row]
+        self.current_user = {
+            'user_id': user_data.get('user_id'),
+            'user_name': user_data.get('user_name', user_data.get('user_id'))
+        }
+        self.result_label.setText(f"选中用户: {self.current_user['user_name']} ({self.current_user['user_id']})")
+        self.send_request_button.setEnabled(True)
+            
     def send_friend_request(self):
         """发送好友申请"""
         if not self.current_user:
@@ -149,7 +171,8 @@ class FriendSearchDialog(QDialog):
             
             # 清空搜索
             self.search_edit.clear()
-            self.result_label.setText("输入用户ID进行搜索")
+            self.results_list.clear()
+            self.result_label.setText("输入昵称或用户ID进行搜索")
             self.send_request_button.setEnabled(False)
             self.current_user = None
             
@@ -165,15 +188,18 @@ class FriendSearchDialog(QDialog):
             # 从网络管理器获取真实好友列表
             self.friends_list.clear()
             
-            friends = self.network_manager.get_friends_list()
-            if friends:
+            # 逐页显示，每页显示完先处理界面事件再请求下一页
+            count = 0
+            for friends in self.network_manager.iter_friends_pages():
                 for friend in friends:
                     # 服务器返回的是 user_id 和 user_name，需要适配
                     friend_name = friend.get('user_name', friend.get('name', '未知用户'))
                     friend_id = friend.get('user_id', friend.get('id', '未知ID'))
                     item = QListWidgetItem(f"{friend_name} ({friend_id})")
                     self.friends_list.addItem(item)
-            else:
+                count += len(friends)
+                QApplication.processEvents()
+            if not count:
                 item = QListWidgetItem("暂无好友")
                 item.setFlags(item.flags() & ~Qt.ItemIsSelectable)
                 self.friends_list.addItem(item)
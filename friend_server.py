@@ -5,22 +5,314 @@
 包含好友申请、情侣配对等所有功能
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+import base64
 import json
+import math
 import time
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from collections import defaultdict
+from message_store import BOOT_ID, BroadcastLog, MailboxTable, RequestIndex, SenderLog, committed_seq, next_version
+from ws_gateway import PushGateway
+from retention import RetentionSweeper
+from idempotency import IdempotencyCache
+from presence import PresenceTracker
+from friend_view import FriendView, FriendViewCache
+from search_index import UserSearchIndex
+from friend_graph import FriendGraph
+from user_store import UserTable
 
 app = Flask(__name__)
 
-# 存储用户数据
-users = {}  # user_id -> user_data
-friends = defaultdict(set)  # user_id -> set of friend_ids
-friend_requests = defaultdict(list)  # user_id -> list of pending friend requests
-couple_requests = defaultdict(list)  # user_id -> list of pending couple requests
-couples = {}  # user_id -> couple_partner_id (双向关系)
-messages = defaultdict(list)  # user_id -> list of messages
+# 存储用户数据：用户表与好友关系图共用用户的内部编号，好友关系存成紧凑的邻接数组，情侣关系在用户表里
+users = UserTable()  # user_id -> UserRecord
+friend_graph = FriendGraph(numbering=users)  # 好友关系，也用于按共同好友数推荐好友
+
+# 屏蔽关系：user_id -> 被该用户屏蔽的 user_id 集合，发申请和定向消息前用哈希查找检查
+blocked_users = {}
+
+# 最近读取过好友列表的用户的视图（昵称和在线状态）预先编码好，好友变化时增量更新；
+# 其他用户读取时从好友关系图现建，FRIEND_VIEW_CACHE_SIZE 为最多保留的视图数
+FRIEND_VIEW_CACHE_SIZE = int(os.environ.get('FRIEND_VIEW_CACHE_SIZE', 10000))
+friend_views = FriendViewCache(lambda user_id: _build_friend_view(user_id), FRIEND_VIEW_CACHE_SIZE)
+views_lock = threading.Lock()  # 读取最新状态并写入视图的过程串行执行，后到的更新不会被旧状态覆盖
+
+# 按昵称和用户ID搜索用户的索引，注册和改昵称时更新；SEARCH_PAGE_SIZE 为不指定 limit 时每页的条数
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+search_index = UserSearchIndex()
+
+# 推荐好友时不指定 limit 返回的个数
+SUGGESTION_LIMIT = int(os.environ.get('SUGGESTION_LIMIT', 10))
+
+# 每个用户信箱最多保留的消息条数，所有信箱合计最多保留的条数（0 表示不限），
+# 以及信箱满时的处理策略：drop_oldest / drop_newest / summarize
+MAILBOX_CAPACITY = int(os.environ.get('MAILBOX_CAPACITY', 1000))
+MAILBOX_GLOBAL_CAPACITY = int(os.environ.get('MAILBOX_GLOBAL_CAPACITY', 200000))
+MAILBOX_OVERFLOW_POLICY = os.environ.get('MAILBOX_OVERFLOW_POLICY', 'drop_oldest')
+messages = MailboxTable(MAILBOX_CAPACITY, MAILBOX_OVERFLOW_POLICY, MAILBOX_GLOBAL_CAPACITY)  # user_id -> Mailbox
+
+# 待处理的好友/情侣申请，申请记录与信箱里的通知是同一条
+friend_requests = RequestIndex('friend_request', messages)
+couple_requests = RequestIndex('couple_request', messages)
+
+# 不指定目标的广播消息只写一份到发送者自己的广播日志，好友读取时再合并（读时扇出）
+BROADCAST_CAPACITY = int(os.environ.get('BROADCAST_CAPACITY', 1000))
+broadcasts = {}  # user_id -> BroadcastLog；成为好友时的序号记在好友关系图的边上，更早的广播不投递给新好友
+
+# 各类数据的保留秒数，超过后由后台清理线程删除；notification 指其余所有消息类型
+RETENTION_TTLS = {
+    'notification': float(os.environ.get('NOTIFICATION_TTL', 7 * 86400)),
+    'pet_action': float(os.environ.get('PET_ACTION_TTL', 86400)),
+    'friend_request': float(os.environ.get('FRIEND_REQUEST_TTL', 30 * 86400)),
+    'couple_request': float(os.environ.get('COUPLE_REQUEST_TTL', 30 * 86400))
+}
+# 清理间隔秒数（0 表示不清理）和单个时间片的毫秒数
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 60))
+RETENTION_SLICE_MS = float(os.environ.get('RETENTION_SLICE_MS', 5))
+
+# 状态类宠物动作只有最新一条有意义，对方还没确认的旧动作会被新动作取代；
+# interaction 等一次性动作逐条保留
+COALESCED_PET_ACTIONS = ('emotion', 'control')
+
+# 情侣共同的宠物状态，服务器端保存最新值，重新登录的客户端不用回放历史动作
+# (user_id, partner_id) 排序后的二元组 -> {'base': 创建时的序号, 'fields': {(pet_id, 字段): (值, 版本号)}}
+pet_states = {}
+PET_IDS = ('1', '2')
+PET_STATE_FIELDS = {'emotion': 'emotion', 'control': 'owner'}  # 动作类型 -> 状态字段
+
+# 每个发送者的宠物动作序号和最近的动作历史，接收方发现序号缺口时只补发缺失的区间
+PET_ACTION_HISTORY = int(os.environ.get('PET_ACTION_HISTORY', 200))
+pet_action_logs = {}  # user_id -> SenderLog
+
+# 当前挂起长轮询 / SSE 的用户及其连接数，广播时只需唤醒这些好友
+listening = defaultdict(int)
+listening_lock = threading.Lock()
+
+# 在线状态：每 PRESENCE_TICK 秒检查一次，连续 PRESENCE_MISSED_HEARTBEATS 个间隔没有任何请求的用户下线
+PRESENCE_TICK = float(os.environ.get('PRESENCE_TICK', 5))
+PRESENCE_MISSED_HEARTBEATS = int(os.environ.get('PRESENCE_MISSED_HEARTBEATS', 3))
+
+# 分页接口单页最多返回的条数
+PAGE_MAX_LIMIT = int(os.environ.get('PAGE_MAX_LIMIT', 500))
+
+# 长轮询单次最长挂起秒数
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', 30))
+
+# SSE 连接空闲时发送保活注释的间隔秒数
+SSE_KEEPALIVE = float(os.environ.get('SSE_KEEPALIVE', 15))
+
+# 同时打开的 SSE 消息流上限：每条消息流一直占着一个工作线程，要给其他请求留出线程
+# （gthread 部署时应小于 --threads）；达到上限后首页不再声明 sse，新的 /stream 返回 503，客户端改用长轮询
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 32))
+sse_streams = 0
+sse_lock = threading.Lock()
+
+# WebSocket 推送网关端口，0 表示不启动；WS_PUBLIC_URL 为客户端可访问的网关地址（可选）
+WS_PORT = int(os.environ.get('WS_PORT', 0))
+WS_PUBLIC_URL = os.environ.get('WS_PUBLIC_URL')
+
+# 带 Idempotency-Key 的 POST 请求的成功响应保存条数和秒数，重试时直接返回保存的结果
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+# 每个用户各数据分区的版本号：user_id -> {section: version}
+# 版本号来自 next_version()，不占用消息序号；/sync 只返回客户端版本号与服务器不一致的分区
+SYNC_SECTIONS = ('friends', 'couple', 'friend_requests', 'couple_requests')
+section_versions = defaultdict(dict)
+
+# 每个用户看到的好友/情侣变化（上下线、改昵称、新加好友、配对）：user_id -> {变化的用户: 变化时的序号}
+# 每次变化都移到末尾，所以按序号递增排列；/friends_status?since= 从末尾往前读到 since 为止，
+# 开销与变化的数量成正比，与好友数量无关
+status_changes = defaultdict(dict)
+status_lock = threading.Lock()
+
+def _record_status_change(watcher_id, user_id):
+    """watcher_id 看到的 user_id 有变化，记入 watcher_id 的变化日志"""
+    with status_lock:
+        changes = status_changes[watcher_id]
+        changes.pop(user_id, None)
+        changes[user_id] = next_version()
+
+def _bump(user_id, section, push=True):
+    """用户的某个数据分区发生变化：更新版本号并唤醒该用户挂起的 /sync
+    
+    WebSocket 客户端不调用 /sync，push 为真时再推送一帧 section_changed 让它重新拉取；
+    上下线引起的变化已经有 presence 帧，不再重复推送。
+    """
+    version = section_versions[user_id][section] = next_version()
+    messages[user_id].poke()
+    if push:
+        push_gateway.push(user_id, {'type': 'section_changed', 'section': section,
+                                    'version': version, 'timestamp': time.time()})
+
+def _bump_version(user_id, key):
+    """只用于 ETag 的版本号（不在 /sync 分区里），更新时不唤醒 /sync"""
+    section_versions[user_id][key] = next_version()
+
+def _build_friend_view(user_id):
+    """从好友关系图现建用户的好友列表视图（在 views_lock 下调用）"""
+    view = FriendView()
+    for friend_id in friend_graph.friends_of(user_id):
+        view.put(friend_id, users[friend_id].user_name, presence.is_online(friend_id))
+    return view
+
+def _friend_view(user_id):
+    """用户的好友列表视图，不在缓存里时现建"""
+    with views_lock:
+        return friend_views.get(user_id)
+
+def _refresh_views(user_id):
+    """用用户当前的昵称和在线状态更新已缓存的好友的好友列表视图"""
+    with views_lock:
+        user_name = users[user_id].user_name
+        online = presence.is_online(user_id)
+        for friend_id in friend_graph.friends_of(user_id):
+            view = friend_views.peek(friend_id)
+            if view is not None:
+                view.put(user_id, user_name, online)
+
+def _bump_watchers(user_id, push=True):
+    """用户昵称或在线状态变化：好友的好友列表、情侣的情侣状态、搜索结果随之变化"""
+    _bump_version(user_id, 'profile')
+    _refresh_views(user_id)
+    for friend_id in friend_graph.friends_of(user_id):
+        _bump(friend_id, 'friends', push)
+        _record_status_change(friend_id, user_id)
+    partner_id = users.partner(user_id)
+    if partner_id is not None:
+        _bump(partner_id, 'couple', push)
+        _record_status_change(partner_id, user_id)
+
+def _conditional(tag, build):
+    """带 ETag 的只读响应
+    
+    tag 由资源名和版本号组成，必须在生成数据之前取得；客户端 If-None-Match 与之一致时
+    直接返回 304，不调用 build 生成和序列化响应体。build 可以返回编码好的字节串。
+    """
+    etag = f'{BOOT_ID}-{tag}'  # 带上本次运行的标识，服务器重启后旧的 ETag 不会误命中
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = build()
+        if isinstance(body, bytes):
+            response = app.response_class(body, mimetype='application/json')
+        else:
+            response = jsonify(body)
+    response.set_etag(etag)
+    return response
+
+def _encode_cursor(position):
+    """分页游标：把上一页最后一条的位置编码成不透明字符串"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def _page_args(position_type, limit=None, cursor=None):
+    """解析分页参数 limit 和 cursor，返回 (limit, 游标位置)；不分页时 limit 为 None
+    
+    默认从查询参数读取；游标位置的类型与 position_type 不符或参数格式错误时抛出 ValueError。
+    """
+    if limit is None:
+        limit = request.args.get('limit')
+    if cursor is None:
+        cursor = request.args.get('cursor')
+    if limit is not None:
+        limit = min(int(limit), PAGE_MAX_LIMIT)
+        if limit <= 0:
+            raise ValueError('limit 必须大于 0')
+    position = None
+    if cursor:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(position, position_type) or isinstance(position, bool):
+            raise ValueError('无效的游标')
+    return limit, position
+
+def _wait_seconds(wait):
+    """解析长轮询的 wait 参数，限制在 [0, LONG_POLL_MAX_WAIT] 内；NaN、无穷大等抛出 ValueError"""
+    wait = float(wait)
+    if not math.isfinite(wait):
+        raise ValueError('wait 必须是有限的数')
+    return min(max(wait, 0), LONG_POLL_MAX_WAIT)
+
+# 请求 environ 中记录本次请求登记的幂等键；/batch 的子操作共用外层的 g，所以不放在 g 里
+IDEMPOTENCY_ENVIRON_KEY = 'heartpet.idempotency_key'
+
+def _request_user_id():
+    """发起请求的用户：查询参数或请求体里的 user_id，发申请的接口用 from_user_id"""
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    if not isinstance(data, dict):
+        data = {}
+    user_id = request.args.get('user_id') or data.get('user_id') or data.get('from_user_id')
+    return user_id if isinstance(user_id, str) else None
+
+@app.before_request
+def _idempotent_replay():
+    """带 Idempotency-Key 的 POST：已成功处理过的直接返回保存的响应，不再执行处理函数
+    
+    键按 (用户, 路径, Idempotency-Key) 区分，不同用户碰巧用了同一个键也不会拿到别人的响应。
+    """
+    key = request.headers.get('Idempotency-Key')
+    if request.method != 'POST' or not key:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return jsonify({'error': 'Idempotency-Key 过长'}), 400
+        
+    key = (_request_user_id(), request.path, key)
+    state, cached = idempotency_cache.begin(key)
+    if state == 'replay':
+        status, body, mimetype = cached
+        response = app.response_class(body, status=status, mimetype=mimetype)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    if state == 'pending':
+        return jsonify({'error': '相同的请求正在处理'}), 409
+    request.environ[IDEMPOTENCY_ENVIRON_KEY] = key
+    return None
+
+@app.after_request
+def _idempotent_store(response):
+    """保存成功的响应；失败的请求没有修改数据，不保存，客户端换格式重试时重新执行"""
+    key = request.environ.get(IDEMPOTENCY_ENVIRON_KEY)
+    if key is not None and 200 <= response.status_code < 300:
+        idempotency_cache.store(key, (response.status_code, response.get_data(), response.mimetype))
+    return response
+
+@app.teardown_request
+def _idempotent_release(exc):
+    """请求结束（包括抛出异常）时释放幂等键，唤醒等待同一个键的重试请求"""
+    key = request.environ.pop(IDEMPOTENCY_ENVIRON_KEY, None)
+    if key is not None:
+        idempotency_cache.finish(key)
+
+# 请求体中表示用户ID的字段
+USER_ID_FIELDS = ('user_id', 'from_user_id', 'to_user_id', 'target_user_id', 'friend_id')
+
+@app.before_request
+def _canonical_user_ids():
+    """把请求体里已注册用户的 ID 换成用户表里保存的那一份，
+    写入申请、消息、好友视图等处的 ID 都引用同一个字符串，不再各存一份"""
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    if isinstance(data, dict):
+        for field in USER_ID_FIELDS:
+            value = data.get(field)
+            if isinstance(value, str):
+                data[field] = users.canonical(value)
+
+# 这些接口的 user_id 参数不是调用者本人，不算心跳
+PRESENCE_EXEMPT_ENDPOINTS = {'search_user'}
+
+@app.after_request
+def _presence_heartbeat(response):
+    """任何带 user_id 的请求都算一次心跳（发申请的接口用 from_user_id），客户端不用单独发 /heartbeat"""
+    if request.endpoint in PRESENCE_EXEMPT_ENDPOINTS:
+        return response
+    user_id = _request_user_id()
+    if user_id is not None and user_id in users:
+        presence.touch(users.canonical(user_id))
+    return response
 
 @app.route('/register_user', methods=['POST'])
 def register_user():
@@ -32,16 +324,15 @@ def register_user():
     if not user_id or not user_name:
         return jsonify({'error': '缺少必要参数'}), 400
         
-    if user_id in users:
-        return jsonify({'error': '用户ID已存在'}), 400
+    if not isinstance(user_id, str) or not isinstance(user_name, str):
+        return jsonify({'error': '参数格式错误'}), 400
         
-    # 存储用户信息
-    users[user_id] = {
-        'user_id': user_id,
-        'user_name': user_name,
-        'online': True,
-        'last_seen': time.time()
-    }
+    # 存储用户信息（查重和加入在用户表的锁内一起完成）
+    record = users.add(user_id, user_name)
+    if record is None:
+        return jsonify({'error': '用户ID已存在'}), 400
+    user_id = record.user_id
+    search_index.put(user_id, user_name)
     
     return jsonify({
         'message': '注册成功',
@@ -58,19 +349,22 @@ def login_user():
     if not user_id or not user_name:
         return jsonify({'error': '缺少必要参数'}), 400
         
-    # 如果用户不存在，自动注册
+    if not isinstance(user_id, str) or not isinstance(user_name, str):
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    # 如果用户不存在，自动注册；并发登录时只有一个请求加入成功
     if user_id not in users:
-        users[user_id] = {
-            'user_id': user_id,
-            'user_name': user_name,
-            'online': True,
-            'last_seen': time.time()
-        }
+        record = users.add(user_id, user_name)
+        if record is not None:
+            search_index.put(record.user_id, user_name)
+        user_id = users.canonical(user_id)
         
-    # 更新用户状态
-    users[user_id]['online'] = True
-    users[user_id]['last_seen'] = time.time()
-    users[user_id]['user_name'] = user_name  # 允许更新昵称
+    # 更新用户状态（在线状态由 _presence_heartbeat 记录）
+    renamed = users[user_id].user_name != user_name
+    users[user_id].user_name = user_name  # 允许更新昵称
+    if renamed:
+        _bump_watchers(user_id)
+        search_index.put(user_id, user_name)
     
     return jsonify({
         'message': '登录成功',
@@ -79,20 +373,66 @@ def login_user():
 
 @app.route('/search_user', methods=['GET'])
 def search_user():
-    """搜索用户"""
+    """搜索用户
+    
+    带 user_id 时按用户ID精确查找；带 q 时按昵称和用户ID前缀、昵称模糊匹配搜索，
+    返回排好序的 users 列表，支持 limit + cursor 分页。
+    带 from_user_id（搜索者）时，与搜索者之间有屏蔽关系的用户查不到。
+    """
+    searcher_id = request.args.get('from_user_id')
+    if 'q' in request.args:
+        return _search_users(request.args['q'], searcher_id)
+        
     user_id = request.args.get('user_id')
     
     if not user_id:
         return jsonify({'error': '缺少用户ID'}), 400
         
-    if user_id in users:
-        user_data = users[user_id].copy()
-        # 不返回敏感信息
-        user_data.pop('last_seen', None)
-        return jsonify({'user': user_data})
+    if user_id in users and not (searcher_id and _blocked(searcher_id, user_id)):
+        def build():
+            user_data = users[user_id].to_dict()
+            user_data['online'] = presence.is_online(user_id)
+            return {'user': user_data}
+        return _conditional(f"user-{section_versions[user_id].get('profile', 0)}", build)
     else:
         return jsonify({'error': '用户不存在'}), 404
 
+def _search_users(query, searcher_id=None):
+    """按搜索词返回一页用户，游标为已返回的结果数；不返回与搜索者之间有屏蔽关系的用户"""
+    if not query.strip():
+        return jsonify({'error': '缺少搜索关键词'}), 400
+        
+    try:
+        limit, offset = _page_args(int)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    offset = max(offset or 0, 0)
+    exclude = (lambda user_id: _blocked(searcher_id, user_id)) if searcher_id else None
+    user_ids, more = search_index.search(query, offset, limit or SEARCH_PAGE_SIZE, exclude)
+    found = []
+    for user_id in user_ids:
+        user_data = users[user_id].to_dict()
+        user_data['online'] = presence.is_online(user_id)
+        found.append(user_data)
+    return jsonify({
+        'users': found,
+        'next_cursor': _encode_cursor(offset + len(found)) if more else None
+    })
+
+def _blocked(sender_id, recipient_id):
+    """两人中有一方屏蔽了另一方"""
+    blocked = blocked_users.get(recipient_id)
+    if blocked is not None and sender_id in blocked:
+        return True
+    blocked = blocked_users.get(sender_id)
+    return blocked is not None and recipient_id in blocked
+
+def _shared_name(user_id, user_name):
+    """请求里带的昵称与用户表里的相同时返回保存的那一份字符串"""
+    record = users.get(user_id)
+    return record.user_name if record is not None and record.user_name == user_name else user_name
+
 @app.route('/send_friend_request', methods=['POST'])
 def send_friend_request():
     """发送好友申请"""
@@ -105,6 +445,9 @@ def send_friend_request():
     if not all([from_user_id, from_user_name, to_user_id]):
         return jsonify({'error': '缺少必要参数'}), 400
         
+    if _blocked(from_user_id, to_user_id):
+        return jsonify({'error': '无法向该用户发送申请'}), 403
+        
     if to_user_id not in users:
         return jsonify({'error': '目标用户不存在'}), 404
         
@@ -112,35 +455,17 @@ def send_friend_request():
         return jsonify({'error': '不能向自己发送好友申请'}), 400
         
     # 检查是否已经是好友
-    if to_user_id in friends[from_user_id]:
+    if friend_graph.are_friends(from_user_id, to_user_id):
         return jsonify({'error': '已经是好友了'}), 400
         
     # 检查是否已经发送过申请
-    for request_data in friend_requests[to_user_id]:
-        if request_data['from_user_id'] == from_user_id:
-            return jsonify({'error': '已经发送过好友申请'}), 400
-    
-    # 创建好友申请
-    friend_request = {
-        'from_user_id': from_user_id,
-        'from_user_name': from_user_name,
-        'to_user_id': to_user_id,
-        'message': message,
-        'timestamp': time.time()
-    }
-    
-    friend_requests[to_user_id].append(friend_request)
-    
-    # 发送消息通知
-    message_data = {
-        'type': 'friend_request',
-        'from_user_id': from_user_id,
-        'from_user_name': from_user_name,
-        'message': message,
-        'timestamp': time.time()
-    }
+    if friend_requests.find(to_user_id, from_user_id) is not None:
+        return jsonify({'error': '已经发送过好友申请'}), 400
     
-    messages[to_user_id].append(message_data)
+    # 创建好友申请，同时作为消息通知写入对方信箱；昵称与保存的相同时引用保存的那一份
+    friend_requests.submit(from_user_id, _shared_name(from_user_id, from_user_name), to_user_id, message)
+    _bump(to_user_id, 'friend_requests')
+    _bump_version(from_user_id, 'sent_friend_requests')
     
     return jsonify({'message': '好友申请发送成功'})
 
@@ -156,6 +481,9 @@ def send_couple_request():
     if not all([from_user_id, from_user_name, to_user_id]):
         return jsonify({'error': '缺少必要参数'}), 400
         
+    if _blocked(from_user_id, to_user_id):
+        return jsonify({'error': '无法向该用户发送申请'}), 403
+        
     if to_user_id not in users:
         return jsonify({'error': '目标用户不存在'}), 404
         
@@ -163,35 +491,17 @@ def send_couple_request():
         return jsonify({'error': '不能向自己发送情侣申请'}), 400
         
     # 检查是否已经是情侣
-    if from_user_id in couples and couples[from_user_id] == to_user_id:
+    if users.partner(from_user_id) == to_user_id:
         return jsonify({'error': '已经是情侣了'}), 400
         
     # 检查是否已经发送过申请
-    for request_data in couple_requests[to_user_id]:
-        if request_data['from_user_id'] == from_user_id:
-            return jsonify({'error': '已经发送过情侣申请'}), 400
-    
-    # 创建情侣申请
-    couple_request = {
-        'from_user_id': from_user_id,
-        'from_user_name': from_user_name,
-        'to_user_id': to_user_id,
-        'message': message,
-        'timestamp': time.time()
-    }
-    
-    couple_requests[to_user_id].append(couple_request)
-    
-    # 发送消息通知
-    message_data = {
-        'type': 'couple_request',
-        'from_user_id': from_user_id,
-        'from_user_name': from_user_name,
-        'message': message,
-        'timestamp': time.time()
-    }
+    if couple_requests.find(to_user_id, from_user_id) is not None:
+        return jsonify({'error': '已经发送过情侣申请'}), 400
     
-    messages[to_user_id].append(message_data)
+    # 创建情侣申请，同时作为消息通知写入对方信箱
+    couple_requests.submit(from_user_id, _shared_name(from_user_id, from_user_name), to_user_id, message)
+    _bump(to_user_id, 'couple_requests')
+    _bump_version(from_user_id, 'sent_couple_requests')
     
     return jsonify({'message': '情侣申请发送成功'})
 
@@ -226,36 +536,38 @@ def accept_friend_request():
         return jsonify({'error': '申请者不存在'}), 404
         
     # 查找并移除好友申请
-    request_found = False
-    if user_id in friend_requests:
-        for i, request_data in enumerate(friend_requests[user_id]):
-            if request_data['from_user_id'] == from_user_id:
-                friend_requests[user_id].pop(i)
-                request_found = True
-                print(f"DEBUG: 找到并移除好友申请")
-                break
-                
-    if not request_found:
+    if friend_requests.remove(user_id, from_user_id) is None:
         print(f"DEBUG: 未找到好友申请 - user_id: {user_id}, from_user_id: {from_user_id}")
-        print(f"DEBUG: 当前好友申请列表: {friend_requests}")
+        print(f"DEBUG: 当前好友申请列表: {friend_requests.pending_for(user_id)}")
         return jsonify({'error': '未找到好友申请'}), 404
+    print(f"DEBUG: 找到并移除好友申请")
         
     # 建立好友关系
-    friends[user_id].add(from_user_id)
-    friends[from_user_id].add(user_id)
+    friend_graph.add_edge(user_id, from_user_id, committed_seq())
+    with views_lock:
+        for owner_id, friend_id in ((user_id, from_user_id), (from_user_id, user_id)):
+            view = friend_views.peek(owner_id)
+            if view is not None:
+                view.put(friend_id, users[friend_id].user_name, presence.is_online(friend_id))
     print(f"DEBUG: 建立好友关系成功")
     
     # 发送接受通知
     message_data = {
         'type': 'friend_accepted',
         'from_user_id': user_id,
-        'from_user_name': users[user_id]['user_name'],
+        'from_user_name': users[user_id].user_name,
         'message': '已接受你的好友申请',
         'timestamp': time.time()
     }
     
     messages[from_user_id].append(message_data)
     print(f"DEBUG: 发送接受通知成功")
+    _bump(user_id, 'friend_requests')
+    _bump_version(from_user_id, 'sent_friend_requests')
+    _bump(user_id, 'friends')
+    _bump(from_user_id, 'friends')
+    _record_status_change(user_id, from_user_id)
+    _record_status_change(from_user_id, user_id)
     
     return jsonify({'message': '好友申请接受成功'})
 
@@ -290,36 +602,35 @@ def accept_couple_request():
         return jsonify({'error': '申请者不存在'}), 404
         
     # 查找并移除情侣申请
-    request_found = False
-    if user_id in couple_requests:
-        for i, request_data in enumerate(couple_requests[user_id]):
-            if request_data['from_user_id'] == from_user_id:
-                couple_requests[user_id].pop(i)
-                request_found = True
-                print(f"DEBUG: 找到并移除情侣申请")
-                break
-                
-    if not request_found:
+    if couple_requests.remove(user_id, from_user_id) is None:
         print(f"DEBUG: 未找到情侣申请 - user_id: {user_id}, from_user_id: {from_user_id}")
-        print(f"DEBUG: 当前情侣申请列表: {couple_requests}")
+        print(f"DEBUG: 当前情侣申请列表: {couple_requests.pending_for(user_id)}")
         return jsonify({'error': '未找到情侣申请'}), 404
+    print(f"DEBUG: 找到并移除情侣申请")
         
-    # 建立情侣关系
-    couples[user_id] = from_user_id
-    couples[from_user_id] = user_id
+    # 建立情侣关系，宠物状态和宠物动作的补发历史从头开始
+    users.pair(user_id, from_user_id)
+    pet_states.pop(_couple_key(user_id), None)
+    _clear_pet_action_logs(user_id, from_user_id)
     print(f"DEBUG: 建立情侣关系成功")
     
     # 发送接受通知
     message_data = {
         'type': 'couple_accepted',
         'from_user_id': user_id,
-        'from_user_name': users[user_id]['user_name'],
+        'from_user_name': users[user_id].user_name,
         'message': '已接受你的情侣申请',
         'timestamp': time.time()
     }
     
     messages[from_user_id].append(message_data)
     print(f"DEBUG: 发送情侣接受通知成功")
+    _bump(user_id, 'couple_requests')
+    _bump_version(from_user_id, 'sent_couple_requests')
+    _bump(user_id, 'couple')
+    _bump(from_user_id, 'couple')
+    _record_status_change(user_id, from_user_id)
+    _record_status_change(from_user_id, user_id)
     
     return jsonify({'message': '情侣申请接受成功'})
 
@@ -354,33 +665,73 @@ def reject_couple_request():
         return jsonify({'error': '申请者不存在'}), 404
         
     # 查找并移除情侣申请
-    request_found = False
-    if user_id in couple_requests:
-        for i, request_data in enumerate(couple_requests[user_id]):
-            if request_data['from_user_id'] == from_user_id:
-                couple_requests[user_id].pop(i)
-                request_found = True
-                print(f"DEBUG: 找到并移除情侣申请")
-                break
-                
-    if not request_found:
+    if couple_requests.remove(user_id, from_user_id) is None:
         print(f"DEBUG: 未找到情侣申请 - user_id: {user_id}, from_user_id: {from_user_id}")
         return jsonify({'error': '未找到情侣申请'}), 404
+    print(f"DEBUG: 找到并移除情侣申请")
         
     # 发送拒绝通知
     message_data = {
         'type': 'couple_rejected',
         'from_user_id': user_id,
-        'from_user_name': users[user_id]['user_name'],
+        'from_user_name': users[user_id].user_name,
         'message': '已拒绝你的情侣申请',
         'timestamp': time.time()
     }
     
     messages[from_user_id].append(message_data)
     print(f"DEBUG: 发送情侣拒绝通知成功")
+    _bump(user_id, 'couple_requests')
+    _bump_version(from_user_id, 'sent_couple_requests')
     
     return jsonify({'message': '情侣申请拒绝成功'})
 
+def _status_entry(user_id):
+    """好友列表和状态变化里的一项（昵称和在线状态）"""
+    return {
+        'user_id': user_id,
+        'user_name': users[user_id].user_name,
+        'online': presence.is_online(user_id)
+    }
+
+def _friend_list(user_id):
+    """好友列表（昵称和在线状态）"""
+    return _friend_view(user_id).items()
+
+def _status_delta(user_id, since):
+    """since 之后有变化的好友和情侣，已不是好友的标记 removed"""
+    with status_lock:
+        changed = []
+        for changed_id, seq in reversed(status_changes[user_id].items()):
+            if seq <= since:
+                break
+            changed.append(changed_id)
+            
+    partner_id = users.partner(user_id)
+    result = {'friends': []}
+    for changed_id in changed:
+        if changed_id in users and friend_graph.are_friends(user_id, changed_id):
+            result['friends'].append(_status_entry(changed_id))
+        elif changed_id != partner_id:
+            result['friends'].append({'user_id': changed_id, 'removed': True})
+        if changed_id == partner_id and partner_id in users:
+            result['couple'] = _status_entry(partner_id)
+    return result
+
+def _couple_status(user_id):
+    """情侣状态"""
+    partner_id = users.partner(user_id)
+    if partner_id is not None:
+        return {
+            'has_couple': True,
+            'partner': {
+                'user_id': partner_id,
+                'user_name': users[partner_id].user_name,
+                'online': presence.is_online(partner_id)
+            }
+        }
+    return {'has_couple': False}
+
 @app.route('/friends', methods=['GET'])
 def get_friends():
     """获取好友列表"""
@@ -392,16 +743,183 @@ def get_friends():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    friend_list = []
-    for friend_id in friends[user_id]:
-        if friend_id in users:
-            friend_list.append({
-                'user_id': friend_id,
-                'user_name': users[friend_id]['user_name'],
-                'online': users[friend_id]['online']
-            })
-            
-    return jsonify({'friends': friend_list})
+    try:
+        limit, after = _page_args(str)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    version = section_versions[user_id].get('friends', 0)
+    view = _friend_view(user_id)
+    if limit is None:
+        return _conditional(f'friends-{version}', view.response_body)
+        
+    def build():
+        encoded, last = view.page(after, limit)
+        return view.response_body(encoded, next_cursor=_encode_cursor(last) if last is not None else None)
+    return _conditional(f'friends-{version}-{limit}-{request.args.get("cursor", "")}', build)
+
+@app.route('/friend_suggestions', methods=['GET'])
+def get_friend_suggestions():
+    """推荐好友：按共同好友数从多到少排列的非好友，不推荐与用户之间有屏蔽关系的人"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    try:
+        limit = int(request.args.get('limit', SUGGESTION_LIMIT))
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    # 取缓存的全部推荐再去掉屏蔽的，屏蔽的人不占 limit 的名额
+    suggestions = []
+    for candidate_id, mutual_friends in friend_graph.suggestions(user_id):
+        if len(suggestions) >= limit:
+            break
+        if _blocked(user_id, candidate_id):
+            continue
+        suggestions.append({
+            'user_id': candidate_id,
+            'user_name': users[candidate_id].user_name,
+            'mutual_friends': mutual_friends,
+            'online': presence.is_online(candidate_id)
+        })
+    return jsonify({'suggestions': suggestions})
+
+def _unfriend(user_id, friend_id):
+    """删除好友关系，两人的好友列表和状态随之变化"""
+    friend_graph.remove_edge(user_id, friend_id)
+    with views_lock:
+        for owner_id, other_id in ((user_id, friend_id), (friend_id, user_id)):
+            view = friend_views.peek(owner_id)
+            if view is not None:
+                view.remove(other_id)
+    _bump(user_id, 'friends')
+    _bump(friend_id, 'friends')
+    _record_status_change(user_id, friend_id)
+    _record_status_change(friend_id, user_id)
+
+def _clear_pet_action_logs(*user_ids):
+    """情侣关系变化时清空双方的宠物动作历史，/resend 不会把发给旧情侣的动作交给新情侣"""
+    for user_id in user_ids:
+        log = pet_action_logs.get(user_id)
+        if log is not None:
+            log.clear()
+
+def _uncouple(user_id):
+    """解除用户的情侣关系并清除共同的宠物状态，返回原来的情侣，没有情侣时返回 None"""
+    couple_key = _couple_key(user_id)
+    partner_id = users.unpair(user_id)
+    if partner_id is None:
+        return None
+    pet_states.pop(couple_key, None)
+    _clear_pet_action_logs(user_id, partner_id)
+    _bump(user_id, 'couple')
+    _bump(partner_id, 'couple')
+    _record_status_change(user_id, partner_id)
+    _record_status_change(partner_id, user_id)
+    return partner_id
+
+@app.route('/remove_friend', methods=['POST'])
+def remove_friend():
+    """删除好友"""
+    data = request.json
+    user_id = data.get('user_id')
+    friend_id = data.get('friend_id')
+    
+    if not user_id or not friend_id:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if not friend_graph.are_friends(user_id, friend_id):
+        return jsonify({'error': '不是好友'}), 404
+        
+    _unfriend(user_id, friend_id)
+    
+    return jsonify({'message': '已删除好友'})
+
+@app.route('/dissolve_couple', methods=['POST'])
+def dissolve_couple():
+    """解除情侣关系"""
+    data = request.json
+    user_id = data.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    if _uncouple(user_id) is None:
+        return jsonify({'error': '没有情侣'}), 404
+        
+    return jsonify({'message': '已解除情侣关系'})
+
+@app.route('/block_user', methods=['POST'])
+def block_user():
+    """屏蔽用户：解除好友和情侣关系，删除双方之间待处理的申请，之后对方的申请和定向消息都会被拒绝"""
+    data = request.json
+    user_id = data.get('user_id')
+    target_user_id = data.get('target_user_id')
+    
+    if not user_id or not target_user_id:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if user_id not in users or target_user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    if user_id == target_user_id:
+        return jsonify({'error': '不能屏蔽自己'}), 400
+        
+    blocked_users.setdefault(user_id, set()).add(target_user_id)
+    
+    if friend_graph.are_friends(user_id, target_user_id):
+        _unfriend(user_id, target_user_id)
+    if users.partner(user_id) == target_user_id:
+        _uncouple(user_id)
+        
+    for index, section in ((friend_requests, 'friend_requests'), (couple_requests, 'couple_requests')):
+        for to_user_id, from_user_id in ((user_id, target_user_id), (target_user_id, user_id)):
+            if index.withdraw(to_user_id, from_user_id) is not None:
+                _bump(to_user_id, section)
+                _bump_version(from_user_id, 'sent_' + section)
+                
+    return jsonify({'message': '已屏蔽该用户'})
+
+@app.route('/unblock_user', methods=['POST'])
+def unblock_user():
+    """取消屏蔽"""
+    data = request.json
+    user_id = data.get('user_id')
+    target_user_id = data.get('target_user_id')
+    
+    if not user_id or not target_user_id:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    blocked = blocked_users.get(user_id)
+    if blocked is None or target_user_id not in blocked:
+        return jsonify({'error': '没有屏蔽该用户'}), 404
+        
+    blocked.discard(target_user_id)
+    if not blocked:
+        del blocked_users[user_id]
+        
+    return jsonify({'message': '已取消屏蔽'})
+
+@app.route('/blocked_users', methods=['GET'])
+def get_blocked_users():
+    """获取自己屏蔽的用户"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    return jsonify({'blocked': sorted(blocked_users.get(user_id, ()))})
 
 @app.route('/couple_status', methods=['GET'])
 def get_couple_status():
@@ -414,23 +932,128 @@ def get_couple_status():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    if user_id in couples:
-        partner_id = couples[user_id]
-        if partner_id in users:
-            return jsonify({
-                'has_couple': True,
-                'partner': {
-                    'user_id': partner_id,
-                    'user_name': users[partner_id]['user_name'],
-                    'online': users[partner_id]['online']
-                }
-            })
+    version = section_versions[user_id].get('couple', 0)
+    return _conditional(f'couple-{version}', lambda: _couple_status(user_id))
+
+def _couple_key(user_id):
+    """情侣双方排序后的二元组，没有情侣时返回 None"""
+    partner_id = users.partner(user_id)
+    if partner_id is None:
+        return None
+    return (user_id, partner_id) if user_id < partner_id else (partner_id, user_id)
+
+def _pet_state(user_id):
+    """用户所在情侣的宠物状态记录，没有情侣时返回 None"""
+    key = _couple_key(user_id)
+    if key is None:
+        return None
+    state = pet_states.get(key)
+    if state is None:
+        state = pet_states.setdefault(key, {'base': next_version(), 'fields': {}})
+    return state
+
+def _update_pet_state(user_id, message_content):
+    """宠物动作改变了状态（表情、控制者）时更新情侣的宠物状态，返回新版本号"""
+    action = _parse_pet_action(message_content)
+    if action is None or action[0] not in PET_IDS or action[1] not in PET_STATE_FIELDS:
+        return None
+    state = _pet_state(user_id)
+    if state is None:
+        return None
+    version = next_version()
+    state['fields'][(action[0], PET_STATE_FIELDS[action[1]])] = (action[2], version)
+    return version
+
+def _pet_state_view(state, version):
+    """version 之后变化的字段；version 不属于当前状态（早于创建或晚于最新版本）时返回全部字段"""
+    fields = list(state['fields'].items())
+    latest = max([state['base']] + [field_version for _, (_, field_version) in fields])
+    full = version < state['base'] or version > latest
+    pets = {}
+    for (pet_id, field), (value, field_version) in fields:
+        if full or field_version > version:
+            pets.setdefault(pet_id, {})[field] = value
+    return {'version': latest, 'full': full, 'pets': pets}
+
+@app.route('/pet_state', methods=['GET'])
+def get_pet_state():
+    """获取情侣共同的宠物状态
+    
+    不带 version 时返回完整快照；带上次拿到的 version 时只返回之后变化的字段。
+    """
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    try:
+        version = int(request.args.get('version', 0))
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    state = _pet_state(user_id)
+    if state is None:
+        return jsonify({'has_couple': False})
+        
+    # 双方当前的宠物动作序号，客户端从这里开始检测缺口
+    action_seqs = {}
+    for member_id in _couple_key(user_id):
+        log = pet_action_logs.get(member_id)
+        action_seqs[member_id] = log.last_sender_seq if log is not None else 0
+    return jsonify(dict(_pet_state_view(state, version), has_couple=True, action_seqs=action_seqs))
+
+@app.route('/resend', methods=['GET'])
+def resend_pet_actions():
+    """补发情侣的宠物动作 - 只返回发送者序号在 [first, last] 区间内仍然有效的动作"""
+    user_id = request.args.get('user_id')
+    from_user_id = request.args.get('from_user_id')
     
-    return jsonify({'has_couple': False})
+    if not user_id or not from_user_id:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    if users.partner(user_id) != from_user_id:
+        return jsonify({'error': '只能请求情侣的宠物动作'}), 403
+        
+    try:
+        first = int(request.args.get('first', 1))
+        last = int(request.args['last'])
+    except (KeyError, ValueError):
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    log = pet_action_logs.get(from_user_id)
+    if log is None:
+        return jsonify({'messages': [], 'last_sender_seq': 0})
+    return jsonify({'messages': log.resend(first, last), 'last_sender_seq': log.last_sender_seq})
+
+def _request_list(index, user_id):
+    """申请列表接口的公共部分：direction=sent 时列出发出的申请，支持 ETag 和分页（按序号排序）"""
+    try:
+        limit, after = _page_args(int)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    sent = request.args.get('direction') == 'sent'
+    section = ('sent_' if sent else '') + index.kind + 's'  # 与 _bump / _bump_version 的分区名一致
+    version = section_versions[user_id].get(section, 0)
+    if limit is None:
+        records = index.sent_by if sent else index.pending_for
+        return _conditional(f'{section}-{version}', lambda: {'requests': records(user_id)})
+        
+    page = index.sent_page if sent else index.pending_page
+    def build():
+        records, more = page(user_id, after or 0, limit)
+        return {'requests': records, 'next_cursor': _encode_cursor(records[-1]['seq']) if more else None}
+    return _conditional(f'{section}-{version}-{limit}-{request.args.get("cursor", "")}', build)
 
 @app.route('/couple_requests', methods=['GET'])
 def get_couple_requests():
-    """获取情侣申请列表"""
+    """获取情侣申请列表（direction=sent 时返回自己发出的待处理申请）"""
     user_id = request.args.get('user_id')
     
     if not user_id:
@@ -439,11 +1062,11 @@ def get_couple_requests():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    return jsonify({'requests': couple_requests[user_id]})
+    return _request_list(couple_requests, user_id)
 
 @app.route('/friend_requests', methods=['GET'])
 def get_friend_requests():
-    """获取好友申请列表"""
+    """获取好友申请列表（direction=sent 时返回自己发出的待处理申请）"""
     user_id = request.args.get('user_id')
     
     if not user_id:
@@ -452,12 +1075,17 @@ def get_friend_requests():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    return jsonify({'requests': friend_requests[user_id]})
+    return _request_list(friend_requests, user_id)
 
 @app.route('/friends_status', methods=['GET'])
 def get_friends_status():
-    """获取好友在线状态"""
+    """获取好友在线状态
+    
+    带 since=<版本号> 时只返回之后昵称或在线状态有变化的好友（以及情侣），
+    不带或版本号无效时返回完整列表；两种情况都返回当前版本号 version。
+    """
     user_id = request.args.get('user_id')
+    since = request.args.get('since')
     
     if not user_id:
         return jsonify({'error': '缺少用户ID'}), 400
@@ -465,47 +1093,58 @@ def get_friends_status():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    status_list = []
-    for friend_id in friends[user_id]:
-        if friend_id in users:
-            status_list.append({
-                'user_id': friend_id,
-                'user_name': users[friend_id]['user_name'],
-                'online': users[friend_id]['online']
-            })
-            
-    return jsonify({'friends': status_list})
-
-@app.route('/send', methods=['POST'])
-def send_message():
-    """发送消息"""
-    data = request.json
-    user_id = data.get('user_id')
-    message_type = data.get('type')
-    target_user_id = data.get('target_user_id')
-    message_content = data.get('message', '')
-    
-    if not all([user_id, message_type]):
-        return jsonify({'error': '缺少必要参数'}), 400
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
         
-    if user_id not in users:
-        return jsonify({'error': '用户不存在'}), 404
+    with status_lock:
+        changes = status_changes.get(user_id)
+        version = next(reversed(changes.values())) if changes else 0
         
+    def build():
+        # 版本号比服务器当前的还新（服务器重启过）时同样返回完整列表；
+        # 情侣解除后也返回完整列表，客户端据此清除情侣（增量里只能表示好友被删除）
+        uncoupled = since is not None and users.partner(user_id) is None and \
+            section_versions[user_id].get('couple', 0) > since
+        if since is None or since > version or uncoupled:
+            fields = {'full': True, 'version': version}
+            partner_id = users.partner(user_id)
+            if partner_id is not None:
+                fields['couple'] = _status_entry(partner_id)
+            return _friend_view(user_id).response_body(**fields)
+        return dict(_status_delta(user_id, since), full=False, version=version)
+    return _conditional(f'friends-status-{since}-{version}', build)
+
+def _deliver_message(user_id, message_type, target_user_id, message_content):
+    """投递一条消息 - /send 和 WebSocket 上行帧共用"""
     # 创建消息
     message_data = {
         'type': message_type,
         'from_user_id': user_id,
-        'from_user_name': users[user_id]['user_name'],
+        'from_user_name': users[user_id].user_name,
         'message': message_content,
         'timestamp': time.time()
     }
     
     # 如果是宠物动作，只发送给情侣伴侣
     if message_type == 'pet_action':
-        if user_id in couples:
-            partner_id = couples[user_id]
+        partner_id = users.partner(user_id)
+        if partner_id is not None:
+            # 状态类动作先更新服务器端的宠物状态，消息带上版本号，
+            # 客户端据此跳过已经包含在快照里的动作
+            state_version = _update_pet_state(user_id, message_content)
+            if state_version is not None:
+                message_data['state_version'] = state_version
             if partner_id in users:
-                messages[partner_id].append(message_data)
+                key = _pet_action_key(user_id, message_content)
+                log = pet_action_logs.get(user_id)
+                if log is None:
+                    log = pet_action_logs.setdefault(user_id, SenderLog(PET_ACTION_HISTORY))
+                # 分配发送者序号和写入信箱在同一把锁内，接收方看到的序号顺序与投递顺序一致
+                with log.lock:
+                    log.stamp(message_data, key)
+                    messages[partner_id].append(message_data, key=key)
                 print(f"DEBUG: 宠物动作发送给情侣伴侣 {partner_id}")
         else:
             print(f"DEBUG: 用户 {user_id} 没有情侣伴侣，无法发送宠物动作")
@@ -513,18 +1152,170 @@ def send_message():
     elif target_user_id and target_user_id in users:
         messages[target_user_id].append(message_data)
     else:
-        # 否则发送给所有好友
-        for friend_id in friends[user_id]:
-            if friend_id in users:
-                messages[friend_id].append(message_data)
+        # 否则广播给所有好友：只写入发送者的广播日志，不再给每个好友复制一份
+        log = broadcasts.get(user_id)
+        if log is None:
+            log = broadcasts.setdefault(user_id, BroadcastLog(BROADCAST_CAPACITY))
+        log.append(message_data)
+        _wake_followers(user_id, message_data)
+
+def _parse_pet_action(message_content):
+    """宠物动作格式: pet_id:action_type:action_data，格式不对时返回 None"""
+    parts = str(message_content).split(':', 2)
+    return parts if len(parts) == 3 else None
+
+def _pet_action_key(user_id, message_content):
+    """状态类宠物动作的合并键 (发送者, pet_id, 动作类型)，其余动作返回 None"""
+    action = _parse_pet_action(message_content)
+    if action is not None and action[1] in COALESCED_PET_ACTIONS:
+        return (user_id, action[0], action[1])
+    return None
+
+def _wake_followers(user_id, message):
+    """广播后只唤醒当前挂着连接的好友，开销与好友总数无关"""
+    follower_count = friend_graph.degree(user_id)
+    for active, wake in ((listening, lambda friend_id: messages[friend_id].poke()),
+                         (push_gateway.connections, lambda friend_id: push_gateway.push(friend_id, message))):
+        # 遍历挂着连接的用户和好友中较少的那一边
+        if len(active) < follower_count:
+            for friend_id in list(active):
+                if friend_graph.are_friends(user_id, friend_id):
+                    wake(friend_id)
+        else:
+            for friend_id in friend_graph.friends_of(user_id):
+                if friend_id in active:
+                    wake(friend_id)
+
+@contextmanager
+def _listening(user_id):
+    """登记用户正在等待新消息，期间好友的广播会唤醒它，用户也保持在线"""
+    with listening_lock:
+        listening[user_id] += 1
+    presence.connect(user_id)
+    try:
+        yield
+    finally:
+        presence.disconnect(user_id)
+        with listening_lock:
+            listening[user_id] -= 1
+            if not listening[user_id]:
+                del listening[user_id]
+
+def _followed_logs(user_id, after):
+    """用户关注的、在 after 之后有新广播的日志 -> 各自的起始序号"""
+    for friend_id, since in friend_graph.friends_since(user_id):
+        log = broadcasts.get(friend_id)
+        if log is not None and log.last_seq > after:
+            yield log, max(after, since)
+
+def _read_inbox(user_id, after, limit=None):
+    """读取收件箱：个人信箱与好友广播日志按序号合并，limit 为最多返回的条数
+    
+    以读取开始时的已提交序号为上限，客户端游标不会越过其他日志里正在写入的消息。
+    合并后序号最小的 limit 条一定在每个日志各自的前 limit 条里，所以每个日志只读 limit 条。
+    """
+    upto = committed_seq()
+    inbox = messages[user_id].read_after(after, limit, upto=upto)
+    merged = False
+    for log, start in _followed_logs(user_id, after):
+        entries = log.read_after(start, limit, upto=upto)
+        if entries:
+            inbox = inbox + entries
+            merged = True
+    if merged:
+        inbox.sort(key=lambda message: message['seq'])
+        if limit is not None:
+            del inbox[limit:]
+    return inbox
+
+def _read_inbox_since_timestamp(user_id, timestamp, after):
+    """按时间戳读取收件箱 - 兼容只会发送 timestamp 的旧客户端，已确认（不大于 after）的不再返回"""
+    inbox = [message for message in messages[user_id].read_since_timestamp(timestamp) if message['seq'] > after]
+    for log, start in _followed_logs(user_id, after):
+        inbox.extend(message for message in log.read_since_timestamp(timestamp)
+                     if message['seq'] > start)
+    inbox.sort(key=lambda message: message['seq'])
+    return inbox
+
+def _wait_inbox(user_id, after, wait, has_changes=None, limit=None):
+    """读取收件箱，为空（且 has_changes() 为假）时最多挂起 wait 秒，被唤醒后重新读取"""
+    mailbox = messages[user_id]
+    with _listening(user_id):
+        # 先记下唤醒计数和信箱序号再读取，读取之后到达的消息和广播都会让等待立即返回
+        pokes = mailbox.pokes
+        baseline = mailbox.last_seq
+        inbox = _read_inbox(user_id, after, limit)
+        if inbox or wait <= 0 or (has_changes is not None and has_changes()):
+            return inbox
+        mailbox.wait_after(max(after, baseline), wait, pokes=pokes)
+        return _read_inbox(user_id, after, limit)
+
+def _same_run(boot):
+    """客户端带的 boot 是否为服务器的本次运行（不带时视为是，兼容旧客户端）"""
+    return not boot or boot == BOOT_ID
+
+def _read_cursor(mailbox, after, boot=None):
+    """读取消息的起点
+    
+    不带游标时从服务器端的投递游标开始；游标来自服务器的上一次运行（boot 不同，
+    或者比已提交的最大序号还大）时同样从投递游标开始，否则重启后新消息的序号都不大于旧游标，
+    客户端要等序号追上来才能收到。
+    游标落后于投递游标时也从投递游标开始：已确认的信箱消息已经释放，好友广播却还在，不能再次投递。
+    """
+    if after is None or not _same_run(boot) or after > committed_seq():
+        return mailbox.acked_seq
+    return max(after, mailbox.acked_seq)
+
+def _message_page(user_id, after, wait, limit, has_changes=None):
+    """读取一页消息，返回 (消息列表, 分页时的 next_cursor 字段)；limit 为 None 时不分页"""
+    if limit is None:
+        return _wait_inbox(user_id, after, wait, has_changes), {}
+    # 多读一条判断后面是否还有
+    inbox = _wait_inbox(user_id, after, wait, has_changes, limit + 1)
+    if len(inbox) > limit:
+        del inbox[limit:]
+        return inbox, {'next_cursor': _encode_cursor(inbox[-1]['seq'])}
+    return inbox, {'next_cursor': None}
+
+@app.route('/send', methods=['POST'])
+def send_message():
+    """发送消息"""
+    data = request.json
+    user_id = data.get('user_id')
+    message_type = data.get('type')
+    target_user_id = data.get('target_user_id')
+    message_content = data.get('message', '')
+    
+    if not all([user_id, message_type]):
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    if target_user_id and _blocked(user_id, target_user_id):
+        return jsonify({'error': '无法向该用户发送消息'}), 403
+        
+    _deliver_message(user_id, message_type, target_user_id, message_content)
     
     return jsonify({'message': '消息发送成功'})
 
 @app.route('/messages', methods=['GET'])
 def get_messages():
-    """获取消息"""
+    """获取消息
+    
+    新客户端用 after=<seq> 按序号游标读取；只带 timestamp 的旧客户端按时间戳过滤；
+    两者都不带时从服务器端的投递游标（已确认的序号）之后读取。
+    ack=<seq> 先确认并释放 seq 及之前的消息。boot 为客户端上次拿到的服务器运行标识，
+    与本次运行不同时 after 和 ack 都视为上一次运行的旧游标，忽略。
+    带 wait=<秒> 时为长轮询：没有新消息就挂起，直到有新消息或超时。
+    带 limit 时分页返回，下一页用返回的 next_cursor 作为 cursor（优先于 after）。
+    """
     user_id = request.args.get('user_id')
-    timestamp = request.args.get('timestamp', 0)
+    after = request.args.get('after')
+    timestamp = request.args.get('timestamp')
+    ack = request.args.get('ack')
+    boot = request.args.get('boot')
+    wait = request.args.get('wait', 0)
     
     if not user_id:
         return jsonify({'error': '缺少用户ID'}), 400
@@ -532,13 +1323,177 @@ def get_messages():
     if user_id not in users:
         return jsonify({'error': '用户不存在'}), 404
         
-    # 过滤新消息
-    new_messages = []
-    for message in messages[user_id]:
-        if message['timestamp'] > float(timestamp):
-            new_messages.append(message)
+    mailbox = messages[user_id]
+    try:
+        if ack is not None and _same_run(boot):
+            mailbox.ack(int(ack))
+        wait = _wait_seconds(wait)
+        limit, position = _page_args(int)
+        page = {}
+        if position is not None:
+            after = position
+        if after is None and timestamp is not None:
+            after = mailbox.acked_seq
+            new_messages = _read_inbox_since_timestamp(user_id, float(timestamp), after)
+        else:
+            after = _read_cursor(mailbox, None if after is None else int(after), boot)
+            new_messages, page = _message_page(user_id, after, wait, limit)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
             
-    return jsonify({'messages': new_messages})
+    return jsonify(dict({
+        'messages': new_messages,
+        'last_seq': new_messages[-1]['seq'] if new_messages else after,
+        'acked_seq': mailbox.acked_seq,
+        'boot': BOOT_ID
+    }, **page))
+
+@app.route('/ack', methods=['POST'])
+def ack_messages():
+    """确认消息 - 推进服务器端的投递游标，并立即释放已确认的消息"""
+    data = request.json or {}
+    user_id = data.get('user_id')
+    seq = data.get('seq')
+    boot = data.get('boot')
+    
+    if not user_id or seq is None:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    try:
+        released = messages[user_id].ack(int(seq)) if _same_run(boot) else 0
+    except (TypeError, ValueError):
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    return jsonify({'message': '确认成功', 'released': released, 'acked_seq': messages[user_id].acked_seq})
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """SSE 消息流 - 消息写入信箱后立即推送
+    
+    事件 id 即消息序号，断线重连时客户端带上 Last-Event-ID 即可从断点继续，
+    同时视为确认了该序号之前的消息；不带时从服务器端的投递游标继续。
+    响应头 X-Boot-Id 为服务器的运行标识，重连时作为 boot 参数带上。
+    连接保持期间同时视为心跳。同时打开的消息流达到 SSE_MAX_STREAMS 时返回 503。
+    """
+    global sse_streams
+    user_id = request.args.get('user_id')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    boot = request.args.get('boot')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    mailbox = messages[user_id]
+    try:
+        after = None if last_event_id is None else int(last_event_id)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    if after is not None and _same_run(boot):
+        mailbox.ack(after)
+    after = _read_cursor(mailbox, after, boot)
+    
+    def generate():
+        cursor = after
+        yield 'retry: 3000\n\n'
+        while True:
+            new_messages = _wait_inbox(user_id, cursor, SSE_KEEPALIVE)
+            if not new_messages:
+                yield ': keepalive\n\n'
+                continue
+            for message in new_messages:
+                cursor = message['seq']
+                yield f"id: {cursor}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+    
+    with sse_lock:
+        if sse_streams >= SSE_MAX_STREAMS:
+            return jsonify({'error': '消息流连接数已满，请改用长轮询'}), 503, {'Retry-After': str(int(LONG_POLL_MAX_WAIT))}
+        sse_streams += 1
+        
+    def release():
+        global sse_streams
+        with sse_lock:
+            sse_streams -= 1
+        
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Boot-Id': BOOT_ID})
+    response.call_on_close(release)  # 连接断开（WSGI 服务器关闭响应）时归还名额
+    return response
+
+SYNC_BUILDERS = {
+    'friends': _friend_list,
+    'couple': _couple_status,
+    'friend_requests': friend_requests.pending_for,
+    'couple_requests': couple_requests.pending_for
+}
+
+def _changed_sections(user_id, versions):
+    """客户端版本号与服务器不一致的分区 -> 服务器当前版本号"""
+    current = section_versions[user_id]
+    changed = {}
+    for section in SYNC_SECTIONS:
+        version = current.get(section, 0)
+        if versions.get(section) != version:
+            changed[section] = version
+    return changed
+
+@app.route('/sync', methods=['POST'])
+def sync():
+    """聚合同步 - 一次请求完成心跳、拉取消息和好友/情侣/申请列表刷新
+    
+    客户端带上消息序号游标 after（不带时用服务器端的投递游标）、确认序号 ack
+    和各分区的版本号 versions，服务器记录心跳，只返回有变化的分区；
+    带 wait 时没有任何变化就挂起等待。boot 的含义与 /messages 相同。
+    """
+    data = request.json or {}
+    user_id = data.get('user_id')
+    versions = data.get('versions') or {}
+    boot = data.get('boot')
+    
+    if not user_id:
+        return jsonify({'error': '缺少用户ID'}), 400
+        
+    if user_id not in users:
+        return jsonify({'error': '用户不存在'}), 404
+        
+    if not isinstance(versions, dict):
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    mailbox = messages[user_id]
+    try:
+        if data.get('ack') is not None and _same_run(boot):
+            mailbox.ack(int(data['ack']))
+        after = int(data['after']) if data.get('after') is not None else None
+        wait = _wait_seconds(data.get('wait', 0))
+        limit, position = _page_args(int, data.get('limit'), data.get('cursor'))
+        if position is not None:
+            after = position
+        # 与 /messages 相同：游标同样要对照运行标识、不早于投递游标
+        after = _read_cursor(mailbox, after, boot)
+    except (TypeError, ValueError):
+        return jsonify({'error': '参数格式错误'}), 400
+        
+    new_messages, page = _message_page(user_id, after, wait, limit, lambda: _changed_sections(user_id, versions))
+    changed = _changed_sections(user_id, versions)
+        
+    # 先取版本号再生成数据，期间发生的变化最多导致下次多同步一次
+    sections = {}
+    for section, version in changed.items():
+        sections[section] = {'version': version, 'data': SYNC_BUILDERS[section](user_id)}
+        
+    return jsonify(dict({
+        'messages': new_messages,
+        'last_seq': new_messages[-1]['seq'] if new_messages else after,
+        'acked_seq': mailbox.acked_seq,
+        'sections': sections,
+        'boot': BOOT_ID
+    }, **page))
 
 @app.route('/heartbeat', methods=['POST'])
 def heartbeat():
@@ -550,29 +1505,234 @@ def heartbeat():
         return jsonify({'error': '缺少用户ID'}), 400
         
     if user_id in users:
-        users[user_id]['last_seen'] = time.time()
-        users[user_id]['online'] = True
+        # 心跳由 _presence_heartbeat 统一记录
         return jsonify({'message': '心跳成功'})
     else:
         return jsonify({'error': '用户不存在'}), 404
 
+# /batch 可以调用的接口及其方法；会长时间挂起的 /stream、/sync 不在其中
+BATCH_OPERATIONS = {
+    'register_user': 'POST',
+    'login_user': 'POST',
+    'search_user': 'GET',
+    'send_friend_request': 'POST',
+    'send_couple_request': 'POST',
+    'accept_friend_request': 'POST',
+    'accept_couple_request': 'POST',
+    'reject_couple_request': 'POST',
+    'friends': 'GET',
+    'friend_suggestions': 'GET',
+    'remove_friend': 'POST',
+    'dissolve_couple': 'POST',
+    'block_user': 'POST',
+    'unblock_user': 'POST',
+    'blocked_users': 'GET',
+    'couple_status': 'GET',
+    'pet_state': 'GET',
+    'resend': 'GET',
+    'couple_requests': 'GET',
+    'friend_requests': 'GET',
+    'friends_status': 'GET',
+    'send': 'POST',
+    'messages': 'GET',
+    'heartbeat': 'POST'
+}
+BATCH_MAX_OPERATIONS = 20
+
+def _run_batch_operation(operation):
+    """在进程内执行单个批量操作，返回状态码和响应体"""
+    op = operation.get('op') if isinstance(operation, dict) else None
+    method = BATCH_OPERATIONS.get(op)
+    if method is None:
+        return {'op': op, 'status': 400, 'body': {'error': '不支持的操作'}}
+        
+    if method == 'POST':
+        context = app.test_request_context(f'/{op}', method='POST', json=operation.get('body') or {})
+    else:
+        args = dict(operation.get('args') or {})
+        args.pop('wait', None)  # 批量请求里不允许长轮询
+        context = app.test_request_context(f'/{op}', method='GET', query_string=args)
+        
+    try:
+        with context:
+            response = app.full_dispatch_request()
+    except Exception:
+        app.logger.exception('批量操作 %s 执行失败', op)
+        return {'op': op, 'status': 500, 'body': {'error': '操作执行失败'}}
+        
+    return {'op': op, 'status': response.status_code, 'body': response.get_json()}
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """批量执行 - 一次请求按顺序执行多个接口操作
+    
+    operations 为操作列表，每项 {'op': 接口名, 'body': POST 参数, 'args': GET 参数}，
+    按顺序交给同一套处理函数执行，某个操作失败不影响后续操作。
+    """
+    data = request.json or {}
+    operations = data.get('operations')
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': '缺少必要参数'}), 400
+        
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'单次最多 {BATCH_MAX_OPERATIONS} 个操作'}), 400
+        
+    return jsonify({'results': [_run_batch_operation(operation) for operation in operations]})
+
 @app.route('/')
 def home():
     """首页"""
-    return jsonify({
+    features = [
+        'user_registration',
+        'friend_requests',
+        'couple_pairing',
+        'messaging',
+        'real_time_status',
+        'long_polling',
+        'sync',
+        'batch',
+        'ack',
+        'pet_state',
+        'resend',
+        'idempotency',
+        'presence',
+        'friends_delta',
+        'etag',
+        'pagination',
+        'user_search',
+        'friend_suggestions',
+        'unfriend',
+        'block'
+    ]
+    info = {
         'message': 'LovePetty Friend Server',
         'status': 'running',
         'timestamp': datetime.now().isoformat(),
         'users_count': len(users),
         'version': '2.1.0',
-        'features': [
-            'user_registration',
-            'friend_requests',
-            'couple_pairing',
-            'messaging',
-            'real_time_status'
-        ]
-    })
+        'boot': BOOT_ID,
+        'features': features,
+        'long_poll_max_wait': LONG_POLL_MAX_WAIT,
+        'mailbox': dict(messages.budget.stats(), capacity=MAILBOX_CAPACITY, policy=MAILBOX_OVERFLOW_POLICY),
+        'retention': retention_sweeper.stats(),
+        'idempotency': idempotency_cache.stats(),
+        'presence': presence.stats(),
+        'search': search_index.stats(),
+        'friend_graph': friend_graph.stats(),
+        'friend_views': friend_views.stats()
+    }
+    
+    if sse_streams < SSE_MAX_STREAMS:
+        features.append('sse')
+    if push_gateway.running:
+        features.append('websocket')
+        info['ws_url'] = WS_PUBLIC_URL or f"ws://{request.host.rsplit(':', 1)[0]}:{WS_PORT}"
+        
+    return jsonify(info)
+
+def _socket_user_exists(user_id):
+    return user_id in users
+
+def _socket_backlog(user_id, after):
+    mailbox = messages[user_id]
+    if after is not None:
+        mailbox.ack(after)  # 重连时带上的序号视为已确认
+    return _read_inbox(user_id, _read_cursor(mailbox, after))
+
+def _on_socket_frame(user_id, frame):
+    """WebSocket 上行帧：宠物动作和消息确认，其余帧当作心跳"""
+    if user_id not in users:
+        return
+    presence.touch(user_id)
+    
+    if frame.get('type') == 'pet_action':
+        _deliver_message(user_id, 'pet_action', None, frame.get('message', ''))
+    elif frame.get('type') == 'ack' and isinstance(frame.get('seq'), int):
+        messages[user_id].ack(frame['seq'])
+
+def _on_socket_presence(user_id, online):
+    """WebSocket 连接保持期间用户保持在线，断开后按心跳超时下线"""
+    if online:
+        presence.connect(user_id)
+    else:
+        presence.disconnect(user_id)
+
+def _on_presence_change(user_id, online):
+    """用户上线或下线：好友和情侣的列表随之变化，并推送给在 WebSocket 上的好友和情侣"""
+    if user_id not in users:
+        return
+    _bump_watchers(user_id, push=False)
+    
+    frame = {
+        'type': 'presence',
+        'user_id': user_id,
+        'user_name': users[user_id].user_name,
+        'online': online
+    }
+    recipients = set(friend_graph.friends_of(user_id))
+    partner_id = users.partner(user_id)
+    if partner_id is not None:
+        recipients.add(partner_id)
+    for recipient_id in recipients:
+        push_gateway.push(recipient_id, frame)
+
+push_gateway = PushGateway('0.0.0.0', WS_PORT, _socket_user_exists, _socket_backlog,
+                           _on_socket_frame, _on_socket_presence)
+messages.listener = push_gateway.push
+
+presence = PresenceTracker(_on_presence_change, PRESENCE_TICK, PRESENCE_MISSED_HEARTBEATS)
+
+def _message_cutoffs(now):
+    """消息类型 -> 过期截止时间戳，以及其余类型的截止时间戳"""
+    cutoffs = {kind: now - ttl for kind, ttl in RETENTION_TTLS.items() if kind != 'notification'}
+    return cutoffs, now - RETENTION_TTLS['notification']
+
+def _sweep_mailbox(user_id, now):
+    return messages[user_id].expire(*_message_cutoffs(now))
+
+def _sweep_broadcasts(user_id, now):
+    return broadcasts[user_id].expire(*_message_cutoffs(now))
+
+def _request_sweeper(index, section):
+    """清理长期未处理的申请，申请列表变化时通知收件人同步"""
+    def sweep(user_id, now):
+        expired = index.expire(user_id, now - RETENTION_TTLS[index.kind])
+        if expired:
+            _bump(user_id, section)
+        for record in expired:
+            _bump_version(record['from_user_id'], 'sent_' + section)
+        return len(expired)
+    return sweep
+
+retention_sweeper = RetentionSweeper([
+    ('messages', lambda: list(messages), _sweep_mailbox),
+    ('broadcasts', lambda: list(broadcasts), _sweep_broadcasts),
+    ('friend_requests', lambda: list(friend_requests.incoming), _request_sweeper(friend_requests, 'friend_requests')),
+    ('couple_requests', lambda: list(couple_requests.incoming), _request_sweeper(couple_requests, 'couple_requests'))
+], interval=RETENTION_INTERVAL, slice_seconds=RETENTION_SLICE_MS / 1000)
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background():
+    """启动后台线程（过期清理、在线检查、WebSocket 网关），重复调用只启动一次
+    
+    导入模块时不启动（测试会反复重新加载模块）：gunicorn 由 gunicorn.conf.py 的 post_worker_init 钩子
+    在每个工作进程里调用，本地直接运行时由下面的 __main__ 调用。
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    retention_sweeper.start()
+    presence.start()
+    if WS_PORT:
+        push_gateway.start()
 
 if __name__ == '__main__':
+    # debug 运行时只在重载器的子进程里启动，避免端口冲突
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000))) 
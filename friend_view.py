@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友列表视图 - 最近活跃用户的好友列表预先生成并编码好，读取时直接返回
+好友加入、改昵称、上下线时只更新变化的那一项
+"""
+
+import bisect
+import json
+import threading
+from collections import OrderedDict
+
+
+def _encode(value):
+    """与 jsonify 相同的编码方式（紧凑、键排序、转义非 ASCII 字符）"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('ascii')
+
+
+class FriendView:
+    """一个用户的好友列表
+
+    entries 为好友 -> {'user_id', 'user_name', 'online'}，每项另存编码好的 JSON 片段；
+    更新一项只重新编码这一项，整个列表的字节串在下次读取时拼接一次并缓存到下次变化。
+    列表按好友 user_id 排序，分页读取时以上一页最后一个 user_id 为游标，顺序不受增删影响。
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._fragments = {}
+        self._order = []  # 排好序的好友 user_id
+        self._encoded = None  # 缓存的 JSON 数组字节串，None 表示需要重新拼接
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, friend_id, user_name, online):
+        """加入或更新一个好友，已有的好友保持原来的位置"""
+        entry = {'user_id': friend_id, 'user_name': user_name, 'online': online}
+        fragment = _encode(entry)
+        with self._lock:
+            if friend_id not in self.entries:
+                bisect.insort(self._order, friend_id)
+            self.entries[friend_id] = entry
+            self._fragments[friend_id] = fragment
+            self._encoded = None
+
+    def remove(self, friend_id):
+        with self._lock:
+            if self.entries.pop(friend_id, None) is not None:
+                del self._fragments[friend_id]
+                del self._order[bisect.bisect_left(self._order, friend_id)]
+                self._encoded = None
+
+    def items(self):
+        """好友列表（共享的字典，调用方不要修改）"""
+        with self._lock:
+            return [self.entries[friend_id] for friend_id in self._order]
+
+    def encoded_list(self):
+        """好友列表的 JSON 数组字节串"""
+        with self._lock:
+            if self._encoded is None:
+                self._encoded = b'[' + b','.join([self._fragments[friend_id] for friend_id in self._order]) + b']'
+            return self._encoded
+
+    def page(self, after, limit):
+        """user_id 大于 after 的前 limit 个好友，返回 (JSON 数组字节串, 后面还有时为本页最后一个 user_id)"""
+        with self._lock:
+            start = bisect.bisect_right(self._order, after) if after is not None else 0
+            friend_ids = self._order[start:start + limit]
+            more = start + limit < len(self._order)
+            encoded = b'[' + b','.join([self._fragments[friend_id] for friend_id in friend_ids]) + b']'
+        return encoded, (friend_ids[-1] if more else None)
+
+    def response_body(self, encoded=None, **fields):
+        """{"friends": [...], **fields} 的 JSON 字节串，不指定 encoded 时使用缓存的完整列表"""
+        body = b'{"friends":' + (encoded if encoded is not None else self.encoded_list())
+        if fields:
+            return body + b',' + _encode(fields)[1:]
+        return body + b'}'
+
+
+class FriendViewCache:
+    """最近读取过好友列表的用户的视图，按最近使用保留最多 capacity 个
+
+    不在缓存里的用户读取时用 build(user_id) 从好友关系图现建一份；
+    好友信息变化时只更新已缓存的视图（peek），没有缓存的用户下次读取时自然是最新的。
+    现建和更新要由调用方串行执行（服务器在 views_lock 下进行），否则现建用的旧状态可能覆盖更新。
+    """
+
+    def __init__(self, build, capacity=10000):
+        self.build = build
+        self.capacity = capacity
+        self._views = OrderedDict()  # user_id -> FriendView，按最近使用排列
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._views)
+
+    def get(self, user_id):
+        """用户的视图，不在缓存里时现建并放入缓存"""
+        with self._lock:
+            view = self._views.get(user_id)
+            if view is not None:
+                self._views.move_to_end(user_id)
+                self.hits += 1
+                return view
+            self.misses += 1
+        view = self.build(user_id)
+        with self._lock:
+            self._views[user_id] = view
+            if len(self._views) > self.capacity:
+                self._views.popitem(last=False)
+        return view
+
+    def peek(self, user_id):
+        """已缓存的视图，没有时返回 None（不现建，不改变使用顺序）"""
+        with self._lock:
+            return self._views.get(user_id)
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {'cached': len(self._views), 'capacity': self.capacity,
+                'cache_hits': self.hits, 'cache_misses': self.misses}
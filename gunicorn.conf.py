@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置 - 在工作进程加载完应用后启动服务器的后台线程
+gunicorn 默认读取当前目录下的 gunicorn.conf.py，启动命令不用另外指定
+"""
+
+
+def post_worker_init(worker):
+    """工作进程初始化完成（应用已导入）后启动过期清理、在线检查和 WebSocket 网关"""
+    import friend_server
+    friend_server.start_background()
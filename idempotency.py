@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+幂等键缓存 - 保存带 Idempotency-Key 的请求的响应
+客户端超时重试或换格式重发时，服务器直接返回第一次的结果，不会重复修改数据或重复发通知
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyCache:
+    """已完成请求的响应缓存
+
+    键由调用方决定（通常是 (用户, 路径, Idempotency-Key)），值为任意响应对象。
+    条目保存 ttl 秒，最多保存 capacity 条，超出时淘汰最早的。
+    同一个键的请求正在处理时，后到的请求等待它完成，最多等 wait_timeout 秒。
+    """
+
+    def __init__(self, capacity=10000, ttl=86400, wait_timeout=30):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()  # key -> (过期时间, 响应)，按写入顺序即过期顺序排列
+        self._pending = {}  # 正在处理的 key -> threading.Event
+        self._lock = threading.Lock()
+        self.replayed = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def begin(self, key):
+        """开始处理一个请求，返回 (状态, 响应)
+
+        状态为 'replay' 时响应为保存的结果；为 'new' 时调用方执行请求，结束后必须调用 finish；
+        为 'pending' 表示同一个键的请求等待超时后仍在处理。
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.time():
+                    self.replayed += 1
+                    return 'replay', entry[1]
+                event = self._pending.get(key)
+                if event is None:
+                    self._pending[key] = threading.Event()
+                    return 'new', None
+            # 第一次请求还没完成：等它结束后再查一次缓存，它失败了就由本次请求重新执行
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                return 'pending', None
+
+    def store(self, key, response):
+        """保存请求的响应，之后相同的键直接返回它"""
+        now = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, response)
+            self.stored += 1
+            while self._entries:
+                expires, _ = next(iter(self._entries.values()))
+                if len(self._entries) <= self.capacity and expires > now:
+                    break
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def finish(self, key):
+        """请求处理结束（无论是否保存了响应），唤醒等待同一个键的请求"""
+        with self._lock:
+            event = self._pending.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {
+            'size': len(self._entries),
+            'pending': len(self._pending),
+            'replayed': self.replayed,
+            'stored': self.stored,
+            'evicted': self.evicted
+        }
@@ -0,0 +1,686 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息信箱 - 带递增序号的有界消息存储
+按序号游标读取，单次轮询的开销与历史长度无关
+"""
+
+import bisect
+import itertools
+import threading
+import time
+
+# 默认每个用户最多保留的消息条数
+DEFAULT_CAPACITY = 1000
+
+# 信箱满时的处理策略：丢弃最旧的消息 / 丢弃新消息 / 把最旧的消息合并成一条摘要
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'summarize')
+
+# 前缀被淘汰超过这个数量时才压缩底层列表，避免频繁搬移
+COMPACT_THRESHOLD = 256
+
+# 全局序号从服务器启动时的毫秒时间戳开始，只有消息占用序号（版本号用另一个计数器），
+# 重启后的序号通常仍大于客户端手里的旧游标；BOOT_ID 标识服务器的这一次运行，
+# 客户端的游标带上它，服务器据此认出上一次运行留下的游标
+_boot_ms = int(time.time() * 1000)
+BOOT_ID = format(_boot_ms, 'x')
+_seq_counter = itertools.count(_boot_ms)
+_version_counter = itertools.count(_boot_ms)
+
+# 消息分配序号和写入日志在同一把全局锁内完成，
+# 因此序号不大于 _committed_seq 的消息一定都已经写入，可以被读到
+_append_lock = threading.Lock()
+_committed_seq = 0
+
+
+def next_seq():
+    """分配下一个全局序号"""
+    return next(_seq_counter)
+
+
+def next_version():
+    """分配下一个版本号（数据分区、好友状态变化、宠物状态），不占用消息序号"""
+    return next(_version_counter)
+
+
+def committed_seq():
+    """已写入完成的最大消息序号
+
+    同时读取多个日志（信箱 + 好友广播）时以它为上限，
+    客户端的游标就不会越过另一个日志里还没写完的消息。
+    """
+    return _committed_seq
+
+
+class SeqLog:
+    """按序号递增排列的有界消息日志 - Mailbox 和 BroadcastLog 的公共部分
+
+    每条消息追加时分配一个全局递增的序号(seq)并写入消息的 'seq' 字段。
+    按序号读取时用二分查找定位起点，开销为 O(log n + k)。
+    超出容量时丢弃最旧的消息。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, on_append=None):
+        self.capacity = capacity
+        self.on_append = on_append
+        self.last_seq = 0
+        self._seqs = []  # 与 _items 一一对应的序号，递增
+        self._items = []
+        self._head = 0  # 已被淘汰的前缀长度
+        self._dead = 0  # 前缀之后被取代（置为 None）的条数
+        self._swept = {}  # 过期类别 -> 上次清理扫描到的序号
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._seqs) - self._head - self._dead
+
+    def append(self, message):
+        """追加消息，返回分配的序号"""
+        with self._cond:
+            seq = self._insert(message)
+
+        if self.on_append is not None:
+            self.on_append(message)
+        return seq
+
+    def _insert(self, message):
+        """分配序号并写入，超出容量时淘汰最旧的消息（调用方需持有锁）"""
+        global _committed_seq
+        with _append_lock:
+            seq = next_seq()
+            message['seq'] = seq
+            self._seqs.append(seq)
+            self._items.append(message)
+            _committed_seq = seq
+        self.last_seq = seq
+
+        while len(self) > self.capacity:
+            self._drop_front(len(self) - self.capacity)
+        self._cond.notify_all()
+        return seq
+
+    def read_after(self, seq, limit=None, upto=None):
+        """读取序号大于 seq（且不大于 upto）的消息"""
+        with self._cond:
+            return self._read_after(seq, limit, upto)
+
+    def read_since_timestamp(self, timestamp):
+        """按时间戳读取 - 兼容只会发送 timestamp 的旧客户端"""
+        with self._cond:
+            return [message for message in self._items[self._head:]
+                    if message is not None and message['timestamp'] > timestamp]
+
+    def expire(self, cutoffs, default_cutoff):
+        """删除过期的消息，返回删除的条数
+
+        cutoffs 为 消息类型 -> 截止时间戳，时间戳早于截止时间的消息过期，
+        未列出的类型使用 default_cutoff（归为类别 None）。消息按序号追加、时间戳基本递增，
+        每个类别从上次扫描停下的序号继续，扫描到第一条不早于本类别截止时间的消息即停止。
+        截止时间只会后移，每条消息在每个类别下最多被扫描一次，
+        保留期长的消息不会因为保留期短的类别而在每一轮清理中被重新扫描。
+        """
+        with self._cond:
+            size = len(self)
+            for kind, cutoff in list(cutoffs.items()) + [(None, default_cutoff)]:
+                i = bisect.bisect_right(self._seqs, self._swept.get(kind, 0), self._head)
+                while i < len(self._items):
+                    message = self._items[i]
+                    if message is not None:
+                        if message['timestamp'] >= cutoff:
+                            break
+                        if (message['type'] if message['type'] in cutoffs else None) == kind:
+                            self._items[i] = None
+                            self._dead += 1
+                    i += 1
+                if i > self._head:
+                    self._swept[kind] = self._seqs[i - 1]
+
+            # 队首连续的空位直接淘汰
+            start = self._head
+            while start < len(self._items) and self._items[start] is None:
+                start += 1
+            self._drop_front(start - self._head)
+            self._account(size)
+            return size - len(self)
+
+    def _account(self, size):
+        """条数变化的记账钩子（调用方需持有锁）"""
+
+    def _read_after(self, seq, limit, upto=None):
+        """二分定位起止位置并切片（调用方需持有锁）"""
+        start = bisect.bisect_right(self._seqs, seq, self._head)
+        if upto is None:
+            end = len(self._items)
+        else:
+            end = bisect.bisect_right(self._seqs, upto, start)
+        if self._dead:
+            items = [message for message in self._items[start:end] if message is not None]
+            return items if limit is None else items[:limit]
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._items[start:end]
+
+    def _drop_front(self, count):
+        """淘汰最旧的 count 条消息（调用方需持有锁）"""
+        # 先断开引用让消息立即被回收，列表本身攒够了再压缩
+        for i in range(self._head, self._head + count):
+            if self._items[i] is None:
+                self._dead -= 1
+            self._items[i] = None
+        self._head += count
+        if self._head >= COMPACT_THRESHOLD and self._head * 2 >= len(self._seqs):
+            del self._seqs[:self._head]
+            del self._items[:self._head]
+            self._head = 0
+
+
+class Mailbox(SeqLog):
+    """单个用户的信箱
+
+    客户端确认(ack)后，确认过的消息立即释放，信箱里只留下未消费的消息。
+    长轮询的等待方阻塞在信箱自己的条件变量上，新消息到达或被 poke() 时唤醒；
+    on_append 回调用于把新消息转交给推送网关。
+    状态类消息带 key 写入时，取代信箱里同一 key 尚未确认的旧消息，只保留最新状态；
+    旧消息带发送者序号时，新消息的 superseded 记下被取代的发送者序号区间，
+    接收方据此不把它们当作缺口去请求补发。
+
+    信箱达到容量（或全局预算紧张时达到公平份额）时按 policy 腾出空间，
+    budget 为所有信箱共享的 MailboxBudget。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, on_append=None, policy='drop_oldest', budget=None):
+        super().__init__(capacity, on_append)
+        self.policy = policy
+        self.budget = budget
+        self.acked_seq = 0  # 服务器端的投递游标：客户端已确认处理到的序号
+        self.pokes = 0  # poke() 次数，等待方据此判断是否被唤醒过
+        self.coalesced = 0  # 被新消息取代而未投递的消息条数
+        self._latest = {}  # key -> 该 key 最新的一条消息
+
+    def append(self, message, key=None):
+        """追加消息，返回分配的序号；按 drop_newest 策略丢弃时返回 None
+
+        key 不为空时，信箱里同一 key 的旧消息被取代：旧消息原位删除，
+        新消息以新序号追加在末尾，与其他消息的先后顺序保持不变。
+        """
+        with self._cond:
+            size = len(self)
+            replaces = key is not None and self._find_latest(key) is not None
+            excess = size - replaces - self._limit() + 1
+            if excess > 0 and not self._make_room(excess):
+                return None
+            if key is not None:
+                replaced = self._supersede(key)
+                if replaced is not None and 'sender_seq' in replaced:
+                    message['superseded'] = _add_range(replaced.get('superseded', []), replaced['sender_seq'])
+            seq = self._insert(message)
+            if key is not None:
+                self._latest[key] = message
+            self._account(size)
+
+        if self.on_append is not None:
+            self.on_append(message)
+        return seq
+
+    def _limit(self):
+        """当前允许的最大条数：自身容量，全局预算用尽时再受公平份额限制"""
+        if self.budget is not None and self.budget.exhausted():
+            return min(self.capacity, self.budget.share())
+        return self.capacity
+
+    def _make_room(self, count):
+        """按溢出策略腾出 count 个位置，drop_newest 策略返回 False（调用方需持有锁）
+
+        计入全局统计的是实际移出信箱的条数（drop_newest 为被拒收的这一条），而不是 count。
+        """
+        if self.policy == 'drop_newest':
+            if self.budget is not None:
+                self.budget.record_overflow(self.policy, rejected=1)
+            return False
+        size = len(self)
+        if self.policy == 'summarize' and size > count:
+            self._summarize(count)
+        else:
+            target = size - count
+            while len(self) > target:
+                self._drop_front(len(self) - target)
+        if self.budget is not None:
+            self.budget.record_overflow(self.policy, evicted=size - len(self))
+        return True
+
+    def _summarize(self, count):
+        """把最旧的 count + 1 条消息合并成一条摘要放在队首（调用方需持有锁）
+
+        已经是摘要的队首消息会继续累加，持续溢出时每次只多合并一条。
+        """
+        positions = []
+        i = self._head
+        while len(positions) <= count:
+            if self._items[i] is not None:
+                positions.append(i)
+            i += 1
+
+        first = self._items[positions[0]]
+        if first['type'] == 'summary':
+            summary = dict(first, types=dict(first['types']))
+            merged = positions[1:]
+        else:
+            summary = {'type': 'summary', 'count': 0, 'types': {},
+                       'first_timestamp': first['timestamp'], 'timestamp': first['timestamp']}
+            merged = positions
+        for position in merged:
+            message = self._items[position]
+            summary['count'] += 1
+            summary['types'][message['type']] = summary['types'].get(message['type'], 0) + 1
+            summary['timestamp'] = message['timestamp']
+
+        # 摘要沿用最后一条被合并消息的序号，其余位置连同之前的前缀一起淘汰
+        last = positions[-1]
+        summary['seq'] = self._seqs[last]
+        for position in positions[:-1]:
+            self._items[position] = None
+            self._dead += 1
+        self._items[last] = summary
+        self._drop_front(last - self._head)
+
+    def _find_latest(self, key):
+        """key 对应的旧消息仍在信箱中时返回其下标（调用方需持有锁）"""
+        message = self._latest.get(key)
+        if message is None:
+            return None
+        i = bisect.bisect_left(self._seqs, message['seq'], self._head)
+        # 旧消息可能已经被确认释放、因容量淘汰或被合并进摘要
+        if i < len(self._items) and self._items[i] is message:
+            return i
+        return None
+
+    def _supersede(self, key):
+        """删除 key 对应的仍在信箱中的旧消息，返回被删除的消息（调用方需持有锁）"""
+        i = self._find_latest(key)
+        self._latest.pop(key, None)
+        if i is None:
+            return None
+        replaced = self._items[i]
+        self._items[i] = None
+        self._dead += 1
+        self.coalesced += 1
+        return replaced
+
+    def discard(self, message):
+        """删除仍在信箱中的这条消息（原位置空），例如撤回的申请通知；返回是否删除"""
+        with self._cond:
+            i = bisect.bisect_left(self._seqs, message.get('seq', 0), self._head)
+            # 可能已经被确认释放、因容量淘汰或被合并进摘要
+            if i >= len(self._items) or self._items[i] is not message:
+                return False
+            size = len(self)
+            self._items[i] = None
+            self._dead += 1
+            self._account(size)
+            return True
+
+    def _account(self, size):
+        """把条数变化计入全局预算（调用方需持有锁）"""
+        if self.budget is not None and len(self) != size:
+            self.budget.add(len(self) - size)
+
+    def wait_after(self, seq, timeout, pokes=None):
+        """等待序号大于 seq 的消息写入，最多等待 timeout 秒；只负责等待，读取由调用方完成
+
+        有新消息或者被 poke() 时提前返回。pokes 为调用方事先记下的 poke 次数，
+        记下之后、开始等待之前发生的 poke 也会让本次等待立即返回。
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if pokes is None:
+                pokes = self.pokes
+            while self.last_seq <= seq and self.pokes == pokes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def ack(self, seq):
+        """确认 seq 及之前的消息已处理，释放这些消息，返回释放的条数
+
+        游标同时覆盖好友广播，因此上限是全局已提交序号而不是本信箱的最大序号；
+        比已提交序号还大的只能是服务器上一次运行留下的游标，忽略，不能把还没投递的消息确认掉。
+        """
+        with self._cond:
+            if seq > _committed_seq or seq <= self.acked_seq:
+                return 0
+            self.acked_seq = seq
+            size = len(self)
+            self._drop_front(bisect.bisect_right(self._seqs, seq, self._head) - self._head)
+            self._account(size)
+            return size - len(self)
+
+    def poke(self):
+        """不写入消息，只唤醒等待方（例如好友列表等其他数据有变化时）"""
+        with self._cond:
+            self.pokes += 1
+            self._cond.notify_all()
+
+
+def _add_range(ranges, number):
+    """在 [first, last] 区间列表末尾加入 number（不小于已有的数），与末尾区间相邻时合并，返回新列表"""
+    if ranges and ranges[-1][1] + 1 == number:
+        return ranges[:-1] + [[ranges[-1][0], number]]
+    return ranges + [[number, number]]
+
+
+class BroadcastLog(SeqLog):
+    """单个发送者的广播日志
+
+    广播只写一份，由发送者的所有好友共享，写入开销与好友数量无关；
+    好友读取时按各自的游标把关注的广播日志合并进收件箱。
+    写入后的消息不再修改，多个读取方可以安全地共享同一个 dict。
+    """
+
+
+class SenderLog:
+    """单个发送者的消息序号和最近的发送历史
+
+    每条消息写入发送者自己的递增序号 sender_seq，接收方据此发现缺口，
+    再按区间请求补发。历史只保留最近 capacity 条，与信箱共享同一个 dict；
+    带 key 的状态类消息只有同 key 最新的一条需要补发。
+    分配序号和写入信箱需要在 lock 内完成，保证序号顺序与投递顺序一致。
+    """
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self.last_sender_seq = 0
+        self.lock = threading.Lock()
+        self._history = {}  # sender_seq -> (消息, key)，按序号插入
+        self._latest = {}  # key -> 该 key 最新的 sender_seq
+
+    def stamp(self, message, key=None):
+        """给消息分配发送者序号并记入历史（调用方需持有 lock），返回序号"""
+        self.last_sender_seq += 1
+        sender_seq = self.last_sender_seq
+        message['sender_seq'] = sender_seq
+        self._history[sender_seq] = (message, key)
+        if key is not None:
+            self._latest[key] = sender_seq
+        while len(self._history) > self.capacity:
+            del self._history[next(iter(self._history))]
+        return sender_seq
+
+    def clear(self):
+        """清空发送历史（情侣关系变化时），序号继续递增；发给旧情侣的消息不会补发给新情侣"""
+        with self.lock:
+            self._history.clear()
+            self._latest.clear()
+
+    def resend(self, first, last):
+        """区间 [first, last] 内仍需补发的消息，按序号排列
+
+        已经被同 key 新消息取代的状态消息不再补发；超出历史范围的无法补发。
+        """
+        with self.lock:
+            last = min(last, self.last_sender_seq)
+            if last - first + 1 > len(self._history):
+                first = max(first, last - len(self._history) + 1)
+            resent = []
+            for sender_seq in range(first, last + 1):
+                entry = self._history.get(sender_seq)
+                if entry is None:
+                    continue
+                message, key = entry
+                if key is None or self._latest.get(key) == sender_seq:
+                    resent.append(message)
+            return resent
+
+
+class MailboxBudget:
+    """所有信箱共享的全局条数预算和溢出计数
+
+    capacity 为所有信箱合计最多保留的消息条数（0 表示不限）。预算用尽后，
+    每个信箱最多只能增长到公平份额 capacity // 信箱数，超出部分按各自的策略处理，
+    因此总条数不会超过 capacity + 信箱数。
+    """
+
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.used = 0  # 所有信箱当前合计条数
+        self.mailboxes = 0
+        self.overflows = {policy: 0 for policy in OVERFLOW_POLICIES}  # 策略 -> 触发次数
+        self.evicted = 0  # 因溢出移出信箱（丢弃或并入摘要）的消息条数
+        self.rejected = 0  # 按 drop_newest 策略拒收的新消息条数
+        self._lock = threading.Lock()
+
+    def add(self, delta):
+        with self._lock:
+            self.used += delta
+
+    def register_mailbox(self):
+        with self._lock:
+            self.mailboxes += 1
+
+    def exhausted(self):
+        return bool(self.capacity) and self.used >= self.capacity
+
+    def share(self):
+        return max(1, self.capacity // max(1, self.mailboxes))
+
+    def record_overflow(self, policy, evicted=0, rejected=0):
+        with self._lock:
+            self.overflows[policy] += 1
+            self.evicted += evicted
+            self.rejected += rejected
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {
+            'messages': self.used,
+            'global_capacity': self.capacity,
+            'overflows': dict(self.overflows),
+            'evicted': self.evicted,
+            'rejected': self.rejected
+        }
+
+
+class MailboxTable(dict):
+    """user_id -> Mailbox，访问不存在的用户时自动创建信箱
+
+    listener(user_id, message) 在任意信箱追加消息后被调用。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy='drop_oldest', global_capacity=0):
+        super().__init__()
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的信箱溢出策略: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.budget = MailboxBudget(global_capacity)
+        self.listener = None
+
+    def __missing__(self, user_id):
+        mailbox = Mailbox(self.capacity, on_append=lambda message: self._notify(user_id, message),
+                          policy=self.policy, budget=self.budget)
+        # setdefault 是原子操作，并发创建时所有线程拿到同一个信箱
+        created = self.setdefault(user_id, mailbox)
+        if created is mailbox:
+            self.budget.register_mailbox()
+        return created
+
+    def _notify(self, user_id, message):
+        if self.listener is not None:
+            self.listener(user_id, message)
+
+
+class _RecordList(list):
+    """一个用户名下按序号排列的申请记录，dead 为其中已经不再待处理、尚未压缩掉的条数"""
+
+    __slots__ = ('dead',)
+
+    def __init__(self):
+        super().__init__()
+        self.dead = 0
+
+
+class RequestIndex:
+    """待处理申请（好友申请 / 情侣申请）的统一存储
+
+    每条申请只保存一条记录：同一个 dict 既是收件人信箱里的通知消息，
+    也挂在"发给某人的申请"和"某人发出的申请"两个二级索引上，
+    申请列表接口和 /messages 都是这些记录的视图，不再各存一份。
+
+    incoming 以双方的 user_id 为键，查重、接受、拒绝的查找都是 O(1)；
+    received / outgoing 为每个用户一个按序号排列的记录列表（不另建字典，每条只占一个列表槽位），
+    分页时按序号二分定位。删除只从 incoming 里移除并给两个列表的 dead 计数加一，O(1)，
+    列表里的记录是否仍待处理以 incoming 为准；dead 超过一半时压缩一次，均摊下来仍是 O(1)。
+    """
+
+    def __init__(self, kind, mailboxes):
+        self.kind = kind  # 通知消息的 type，例如 'friend_request'
+        self.mailboxes = mailboxes
+        self.incoming = {}  # to_user_id -> {from_user_id: 申请记录}
+        self.received = {}  # to_user_id -> _RecordList，按序号排列，可能含已删除的记录
+        self.outgoing = {}  # from_user_id -> _RecordList，按序号排列，可能含已删除的记录
+        self._lock = threading.Lock()
+
+    def submit(self, from_user_id, from_user_name, to_user_id, message):
+        """提交申请：写入收件人信箱并建立索引，返回申请记录"""
+        record = {
+            'type': self.kind,
+            'from_user_id': from_user_id,
+            'from_user_name': from_user_name,
+            'to_user_id': to_user_id,
+            'message': message,
+            'timestamp': time.time()
+        }
+        if self.mailboxes[to_user_id].append(record) is None:
+            record['seq'] = next_seq()  # 信箱按 drop_newest 拒收时仍需要序号用于分页排序
+        self._index(record)
+        return record
+
+    def _index(self, record):
+        """把记录挂到各个索引上"""
+        with self._lock:
+            pending = self.incoming.setdefault(record['to_user_id'], {})
+            replaced = pending.get(record['from_user_id'])
+            pending[record['from_user_id']] = record
+            if replaced is not None and replaced is not record:
+                self._release(replaced)
+            self._insert(self._list(self.received, record['to_user_id']), record)
+            self._insert(self._list(self.outgoing, record['from_user_id']), record)
+
+    def _live(self, record):
+        """记录是否仍待处理（需持有锁）"""
+        pending = self.incoming.get(record['to_user_id'])
+        return pending is not None and pending.get(record['from_user_id']) is record
+
+    def find(self, to_user_id, from_user_id):
+        """查找 from_user_id 发给 to_user_id 的待处理申请"""
+        pending = self.incoming.get(to_user_id)
+        return pending.get(from_user_id) if pending else None
+
+    def remove(self, to_user_id, from_user_id):
+        """移除待处理申请（接受或拒绝后），返回被移除的记录，不存在时返回 None"""
+        # 接受/拒绝和过期清理可能并发删除同一条，只有一方拿到记录
+        with self._lock:
+            pending = self.incoming.get(to_user_id)
+            record = pending.pop(from_user_id, None) if pending else None
+            if record is None:
+                return None
+            if not pending:
+                del self.incoming[to_user_id]
+            self._release(record)
+            return record
+
+    def withdraw(self, to_user_id, from_user_id):
+        """撤回待处理申请：移除记录，并删除收件人信箱里尚未取走的通知，返回被移除的记录"""
+        record = self.remove(to_user_id, from_user_id)
+        if record is not None:
+            self.mailboxes[to_user_id].discard(record)
+        return record
+
+    def expire(self, to_user_id, cutoff):
+        """删除发给 to_user_id、提交时间早于 cutoff 的待处理申请，返回删除的记录"""
+        # 每个收件人名下按序号（即提交顺序）排列，遇到第一条未过期的即可停止
+        expired = []
+        for record in self.pending_for(to_user_id):
+            if record['timestamp'] >= cutoff:
+                break
+            if self.remove(to_user_id, record['from_user_id']) is not None:
+                expired.append(record)
+        return expired
+
+    def pending_for(self, user_id):
+        """发给 user_id 的待处理申请，按提交顺序"""
+        with self._lock:
+            return [record for record in self.received.get(user_id, ()) if self._live(record)]
+
+    def sent_by(self, user_id):
+        """user_id 发出的待处理申请，按提交顺序"""
+        with self._lock:
+            return [record for record in self.outgoing.get(user_id, ()) if self._live(record)]
+
+    def pending_page(self, user_id, after, limit):
+        """发给 user_id 的待处理申请中序号大于 after 的前 limit 条，返回 (申请列表, 是否还有)"""
+        return self._page(self.received, user_id, after, limit)
+
+    def sent_page(self, user_id, after, limit):
+        """user_id 发出的待处理申请中序号大于 after 的前 limit 条，返回 (申请列表, 是否还有)"""
+        return self._page(self.outgoing, user_id, after, limit)
+
+    def _page(self, index, user_id, after, limit):
+        with self._lock:
+            records = index.get(user_id, ())
+            page = []
+            for i in range(self._position(records, after + 1), len(records)):
+                record = records[i]
+                if not self._live(record):
+                    continue
+                if len(page) == limit:
+                    return page, True
+                page.append(record)
+            return page, False
+
+    @staticmethod
+    def _position(records, seq):
+        """records 中第一条序号不小于 seq 的位置"""
+        low, high = 0, len(records)
+        while low < high:
+            middle = (low + high) // 2
+            if records[middle]['seq'] < seq:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def _list(index, user_id):
+        """用户的记录列表，没有时新建（需持有锁）"""
+        records = index.get(user_id)
+        if records is None:
+            records = index[user_id] = _RecordList()
+        return records
+
+    def _insert(self, records, record):
+        """按序号插入；提交和建索引不在同一把锁里，并发提交时后到的序号可能更小（需持有锁）
+
+        删除后又放回的记录如果还留在列表里，只把它重新算作待处理。
+        """
+        if not records or records[-1]['seq'] < record['seq']:
+            records.append(record)
+            return
+        position = self._position(records, record['seq'])
+        if position < len(records) and records[position] is record:
+            records.dead -= 1
+        else:
+            records.insert(position, record)
+
+    def _release(self, record):
+        """记录不再待处理：两个列表的 dead 各加一，全部失效时删除列表，超过一半时压缩（需持有锁）"""
+        for index, user_id in ((self.received, record['to_user_id']), (self.outgoing, record['from_user_id'])):
+            records = index.get(user_id)
+            if records is None:
+                continue
+            records.dead += 1
+            if records.dead >= len(records):
+                del index[user_id]
+            elif records.dead * 2 > len(records):
+                records[:] = [kept for kept in records if self._live(kept)]
+                records.dead = 0
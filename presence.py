@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在线状态 - 心跳驱动，连续错过若干次心跳的用户自动下线
+到期检查用时间轮，每个刻度只处理到期的那一格，不扫描全部用户
+"""
+
+import threading
+import time
+
+
+class PresenceTracker:
+    """在线状态跟踪
+
+    用户第一次出现时分配一个内部编号，在线标记存放在按编号索引的 bytearray 里。
+    时间轮每格 tick_seconds 秒，每个在线用户挂在它到期的那一格上；
+    心跳只更新到期刻度，不移动用户，轮到那一格时还没到期再挂到新的格子上。
+    connect / disconnect 之间（长轮询、SSE、WebSocket 连接保持期间）不会过期。
+    状态变化时调用 on_change(user_id, online)，调用时不持有内部锁。
+    """
+
+    def __init__(self, on_change, tick_seconds=5, missed_heartbeats=3):
+        self.on_change = on_change
+        self.tick_seconds = tick_seconds
+        self.timeout_ticks = missed_heartbeats + 1  # 多留一格，刻度取整不会提前下线
+        self.wheel = [set() for _ in range(self.timeout_ticks + 1)]
+        self.numbers = {}  # user_id -> 内部编号
+        self.user_ids = []  # 内部编号 -> user_id
+        self.online = bytearray()  # 内部编号 -> 是否在线
+        self.deadlines = []  # 内部编号 -> 到期刻度
+        self.holds = []  # 内部编号 -> 保持中的连接数
+        self.online_count = 0
+        self.expired = 0
+        self.tick = self._now_tick()
+        self.running = False
+        self._lock = threading.Lock()
+
+    def _now_tick(self):
+        return int(time.monotonic() / self.tick_seconds)
+
+    def _number(self, user_id):
+        """用户的内部编号，第一次出现时分配（需持有锁）"""
+        number = self.numbers.get(user_id)
+        if number is None:
+            number = len(self.user_ids)
+            self.numbers[user_id] = number
+            self.user_ids.append(user_id)
+            self.online.append(0)
+            self.deadlines.append(0)
+            self.holds.append(0)
+        return number
+
+    def _refresh(self, number):
+        """推迟到期刻度，原来不在线的挂到时间轮上并返回 True（需持有锁）"""
+        deadline = self._now_tick() + self.timeout_ticks
+        self.deadlines[number] = deadline
+        if self.online[number]:
+            return False
+        self.online[number] = 1
+        self.online_count += 1
+        self.wheel[deadline % len(self.wheel)].add(number)
+        return True
+
+    def touch(self, user_id):
+        """记录一次心跳"""
+        with self._lock:
+            came_online = self._refresh(self._number(user_id))
+        if came_online:
+            self.on_change(user_id, True)
+
+    def connect(self, user_id):
+        """连接建立：连接保持期间不会过期"""
+        with self._lock:
+            number = self._number(user_id)
+            self.holds[number] += 1
+            came_online = self._refresh(number)
+        if came_online:
+            self.on_change(user_id, True)
+
+    def disconnect(self, user_id):
+        """连接断开：从现在开始按心跳计算过期，断线重连不会造成上下线抖动"""
+        with self._lock:
+            number = self.numbers.get(user_id)
+            if number is None:
+                return
+            self.holds[number] = max(self.holds[number] - 1, 0)
+            self.deadlines[number] = self._now_tick() + self.timeout_ticks
+
+    def is_online(self, user_id):
+        number = self.numbers.get(user_id)
+        return number is not None and bool(self.online[number])
+
+    def advance(self):
+        """处理到当前刻度为止到期的格子，返回本次下线的用户数"""
+        went_offline = []
+        with self._lock:
+            now = self._now_tick()
+            size = len(self.wheel)
+            # 落后超过一圈时每一格只需处理一次
+            for tick in range(max(self.tick + 1, now - size + 1), now + 1):
+                due = self.wheel[tick % size]
+                self.wheel[tick % size] = set()
+                for number in due:
+                    if self.holds[number]:
+                        self.deadlines[number] = max(self.deadlines[number], now + self.timeout_ticks)
+                    deadline = self.deadlines[number]
+                    if deadline > now:
+                        self.wheel[deadline % size].add(number)
+                    else:
+                        self.online[number] = 0
+                        self.online_count -= 1
+                        went_offline.append(self.user_ids[number])
+            self.tick = max(self.tick, now)
+            self.expired += len(went_offline)
+
+        for user_id in went_offline:
+            self.on_change(user_id, False)
+        return len(went_offline)
+
+    def start(self):
+        """启动后台线程，每个刻度推进一次时间轮"""
+        if self.running:
+            return
+        self.running = True
+        thread = threading.Thread(target=self._loop)
+        thread.daemon = True
+        thread.start()
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.tick_seconds)
+            try:
+                self.advance()
+            except Exception as e:
+                print(f"❌ 在线状态检查失败: {e}")
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {
+            'online': self.online_count,
+            'tracked': len(self.user_ids),
+            'expired': self.expired,
+            'heartbeat_timeout': self.timeout_ticks * self.tick_seconds
+        }
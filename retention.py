@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+过期数据清理 - 后台线程按保留时间清理信箱消息和长期未处理的申请
+每次只工作一个很短的时间片，处理完一片就让出 CPU，不会长时间阻塞请求线程
+"""
+
+import threading
+import time
+
+
+class RetentionSweeper:
+    """后台清理线程
+
+    tasks 为 (名称, keys, sweep) 列表：keys() 返回本轮要检查的键（快照），
+    sweep(key, now) 清理一个键下的过期数据并返回清理的条数。
+    每轮依次执行所有任务，连续工作满 slice_seconds 后暂停 pause_seconds，
+    一轮结束后等待 interval 秒开始下一轮。
+    """
+
+    def __init__(self, tasks, interval=60, slice_seconds=0.005, pause_seconds=0.005):
+        self.tasks = tasks
+        self.interval = interval
+        self.slice_seconds = slice_seconds
+        self.pause_seconds = pause_seconds
+        self.running = False
+        self.runs = 0
+        self.reclaimed = {name: 0 for name, _, _ in tasks}  # 累计清理条数
+        self.last_reclaimed = {name: 0 for name, _, _ in tasks}  # 上一轮清理条数
+        self.last_run_seconds = 0.0  # 上一轮实际工作时间（不含暂停）
+        self.last_run_slices = 0  # 上一轮分成的时间片数
+
+    def start(self):
+        """启动后台线程"""
+        if self.running or self.interval <= 0:
+            return
+        self.running = True
+        thread = threading.Thread(target=self._loop)
+        thread.daemon = True
+        thread.start()
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ 过期数据清理失败: {e}")
+
+    def run_once(self):
+        """执行一轮清理，返回本轮各任务清理的条数"""
+        now = time.time()
+        reclaimed = {name: 0 for name, _, _ in self.tasks}
+        busy = 0.0
+        slices = 1
+        slice_start = time.perf_counter()
+
+        for name, keys, sweep in self.tasks:
+            for key in keys():
+                reclaimed[name] += sweep(key, now)
+                elapsed = time.perf_counter() - slice_start
+                if elapsed >= self.slice_seconds:
+                    # 时间片用完，暂停一下让请求线程拿到 GIL
+                    busy += elapsed
+                    slices += 1
+                    time.sleep(self.pause_seconds)
+                    slice_start = time.perf_counter()
+        busy += time.perf_counter() - slice_start
+
+        for name, count in reclaimed.items():
+            self.reclaimed[name] += count
+        self.last_reclaimed = reclaimed
+        self.last_run_seconds = busy
+        self.last_run_slices = slices
+        self.runs += 1
+        return reclaimed
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {
+            'runs': self.runs,
+            'reclaimed': dict(self.reclaimed),
+            'last_reclaimed': dict(self.last_reclaimed),
+            'last_run_ms': round(self.last_run_seconds * 1000, 3),
+            'last_run_slices': self.last_run_slices
+        }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户搜索索引 - 按昵称和用户ID前缀搜索，昵称支持三元组模糊匹配
+注册和改昵称时增量更新，查询不扫描全部用户
+"""
+
+import math
+import threading
+import unicodedata
+from array import array
+from itertools import islice
+
+
+def normalize(text):
+    """搜索用的规范形式：全角转半角、忽略大小写、去掉首尾空白"""
+    return unicodedata.normalize('NFKC', text).casefold().strip()
+
+
+def trigrams(key):
+    """规范化后的字符串的三元组集合，前面补两个空格、后面补一个，短昵称和开头的字符也能匹配"""
+    padded = '  ' + key + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UserSearchIndex:
+    """用户搜索索引
+
+    用户第一次加入时分配一个内部编号；names / ids 按编号保存规范化后的昵称和用户ID
+    （与原字符串相同时直接引用原字符串，不另占内存）。
+    by_name / by_id 是按 (规范化的键, 用户ID) 排好序的编号数组，前缀查询二分定位后顺序读取；
+    grams 为昵称三元组 -> 编号数组，模糊查询只合并最少见的几个三元组的编号再逐个打分。
+
+    查询结果依次为：用户ID完全匹配、昵称前缀匹配（完全相同的排在最前）、用户ID前缀匹配、
+    昵称模糊匹配（按相似度从高到低，输入的是完整用户ID时不做），同一个用户只出现一次。
+    模糊匹配最多给 fuzzy_candidates 个候选打分，常见三元组很多时结果只是近似的前几名。
+    """
+
+    def __init__(self, fuzzy_threshold=0.3, fuzzy_candidates=2000):
+        self.fuzzy_threshold = fuzzy_threshold  # 模糊匹配的最低相似度（三元组的 Jaccard 系数）
+        self.fuzzy_candidates = fuzzy_candidates  # 模糊匹配最多打分的候选数
+        self.numbers = {}  # user_id -> 内部编号
+        self.user_ids = []  # 内部编号 -> user_id
+        self.names = []  # 内部编号 -> 规范化的昵称
+        self.ids = []  # 内部编号 -> 规范化的用户ID
+        self.by_name = []  # 按 (names[编号], user_id) 排序的编号
+        self.by_id = []  # 按 (ids[编号], user_id) 排序的编号
+        self.grams = {}  # 昵称三元组 -> array('I') 编号
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @staticmethod
+    def _key(text):
+        key = normalize(text)
+        return text if key == text else key
+
+    def put(self, user_id, user_name):
+        """加入新用户或更新昵称"""
+        name = self._key(user_name)
+        with self._lock:
+            number = self.numbers.get(user_id)
+            if number is None:
+                number = len(self.user_ids)
+                self.numbers[user_id] = number
+                self.user_ids.append(user_id)
+                self.names.append(name)
+                self.ids.append(self._key(user_id))
+                self.by_id.insert(self._lower_bound(self.by_id, self.ids, self.ids[number], user_id), number)
+            elif self.names[number] == name:
+                return
+            else:
+                del self.by_name[self._lower_bound(self.by_name, self.names, self.names[number], user_id)]
+                self._remove_grams(number)
+                self.names[number] = name
+            self.by_name.insert(self._lower_bound(self.by_name, self.names, name, user_id), number)
+            self._add_grams(number)
+
+    def _add_grams(self, number):
+        for gram in trigrams(self.names[number]):
+            postings = self.grams.get(gram)
+            if postings is None:
+                postings = self.grams[gram] = array('I')
+            postings.append(number)
+
+    def _remove_grams(self, number):
+        for gram in trigrams(self.names[number]):
+            postings = self.grams[gram]
+            postings.remove(number)
+            if not postings:
+                del self.grams[gram]
+
+    def _lower_bound(self, order, keys, key, user_id=''):
+        """order 中第一个 (keys[编号], user_id) 不小于 (key, user_id) 的位置"""
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            number = order[middle]
+            if (keys[number], self.user_ids[number]) < (key, user_id):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _prefix(self, order, keys, prefix):
+        """键以 prefix 开头的编号，按键的顺序逐个产生（需持有锁）"""
+        for position in range(self._lower_bound(order, keys, prefix), len(order)):
+            number = order[position]
+            if not keys[number].startswith(prefix):
+                return
+            yield number
+
+    def _fuzzy(self, query):
+        """昵称与 query 三元组相似度不低于阈值的编号，按相似度从高到低排列（需持有锁）"""
+        query_grams = trigrams(query)
+        # 相似度 >= t 的昵称至少包含 query 的 ceil(t * |Q|) 个三元组，
+        # 所以一定出现在最少见的 |Q| - ceil(t * |Q|) + 1 个三元组的编号数组里，只需合并这几个
+        required = max(1, math.ceil(self.fuzzy_threshold * len(query_grams)))
+        postings = sorted((self.grams.get(gram, ()) for gram in query_grams), key=len)
+        candidates = set()
+        for numbers in postings[:len(query_grams) - required + 1]:
+            candidates.update(islice(numbers, self.fuzzy_candidates - len(candidates)))
+            if len(candidates) >= self.fuzzy_candidates:
+                break
+
+        scored = []
+        for number in candidates:
+            name_grams = trigrams(self.names[number])
+            shared = len(query_grams & name_grams)
+            score = shared / (len(query_grams) + len(name_grams) - shared)
+            if score >= self.fuzzy_threshold:
+                scored.append((-score, self.names[number], self.user_ids[number], number))
+        scored.sort()
+        return [entry[3] for entry in scored]
+
+    def _matches(self, query):
+        """按排名顺序逐个产生匹配的 user_id（需持有锁）"""
+        seen = set()
+        number = self.numbers.get(query)
+        if number is None:
+            position = self._lower_bound(self.by_id, self.ids, query)
+            if position < len(self.by_id) and self.ids[self.by_id[position]] == query:
+                number = self.by_id[position]
+        if number is not None:
+            seen.add(number)
+            yield self.user_ids[number]
+        exact_id = number is not None
+        for tier in (self._prefix(self.by_name, self.names, query),
+                     self._prefix(self.by_id, self.ids, query)):
+            for number in tier:
+                if number not in seen:
+                    seen.add(number)
+                    yield self.user_ids[number]
+        if exact_id:
+            return  # 输入的是完整的用户ID，不再按昵称模糊匹配
+        for number in self._fuzzy(query):
+            if number not in seen:
+                yield self.user_ids[number]
+
+    def search(self, text, offset=0, limit=20, exclude=None):
+        """排名第 offset 起的 limit 个 user_id，返回 (user_id 列表, 后面是否还有)
+
+        exclude(user_id) 为真的用户不出现在结果里，也不占排名（翻页的 offset 不受影响）。
+        """
+        query = normalize(text)
+        if not query:
+            return [], False
+        results = []
+        with self._lock:
+            matches = self._matches(query)
+            if exclude is not None:
+                matches = (user_id for user_id in matches if not exclude(user_id))
+            for index, user_id in enumerate(matches):
+                if index >= offset + limit:
+                    return results, True
+                if index >= offset:
+                    results.append(user_id)
+        return results, False
+
+    def stats(self):
+        """供首页展示的统计信息"""
+        return {'users': len(self.user_ids), 'trigrams': len(self.grams)}
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器测试的公共夹具 - 每个测试重新加载 friend_server，得到一份全新的内存状态
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def server():
+    """全新状态的 friend_server 模块（后台线程只由 start_background() 启动，导入和重新加载时不会启动）"""
+    import friend_server
+    return importlib.reload(friend_server)
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """注册用户，返回 user_id"""
+    def register(*user_ids):
+        for user_id in user_ids:
+            response = client.post('/register_user', json={'user_id': user_id, 'user_name': user_id.upper()})
+            assert response.status_code == 200
+        return user_ids[0] if len(user_ids) == 1 else user_ids
+    return register
+
+
+@pytest.fixture
+def befriend(client):
+    """a 向 b 发送好友申请，b 接受"""
+    def befriend(a, b):
+        assert client.post('/send_friend_request', json={'from_user_id': a, 'from_user_name': a.upper(), 'to_user_id': b}).status_code == 200
+        assert client.post('/accept_friend_request', json={'user_id': b, 'from_user_id': a}).status_code == 200
+    return befriend
+
+
+@pytest.fixture
+def pair(client):
+    """a 向 b 发送情侣申请，b 接受"""
+    def pair(a, b):
+        assert client.post('/send_couple_request', json={'from_user_id': a, 'from_user_name': a.upper(), 'to_user_id': b}).status_code == 200
+        assert client.post('/accept_couple_request', json={'user_id': b, 'from_user_id': a}).status_code == 200
+    return pair
+
+
+@pytest.fixture
+def send(client):
+    """发送一条消息"""
+    def send(user_id, message_type='chat', target_user_id=None, message=''):
+        payload = {'user_id': user_id, 'type': message_type, 'message': message}
+        if target_user_id:
+            payload['target_user_id'] = target_user_id
+        assert client.post('/send', json=payload).status_code == 200
+    return send
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+删除好友和屏蔽的测试 - 关系、申请和消息随之清理，屏蔽的人不出现在推荐和搜索里
+"""
+
+
+def _block(client, user_id, target_user_id):
+    assert client.post('/block_user', json={'user_id': user_id, 'target_user_id': target_user_id}).status_code == 200
+
+
+def _friend_ids(client, user_id):
+    return sorted(friend['user_id'] for friend in client.get('/friends', query_string={'user_id': user_id}).get_json()['friends'])
+
+
+def _suggested(client, user_id, limit=10):
+    data = client.get('/friend_suggestions', query_string={'user_id': user_id, 'limit': limit}).get_json()
+    return [suggestion['user_id'] for suggestion in data['suggestions']]
+
+
+def _found(client, query, searcher_id):
+    data = client.get('/search_user', query_string={'q': query, 'from_user_id': searcher_id}).get_json()
+    return [user['user_id'] for user in data['users']]
+
+
+def test_unfriend_updates_both_lists_and_suggestions(client, register, befriend):
+    register('alice', 'bob', 'carol')
+    befriend('alice', 'bob')
+    befriend('bob', 'carol')
+    assert _suggested(client, 'alice') == ['carol']
+
+    assert client.post('/remove_friend', json={'user_id': 'bob', 'friend_id': 'alice'}).status_code == 200
+    assert _friend_ids(client, 'alice') == [] and _friend_ids(client, 'bob') == ['carol']
+    assert _suggested(client, 'alice') == []
+    assert client.post('/remove_friend', json={'user_id': 'bob', 'friend_id': 'alice'}).status_code == 404
+
+
+def test_block_removes_friendship_requests_and_messages(client, register, befriend, pair, send):
+    register('alice', 'bob')
+    pair('alice', 'bob')
+    befriend('alice', 'bob')
+    _block(client, 'bob', 'alice')
+
+    assert _friend_ids(client, 'bob') == []
+    assert client.get('/couple_status', query_string={'user_id': 'bob'}).get_json()['has_couple'] is False
+    response = client.post('/send_friend_request', json={'from_user_id': 'alice', 'from_user_name': 'ALICE', 'to_user_id': 'bob'})
+    assert response.status_code == 403
+    response = client.post('/send', json={'user_id': 'alice', 'type': 'note', 'target_user_id': 'bob', 'message': 'hi'})
+    assert response.status_code == 403
+    assert client.get('/blocked_users', query_string={'user_id': 'bob'}).get_json() == {'blocked': ['alice']}
+
+
+def test_block_withdraws_pending_request_notifications(server, client, register):
+    register('alice', 'bob')
+    for path in ('/send_friend_request', '/send_couple_request'):
+        assert client.post(path, json={'from_user_id': 'alice', 'from_user_name': 'ALICE', 'to_user_id': 'bob'}).status_code == 200
+    size = server.messages.budget.stats()['messages']
+    _block(client, 'bob', 'alice')
+
+    inbox = client.get('/messages', query_string={'user_id': 'bob'}).get_json()['messages']
+    assert [message['type'] for message in inbox] == []
+    assert client.get('/friend_requests', query_string={'user_id': 'bob'}).get_json()['requests'] == []
+    assert len(server.messages['bob']) == 0
+    assert server.messages.budget.stats()['messages'] == size - 2
+
+
+def test_blocked_users_are_not_suggested_either_way(client, register, befriend):
+    register('alice', 'bob', 'carol', 'dave')
+    for friend_id in ('alice', 'carol', 'dave'):
+        befriend(friend_id, 'bob')
+    assert sorted(_suggested(client, 'alice')) == ['carol', 'dave']
+
+    _block(client, 'carol', 'alice')  # 对方屏蔽了自己
+    assert _suggested(client, 'alice', 1) == ['dave']  # 屏蔽的人不占 limit 的名额
+    assert _suggested(client, 'carol') == ['dave']
+
+    assert client.post('/unblock_user', json={'user_id': 'carol', 'target_user_id': 'alice'}).status_code == 200
+    assert sorted(_suggested(client, 'alice')) == ['carol', 'dave']
+
+
+def test_blocked_users_are_hidden_from_search(client, register):
+    register('cat_1', 'cat_2', 'cat_3', 'searcher')
+    _block(client, 'searcher', 'cat_1')
+    _block(client, 'cat_2', 'searcher')
+
+    assert _found(client, 'cat', 'searcher') == ['cat_3']
+    assert _found(client, 'cat', 'cat_3') == ['cat_1', 'cat_2', 'cat_3']
+    # 屏蔽的人不占排名，第一页就是没有被屏蔽的结果
+    data = client.get('/search_user', query_string={'q': 'cat', 'limit': 1, 'from_user_id': 'searcher'}).get_json()
+    assert [user['user_id'] for user in data['users']] == ['cat_3'] and data['next_cursor'] is None
+    assert client.get('/search_user', query_string={'user_id': 'cat_1', 'from_user_id': 'searcher'}).status_code == 404
+    assert client.get('/search_user', query_string={'user_id': 'cat_1'}).status_code == 200
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友广播（读时合并）的测试 - 只投递给好友、游标不早于投递游标
+"""
+
+
+def _texts(data):
+    return [message['message'] for message in data['messages']]
+
+
+def test_broadcast_reaches_friends_only(client, register, befriend, send):
+    register('alice', 'bob', 'carol')
+    befriend('alice', 'bob')
+    send('alice', message='hello')
+
+    bob = client.get('/messages', query_string={'user_id': 'bob'}).get_json()
+    carol = client.get('/messages', query_string={'user_id': 'carol'}).get_json()
+    assert 'hello' in _texts(bob)
+    assert _texts(carol) == []
+
+
+def test_new_friend_does_not_see_older_broadcasts(client, register, befriend, send):
+    register('alice', 'bob')
+    send('alice', message='before')
+    befriend('alice', 'bob')
+    send('alice', message='after')
+
+    data = client.get('/messages', query_string={'user_id': 'bob'}).get_json()
+    assert 'before' not in _texts(data)
+    assert 'after' in _texts(data)
+
+
+def test_acked_broadcasts_are_not_redelivered(server, client, register, befriend, send):
+    register('alice', 'bob')
+    befriend('alice', 'bob')
+    send('alice', message='hello')
+    seq = server.committed_seq()
+    client.post('/ack', json={'user_id': 'bob', 'seq': seq})
+
+    # 广播留在发送者的日志里，落后于投递游标的 after 不能把它再读出来
+    for params in ({'after': 0}, {}, {'timestamp': 0}):
+        data = client.get('/messages', query_string=dict(params, user_id='bob')).get_json()
+        assert _texts(data) == [], params
+    data = client.post('/sync', json={'user_id': 'bob', 'after': 0}).get_json()
+    assert _texts(data) == []
+    assert server._socket_backlog('bob', None) == []
+    assert server._socket_backlog('bob', 0) == []
+
+
+def test_refriending_resets_broadcast_start(client, register, befriend, send):
+    register('alice', 'bob')
+    befriend('alice', 'bob')
+    assert client.post('/remove_friend', json={'user_id': 'bob', 'friend_id': 'alice'}).status_code == 200
+    send('alice', message='while apart')
+    befriend('alice', 'bob')
+    send('alice', message='again')
+
+    texts = _texts(client.get('/messages', query_string={'user_id': 'bob'}).get_json())
+    assert 'while apart' not in texts
+    assert 'again' in texts
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端 FriendNetworkManager 的测试 - 不连接服务器，只检查本地的同步逻辑（需要 PyQt5）
+"""
+
+import pytest
+import requests
+
+pytest.importorskip('PyQt5')
+
+import friend_network_manager
+from friend_network_manager import FriendNetworkManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = FriendNetworkManager('http://127.0.0.1:9')
+    manager.user_id = 'bob'
+    manager.resent = []
+    monkeypatch.setattr(manager, '_request_resend', lambda *gap: manager.resent.append(gap))
+    return manager
+
+
+def test_gap_covered_by_later_superseding_message_is_not_resent(manager):
+    manager._check_sender_seq('alice', 1)
+    manager._check_sender_seq('alice', 3)  # 2 暂时是缺口
+    manager._check_sender_seq('alice', 5, [[2, 2], [4, 4]])
+    manager._flush_gaps()
+    assert manager.resent == []
+
+
+def test_real_gap_is_resent_once_after_batch(manager):
+    manager._check_sender_seq('alice', 1)
+    manager._check_sender_seq('alice', 6, [[3, 3]])
+    assert manager.resent == []
+    manager._flush_gaps()
+    assert manager.resent == [('alice', 2, 2), ('alice', 4, 5)]
+    manager._flush_gaps()
+    assert len(manager.resent) == 2
+
+
+def test_partner_change_forgets_old_sender_seqs(manager, monkeypatch):
+    monkeypatch.setattr(manager, 'fetch_pet_state', lambda: None)
+    manager._update_couple_partner({'has_couple': True, 'partner': {'user_id': 'alice'}})
+    manager._check_sender_seq('alice', 1)
+    manager._check_sender_seq('alice', 4)
+    manager._update_couple_partner({'has_couple': True, 'partner': {'user_id': 'carol'}})
+    assert 'alice' not in manager.pet_action_seqs
+    manager._flush_gaps()
+    assert manager.resent == []
+
+
+def test_resent_state_action_is_applied_after_newer_other_field(manager):
+    applied = []
+    manager.pet_action_received.connect(lambda *action: applied.append(action))
+    # 漏掉 1:emotion:happy（版本 10），先收到 2:control:a（版本 11），补发回来的表情仍要应用
+    manager._apply_pet_action({'message': '2:control:a', 'state_version': 11})
+    manager._apply_pet_action({'message': '1:emotion:happy', 'state_version': 10})
+    assert applied == [(2, 'control', 'a'), (1, 'emotion', 'happy')]
+    # 同一项状态的旧版本和快照里已包含的动作不再应用
+    manager._apply_pet_action({'message': '2:control:b', 'state_version': 9})
+    manager.pet_state_version = 20
+    manager._apply_pet_action({'message': '1:emotion:sad', 'state_version': 15})
+    assert len(applied) == 2
+
+
+@pytest.fixture
+def slow_network(monkeypatch):
+    """假的时钟和 requests.post：每次请求耗时 cost 秒后抛出 error，返回 (时钟, 每次请求的超时)"""
+    clock = [0.0]
+    timeouts = []
+
+    def install(cost, error):
+        def post(url, json=None, headers=None, timeout=None):
+            timeouts.append(timeout)
+            clock[0] += min(cost, timeout)
+            raise error()
+        monkeypatch.setattr(friend_network_manager.requests, 'post', post)
+
+    monkeypatch.setattr(friend_network_manager.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(friend_network_manager.time, 'sleep', lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    return clock, timeouts, install
+
+
+def test_post_timeouts_stay_within_deadline(manager, slow_network):
+    clock, timeouts, install = slow_network
+    install(60, requests.Timeout)
+    with pytest.raises(requests.Timeout):
+        manager._post('/send', {})
+    assert clock[0] <= friend_network_manager.POST_DEADLINE
+    assert timeouts == [friend_network_manager.POST_DEADLINE]
+
+
+def test_post_retries_fast_failures_with_remaining_time(manager, slow_network):
+    clock, timeouts, install = slow_network
+    install(0.5, requests.ConnectionError)
+    with pytest.raises(requests.ConnectionError):
+        manager._post('/send', {})
+    assert len(timeouts) == friend_network_manager.POST_RETRIES + 1
+    assert timeouts == sorted(timeouts, reverse=True)
+    assert clock[0] <= friend_network_manager.POST_DEADLINE
+
+
+def test_section_changed_frames_refresh_statuses(manager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(manager, 'fetch_friends_status', lambda: calls.append('friends'))
+    monkeypatch.setattr(manager, '_get_json', lambda path, params: (
+        calls.append(path), (200, {'has_couple': True, 'partner': {'user_id': 'alice'}}))[1])
+    monkeypatch.setattr(manager, 'fetch_pet_state', lambda: calls.append('pet_state'))
+    manager.sync_cache['couple'] = {'has_couple': False}
+
+    manager._handle_section_changed({'type': 'section_changed', 'section': 'friends'})
+    assert calls == ['friends']
+    del calls[:]
+    manager._handle_section_changed({'type': 'section_changed', 'section': 'couple'})
+    assert calls == ['/couple_status', 'pet_state', 'friends']
+    assert manager.couple_partner_id == 'alice'
+    del calls[:]
+    manager._handle_section_changed({'type': 'section_changed', 'section': 'friend_requests'})
+    assert calls == []
+
+
+def test_friend_pages_follow_cursor_and_getter_is_one_request(manager, monkeypatch):
+    requests_made = []
+    pages = {None: {'friends': [{'user_id': 'a'}, {'user_id': 'b'}], 'next_cursor': 'Yg'},
+             'Yg': {'friends': [{'user_id': 'c'}], 'next_cursor': None}}
+
+    def get_json(path, params):
+        requests_made.append(dict(params))
+        if 'limit' not in params:
+            return 200, {'friends': pages[None]['friends'] + pages['Yg']['friends']}
+        return 200, pages[params.get('cursor')]
+    monkeypatch.setattr(manager, '_get_json', get_json)
+    manager.server_features = {'pagination'}
+
+    iterator = manager.iter_friends_pages()
+    assert [friend['user_id'] for friend in next(iterator)] == ['a', 'b']
+    assert len(requests_made) == 1  # 第一页交给界面之前不请求下一页
+    assert [friend['user_id'] for friend in next(iterator)] == ['c']
+    assert list(iterator) == []
+    assert requests_made[1]['cursor'] == 'Yg'
+
+    del requests_made[:]
+    assert [friend['user_id'] for friend in manager.get_friends_list()] == ['a', 'b', 'c']
+    assert requests_made == [{'user_id': 'bob'}]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+状态类宠物动作合并的测试 - 同一 key 只保留最新一条，其他消息的顺序不变
+"""
+
+from message_store import Mailbox
+
+
+def _message(text):
+    return {'type': 'pet_action', 'message': text, 'timestamp': 1}
+
+
+def test_keyed_message_replaces_unacked_one():
+    mailbox = Mailbox()
+    mailbox.append(_message('1:emotion:happy'), key=('alice', '1', 'emotion'))
+    mailbox.append(_message('1:pat:head'))
+    mailbox.append(_message('1:emotion:sad'), key=('alice', '1', 'emotion'))
+    mailbox.append(_message('2:emotion:calm'), key=('alice', '2', 'emotion'))
+
+    texts = [message['message'] for message in mailbox.read_after(0)]
+    assert texts == ['1:pat:head', '1:emotion:sad', '2:emotion:calm']
+    assert mailbox.coalesced == 1
+    assert len(mailbox) == 3
+
+
+def test_acked_message_is_not_replaced():
+    mailbox = Mailbox()
+    first = mailbox.append(_message('1:emotion:happy'), key='emotion')
+    mailbox.ack(first)
+    mailbox.append(_message('1:emotion:sad'), key='emotion')
+
+    assert [message['message'] for message in mailbox.read_after(0)] == ['1:emotion:sad']
+    assert mailbox.coalesced == 0
+
+
+def test_replacement_does_not_count_against_capacity():
+    mailbox = Mailbox(capacity=2, policy='drop_newest')
+    mailbox.append(_message('chat'))
+    mailbox.append(_message('1:emotion:happy'), key='emotion')
+    assert mailbox.append(_message('1:emotion:sad'), key='emotion') is not None
+    assert [message['message'] for message in mailbox.read_after(0)] == ['chat', '1:emotion:sad']
+
+
+def test_pet_actions_coalesce_in_partner_mailbox(server, client, register, pair):
+    register('alice', 'bob')
+    pair('alice', 'bob')
+    for text in ('1:emotion:happy', '1:dance:spin', '1:emotion:sad', '1:emotion:angry'):
+        client.post('/send', json={'user_id': 'alice', 'type': 'pet_action', 'message': text})
+
+    data = client.get('/messages', query_string={'user_id': 'bob'}).get_json()
+    texts = [message['message'] for message in data['messages'] if message['type'] == 'pet_action']
+    assert texts == ['1:dance:spin', '1:emotion:angry']
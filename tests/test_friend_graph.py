@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友关系图的测试 - CSR 快照加增删覆盖层与朴素的集合实现结果一致（含成为好友时的序号），
+推荐缓存按受影响用户失效
+"""
+
+import random
+from collections import Counter, defaultdict
+
+from friend_graph import FriendGraph
+from user_store import UserTable
+
+
+def _naive_suggestions(friends, user_id):
+    counts = Counter()
+    for friend_id in friends[user_id]:
+        counts.update(friends[friend_id])
+    counts.pop(user_id, None)
+    for friend_id in friends[user_id]:
+        counts.pop(friend_id, None)
+    return counts
+
+
+def test_random_edits_match_set_model_across_rebuilds():
+    rng = random.Random(7)
+    graph = FriendGraph(top_k=100, rebuild_min=8)
+    friends = defaultdict(set)
+    since = {}
+    user_ids = [f'user_{i}' for i in range(30)]
+    for step in range(600):
+        a, b = rng.sample(user_ids, 2)
+        if rng.random() < 0.6:
+            graph.add_edge(a, b, step)
+            if b not in friends[a]:
+                since[(a, b)] = since[(b, a)] = step
+            friends[a].add(b)
+            friends[b].add(a)
+        else:
+            graph.remove_edge(a, b)
+            friends[a].discard(b)
+            friends[b].discard(a)
+        if step % 50 == 0:
+            user_id = rng.choice(user_ids)
+            graph.suggestions(user_id)  # 让缓存里有旧结果，检查失效
+
+        for user_id in rng.sample(user_ids, 3):
+            assert sorted(graph.friends_of(user_id)) == sorted(friends[user_id])
+            assert graph.degree(user_id) == len(friends[user_id])
+            assert sorted(graph.friends_since(user_id)) == sorted((friend_id, since[(user_id, friend_id)])
+                                                                  for friend_id in friends[user_id])
+            expected = _naive_suggestions(friends, user_id)
+            assert dict(graph.suggestions(user_id)) == dict(expected)
+            mutuals = [mutual for _, mutual in graph.suggestions(user_id)]
+            assert mutuals == sorted(mutuals, reverse=True)
+        assert graph.are_friends(a, b) == (b in friends[a])
+
+    assert graph.rebuilds > 0
+    assert graph.stats()['edges'] == sum(map(len, friends.values())) // 2
+
+
+def test_suggestion_cache_is_dropped_for_affected_users_only():
+    graph = FriendGraph()
+    for a, b in (('a', 'b'), ('b', 'c'), ('x', 'y'), ('y', 'z')):
+        graph.add_edge(a, b)
+    assert graph.suggestions('a') == [('c', 1)]
+    assert graph.suggestions('x') == [('z', 1)]
+    graph.add_edge('a', 'c')
+    assert graph.suggestions('a') == []
+    graph.suggestions('x')
+    assert graph.hits == 1 and graph.misses == 3
+
+
+def test_shared_numbering_with_user_table():
+    table = UserTable()
+    for user_id in ('a', 'b', 'c'):
+        table.add(user_id, user_id.upper())
+    graph = FriendGraph(numbering=table)
+    graph.add_edge('a', 'b')
+    graph.add_edge('b', 'c')
+    assert graph.suggestions('a', 1) == [('c', 1)]
+    assert graph.friends_of('unknown') == [] and graph.degree('unknown') == 0
+    graph.remove_edge('a', 'unknown')  # 不存在的用户直接忽略
+
+
+def test_readded_friend_gets_new_since_after_rebuild():
+    graph = FriendGraph(rebuild_min=1)
+    graph.add_edge('a', 'b', 5)  # 立即合并进快照
+    graph.remove_edge('a', 'b')
+    graph.add_edge('a', 'b', 9)
+    assert graph.friends_since('a') == [('b', 9)]
+    graph.add_edge('a', 'b', 12)  # 已经是好友，不变
+    assert graph.friends_since('b') == [('a', 9)]
+    assert graph.rebuilds >= 2 and graph.degree('a') == 1
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友列表视图的测试 - 视图只为最近读取过的用户保留，淘汰后现建的视图与增量更新的结果一致
+"""
+
+from friend_view import FriendView, FriendViewCache
+
+
+def test_cache_keeps_most_recently_read_views():
+    built = []
+
+    def build(user_id):
+        built.append(user_id)
+        return FriendView()
+
+    cache = FriendViewCache(build, capacity=2)
+    a = cache.get('a')
+    cache.get('b')
+    assert cache.get('a') is a  # a 变成最近使用的，淘汰 b
+    cache.get('c')
+    assert cache.peek('b') is None and cache.peek('a') is a
+    cache.get('b')
+    assert built == ['a', 'b', 'c', 'b']
+    assert cache.stats() == {'cached': 2, 'capacity': 2, 'cache_hits': 1, 'cache_misses': 4}
+
+
+def _friends(client, user_id):
+    return {friend['user_id']: friend['user_name']
+            for friend in client.get('/friends', query_string={'user_id': user_id}).get_json()['friends']}
+
+
+def test_evicted_views_are_rebuilt_with_current_names(server, client, register, befriend):
+    server.friend_views.capacity = 1
+    register('alice', 'bob', 'carol')
+    befriend('alice', 'bob')
+    befriend('carol', 'bob')
+    assert _friends(client, 'bob') == {'alice': 'ALICE', 'carol': 'CAROL'}
+    assert _friends(client, 'alice') == {'bob': 'BOB'}  # 淘汰 bob 的视图
+    assert server.friend_views.peek('bob') is None
+
+    client.post('/login_user', json={'user_id': 'carol', 'user_name': 'Carol 2'})
+    assert client.post('/remove_friend', json={'user_id': 'alice', 'friend_id': 'bob'}).status_code == 200
+    assert _friends(client, 'bob') == {'carol': 'Carol 2'}
+    # 已缓存的视图增量更新
+    client.post('/login_user', json={'user_id': 'carol', 'user_name': 'Carol 3'})
+    assert _friends(client, 'bob') == {'carol': 'Carol 3'}
+    assert _friends(client, 'alice') == {}
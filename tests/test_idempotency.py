@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+幂等键的测试 - 重试只执行一次、按用户区分、失败的请求不保存
+"""
+
+import threading
+
+from idempotency import IdempotencyCache
+
+
+def _request(client, from_user_id, to_user_id, key):
+    return client.post('/send_friend_request', headers={'Idempotency-Key': key},
+                       json={'from_user_id': from_user_id, 'from_user_name': from_user_id, 'to_user_id': to_user_id})
+
+
+def test_retry_with_same_key_is_replayed(server, client, register):
+    register('alice', 'bob')
+    first = _request(client, 'alice', 'bob', 'k1')
+    retry = _request(client, 'alice', 'bob', 'k1')
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_data() == first.get_data()
+    assert len(server.friend_requests.pending_for('bob')) == 1
+    assert len(server.messages['bob']) == 1
+
+
+def test_same_key_from_other_user_is_executed(server, client, register):
+    register('alice', 'carol', 'bob')
+    _request(client, 'alice', 'bob', 'shared')
+    response = _request(client, 'carol', 'bob', 'shared')
+
+    assert 'Idempotent-Replayed' not in response.headers
+    assert [record['from_user_id'] for record in server.friend_requests.pending_for('bob')] == ['alice', 'carol']
+
+
+def test_failed_request_is_not_stored(client, register):
+    register('alice')
+    assert _request(client, 'alice', 'bob', 'k2').status_code == 404
+    register('bob')
+    response = _request(client, 'alice', 'bob', 'k2')
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+
+
+def test_concurrent_duplicate_waits_for_first():
+    cache = IdempotencyCache(wait_timeout=5)
+    assert cache.begin('key') == ('new', None)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(cache.begin('key')))
+    waiter.start()
+    cache.store('key', 'response')
+    cache.finish('key')
+    waiter.join()
+    assert result == [('replay', 'response')]
+
+
+def test_pending_times_out():
+    cache = IdempotencyCache(wait_timeout=0.05)
+    cache.begin('key')
+    assert cache.begin('key') == ('pending', None)
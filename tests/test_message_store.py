@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+message_store 的单元测试 - 序号、确认、等待
+"""
+
+import threading
+import time
+
+from message_store import Mailbox, committed_seq, next_version
+
+
+def test_versions_do_not_consume_message_seqs():
+    mailbox = Mailbox()
+    mailbox.append({'type': 'chat', 'timestamp': 1})
+    first = committed_seq()
+    for _ in range(10):
+        next_version()
+    mailbox.append({'type': 'chat', 'timestamp': 2})
+    assert committed_seq() == first + 1
+
+
+def test_ack_ignores_cursor_beyond_committed_seq():
+    mailbox = Mailbox()
+    mailbox.append({'type': 'chat', 'timestamp': 1})
+    stale = committed_seq() + 1000  # 服务器上一次运行留下的游标
+    assert mailbox.ack(stale) == 0
+    assert mailbox.acked_seq == 0
+    assert len(mailbox) == 1
+
+
+def test_wait_after_returns_on_append_and_poke():
+    mailbox = Mailbox()
+    mailbox.append({'type': 'chat', 'timestamp': 1})
+    seq = committed_seq()
+
+    started = time.monotonic()
+    mailbox.wait_after(seq - 1, 5)  # 已经有更新的消息，不等待
+    assert time.monotonic() - started < 1
+
+    timer = threading.Timer(0.05, mailbox.append, [{'type': 'chat', 'timestamp': 2}])
+    timer.start()
+    started = time.monotonic()
+    assert mailbox.wait_after(seq, 5) is None
+    assert time.monotonic() - started < 1
+    timer.join()
+
+    pokes = mailbox.pokes
+    mailbox.poke()  # 记下次数之后、开始等待之前的 poke 同样让等待返回
+    started = time.monotonic()
+    mailbox.wait_after(committed_seq(), 5, pokes=pokes)
+    assert time.monotonic() - started < 1
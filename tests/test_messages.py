@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/messages、/sync、/ack、/stream 的测试 - 序号游标、确认与断点续传、服务器重启后的旧游标
+"""
+
+
+def _messages(client, user_id, **params):
+    response = client.get('/messages', query_string=dict(params, user_id=user_id))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_responses_carry_boot_id(server, client, register):
+    register('alice')
+    assert client.get('/').get_json()['boot'] == server.BOOT_ID
+    assert _messages(client, 'alice')['boot'] == server.BOOT_ID
+    assert client.post('/sync', json={'user_id': 'alice'}).get_json()['boot'] == server.BOOT_ID
+
+
+def test_version_bumps_do_not_advance_message_seq(server, client, register, befriend, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob')
+    before = server.committed_seq()
+    befriend('alice', 'bob')  # 申请和“已接受”通知各占一个序号，好友列表、好友状态的版本号不占
+    client.post('/login_user', json={'user_id': 'alice', 'user_name': 'ALICE'})
+    assert server.committed_seq() == before + 2
+
+
+def test_cursor_from_previous_run_does_not_hide_new_messages(server, client, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='hi')
+    stale = server.committed_seq() + 5000  # 上一次运行的序号跑得更远
+
+    data = _messages(client, 'bob', after=stale, ack=stale)
+    assert [message['message'] for message in data['messages']] == ['hi']
+    assert data['acked_seq'] == 0  # 旧游标不能把新消息确认掉
+
+
+def test_cursor_with_other_boot_id_restarts_from_acked_seq(server, client, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='one')
+    send('alice', target_user_id='bob', message='two')
+    old_cursor = server.committed_seq()  # 数值上落在本次运行的序号范围内
+
+    data = _messages(client, 'bob', after=old_cursor, ack=old_cursor, boot='stale')
+    assert [message['message'] for message in data['messages']] == ['one', 'two']
+    assert data['acked_seq'] == 0
+
+    data = _messages(client, 'bob', after=old_cursor, ack=old_cursor, boot=server.BOOT_ID)
+    assert data['messages'] == []
+    assert data['acked_seq'] == old_cursor
+
+
+def test_sync_and_ack_ignore_stale_boot(server, client, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='hi')
+    seq = server.committed_seq()
+
+    response = client.post('/ack', json={'user_id': 'bob', 'seq': seq, 'boot': 'stale'})
+    assert response.status_code == 200
+    data = client.post('/sync', json={'user_id': 'bob', 'after': seq, 'ack': seq, 'boot': 'stale'}).get_json()
+    assert [message['message'] for message in data['messages']] == ['hi']
+    assert data['acked_seq'] == 0
+
+
+def test_socket_backlog_resets_cursor_beyond_committed_seq(server, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='hi')
+    backlog = server._socket_backlog('bob', server.committed_seq() + 5000)
+    assert [message['message'] for message in backlog] == ['hi']
+
+
+def test_ack_releases_messages_and_moves_delivery_cursor(server, client, register, send):
+    register('alice', 'bob')
+    for text in ('one', 'two', 'three'):
+        send('alice', target_user_id='bob', message=text)
+    first = _messages(client, 'bob')['messages'][0]['seq']
+
+    response = client.post('/ack', json={'user_id': 'bob', 'seq': first})
+    assert response.get_json()['released'] == 1
+    assert response.get_json()['acked_seq'] == first
+    assert len(server.messages['bob']) == 2
+
+    # 不带游标时从投递游标继续，已确认的不再返回
+    data = _messages(client, 'bob')
+    assert [message['message'] for message in data['messages']] == ['two', 'three']
+    assert data['acked_seq'] == first
+
+
+def test_ack_parameter_on_read_resumes_after_reconnect(server, client, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='one')
+    seq = _messages(client, 'bob')['last_seq']
+    send('alice', target_user_id='bob', message='two')
+
+    # 客户端处理完第一条后断线，重连时只带 ack 不带 after
+    data = _messages(client, 'bob', ack=seq)
+    assert [message['message'] for message in data['messages']] == ['two']
+    assert data['acked_seq'] == seq
+
+    # ack 不会倒退
+    client.post('/ack', json={'user_id': 'bob', 'seq': seq - 1})
+    assert server.messages['bob'].acked_seq == seq
+
+
+def test_stream_resumes_from_last_event_id(server, client, register, send):
+    register('alice', 'bob')
+    send('alice', target_user_id='bob', message='one')
+    first = server.committed_seq()
+    send('alice', target_user_id='bob', message='two')
+
+    response = client.get('/stream', query_string={'user_id': 'bob'},
+                          headers={'Last-Event-ID': str(first)}, buffered=False)
+    assert response.headers['X-Boot-Id'] == server.BOOT_ID
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    chunk = next(chunks)
+    response.close()
+    assert b'"two"' in chunk and b'"one"' not in chunk
+    assert server.messages['bob'].acked_seq == first
+
+
+def test_stream_cap_stops_advertising_sse(server, client, register):
+    register('bob')
+    server.SSE_MAX_STREAMS = 1
+    assert 'sse' in client.get('/').get_json()['features']
+
+    response = client.get('/stream', query_string={'user_id': 'bob'}, buffered=False)
+    assert response.status_code == 200
+    assert 'sse' not in client.get('/').get_json()['features']
+    assert client.get('/stream', query_string={'user_id': 'bob'}).status_code == 503
+
+    response.close()  # 断开后归还名额
+    assert server.sse_streams == 0
+    assert 'sse' in client.get('/').get_json()['features']
+
+
+def test_non_finite_wait_is_rejected(client, register):
+    register('bob')
+    for wait in ('nan', 'inf', '-inf'):
+        assert client.get('/messages', query_string={'user_id': 'bob', 'wait': wait}).status_code == 400
+        assert client.post('/sync', json={'user_id': 'bob', 'wait': float(wait)}).status_code == 400
+
+
+def test_sync_cursor_is_clamped_like_messages(server, client, register, befriend, send):
+    register('alice', 'bob')
+    befriend('alice', 'bob')
+    old = server.committed_seq()
+    send('alice', message='broadcast')
+    client.post('/ack', json={'user_id': 'bob', 'seq': server.committed_seq()})
+
+    cursor = server._encode_cursor(old)
+    data = client.post('/sync', json={'user_id': 'bob', 'cursor': cursor, 'limit': 10}).get_json()
+    assert data['messages'] == []
+    assert _messages(client, 'bob', cursor=cursor, limit=10)['messages'] == []
+    # 上一次运行的游标从投递游标开始
+    data = client.post('/sync', json={'user_id': 'bob', 'cursor': cursor, 'limit': 10, 'boot': 'stale'}).get_json()
+    assert data['messages'] == []
+
+
+def test_batch_logs_failed_operation_with_traceback(server, client, register, monkeypatch, caplog):
+    register('alice')
+
+    def fail():
+        raise RuntimeError('boom')
+
+    monkeypatch.setitem(server.app.view_functions, 'get_friends', fail)
+    response = client.post('/batch', json={'operations': [{'op': 'friends', 'args': {'user_id': 'alice'}}]})
+    assert response.get_json()['results'] == [{'op': 'friends', 'status': 500, 'body': {'error': '操作执行失败'}}]
+    failure, = [record for record in caplog.records if record.exc_info]
+    assert failure.getMessage() == '批量操作 friends 执行失败'
+    assert failure.exc_info[0] is RuntimeError
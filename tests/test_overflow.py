@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+信箱容量和溢出策略的测试 - drop_oldest / drop_newest / summarize、全局预算、溢出计数
+"""
+
+import pytest
+
+from message_store import MailboxTable
+
+
+def _fill(mailbox, count, start=0):
+    for i in range(start, start + count):
+        mailbox.append({'type': 'chat', 'message': str(i), 'timestamp': float(i)})
+
+
+def _texts(mailbox):
+    return [message.get('message') for message in mailbox.read_after(0)]
+
+
+def test_drop_oldest_keeps_newest_messages():
+    table = MailboxTable(capacity=3, policy='drop_oldest')
+    _fill(table['bob'], 5)
+    assert _texts(table['bob']) == ['2', '3', '4']
+    assert table.budget.stats()['evicted'] == 2
+
+
+def test_drop_newest_rejects_new_messages():
+    table = MailboxTable(capacity=3, policy='drop_newest')
+    _fill(table['bob'], 5)
+    assert _texts(table['bob']) == ['0', '1', '2']
+    stats = table.budget.stats()
+    assert (stats['rejected'], stats['evicted']) == (2, 0)
+
+
+def test_summarize_merges_oldest_into_one_summary():
+    table = MailboxTable(capacity=3, policy='summarize')
+    _fill(table['bob'], 6)
+    messages = table['bob'].read_after(0)
+    assert messages[0]['type'] == 'summary'
+    assert messages[0]['count'] == 4 and messages[0]['types'] == {'chat': 4}
+    assert [message['message'] for message in messages[1:]] == ['4', '5']
+    # 每次溢出移出一条：6 条写进容量 3 的信箱
+    assert table.budget.stats()['evicted'] == 3
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        MailboxTable(policy='drop_everything')
+
+
+@pytest.mark.parametrize('policy, kept, evicted, rejected', [
+    ('drop_oldest', 5, 6, 0),
+    ('drop_newest', 10, 0, 1),
+])
+def test_global_budget_counts_actual_messages(policy, kept, evicted, rejected):
+    table = MailboxTable(capacity=100, policy=policy, global_capacity=10)
+    _fill(table['alice'], 10)
+    table['bob']  # 第二个信箱，公平份额降到 5
+    _fill(table['alice'], 1, start=10)
+
+    stats = table.budget.stats()
+    assert len(table['alice']) == kept
+    assert (stats['evicted'], stats['rejected']) == (evicted, rejected)
+    assert stats['overflows'][policy] == 1
+    assert stats['messages'] == kept
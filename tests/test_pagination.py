@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列表接口分页的测试 - limit / cursor 逐页读完全部，不带 limit 时一次返回全部
+"""
+
+
+def _pages(client, path, key, limit, **params):
+    """按 next_cursor 逐页读取，返回每页的 user_id 列表"""
+    pages = []
+    params = dict(params, limit=limit)
+    while True:
+        response = client.get(path, query_string=params)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append([entry.get('user_id') or entry.get('from_user_id') for entry in data[key]])
+        if not data.get('next_cursor'):
+            return pages
+        params['cursor'] = data['next_cursor']
+
+
+def test_friends_pages_cover_list_in_order(client, register, befriend):
+    register('bob', *[f'friend_{i}' for i in range(7)])
+    for i in range(7):
+        befriend(f'friend_{i}', 'bob')
+
+    pages = _pages(client, '/friends', 'friends', 3, user_id='bob')
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == sorted(f'friend_{i}' for i in range(7))
+    whole = client.get('/friends', query_string={'user_id': 'bob'}).get_json()
+    assert 'next_cursor' not in whole
+    assert sorted(friend['user_id'] for friend in whole['friends']) == sum(pages, [])
+
+
+def test_friends_cursor_survives_changes_between_pages(client, register, befriend):
+    register('bob', 'a', 'b', 'c', 'd')
+    for friend_id in ('a', 'c', 'd'):
+        befriend(friend_id, 'bob')
+    first = client.get('/friends', query_string={'user_id': 'bob', 'limit': 2}).get_json()
+    assert [friend['user_id'] for friend in first['friends']] == ['a', 'c']
+    # 翻页之间新增的、排在游标之前的好友不会让下一页重复或跳过
+    befriend('b', 'bob')
+    second = client.get('/friends', query_string={
+        'user_id': 'bob', 'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert [friend['user_id'] for friend in second['friends']] == ['d']
+    assert second['next_cursor'] is None
+
+
+def test_friend_request_pages_follow_arrival_order(client, register):
+    senders = [f'sender_{i}' for i in range(5)]
+    register('bob', *senders)
+    for sender in reversed(senders):
+        assert client.post('/send_friend_request', json={
+            'from_user_id': sender, 'from_user_name': sender.upper(), 'to_user_id': 'bob'}).status_code == 200
+
+    pages = _pages(client, '/friend_requests', 'requests', 2, user_id='bob')
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == list(reversed(senders))
+
+
+def test_bad_page_arguments_are_rejected(client, register):
+    register('bob')
+    for params in ({'limit': 0}, {'limit': 'x'}, {'limit': 2, 'cursor': '!!'},
+                   {'limit': 2, 'cursor': 'MQ'}):  # MQ 是数字 1，/friends 的游标是 user_id
+        assert client.get('/friends', query_string=dict(params, user_id='bob')).status_code == 400
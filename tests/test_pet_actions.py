@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+宠物动作的测试 - 发送者序号、被合并的序号区间、按区间补发
+"""
+
+from message_store import SenderLog
+
+
+def _act(client, user_id, text):
+    assert client.post('/send', json={'user_id': user_id, 'type': 'pet_action', 'message': text}).status_code == 200
+
+
+def _pet_actions(client, user_id):
+    data = client.get('/messages', query_string={'user_id': user_id}).get_json()
+    return [message for message in data['messages'] if message['type'] == 'pet_action']
+
+
+def _resend(client, user_id, from_user_id, first, last):
+    return client.get('/resend', query_string={
+        'user_id': user_id, 'from_user_id': from_user_id, 'first': first, 'last': last})
+
+
+def test_sender_log_resends_only_live_messages():
+    log = SenderLog(capacity=3)
+    with log.lock:
+        for key in ('emotion', None, 'emotion', None):
+            log.stamp({'key': key}, key)
+    # 历史只留最近 3 条，序号 1 已无法补发；序号 3 是 emotion 最新的一条
+    assert [message['sender_seq'] for message in log.resend(1, 4)] == [2, 3, 4]
+    with log.lock:
+        log.stamp({'key': 'emotion'}, 'emotion')
+    # 序号 3 被新的 emotion 取代，不再补发
+    assert [message['sender_seq'] for message in log.resend(1, 5)] == [4, 5]
+
+
+def test_coalesced_message_lists_superseded_sender_seqs(client, register, pair):
+    register('alice', 'bob')
+    pair('alice', 'bob')
+    for text in ('1:emotion:happy', '1:dance:spin', '1:emotion:sad', '1:emotion:angry', '1:control:alice'):
+        _act(client, 'alice', text)
+
+    actions = _pet_actions(client, 'bob')
+    assert [(message['message'], message['sender_seq']) for message in actions] == [
+        ('1:dance:spin', 2), ('1:emotion:angry', 4), ('1:control:alice', 5)]
+    # 被合并掉的 1、3 不是缺口
+    assert actions[1]['superseded'] == [[1, 1], [3, 3]]
+    assert 'superseded' not in actions[0]
+
+
+def test_resend_returns_missing_range(server, client, register, pair):
+    register('alice', 'bob')
+    pair('alice', 'bob')
+    for text in ('1:dance:one', '1:dance:two', '1:dance:three'):
+        _act(client, 'alice', text)
+
+    data = _resend(client, 'bob', 'alice', 2, 3).get_json()
+    assert [message['message'] for message in data['messages']] == ['1:dance:two', '1:dance:three']
+    assert data['last_sender_seq'] == 3
+    assert _resend(client, 'carol', 'alice', 1, 3).status_code == 404
+
+
+def test_resend_does_not_leak_to_next_partner(client, register, pair):
+    register('alice', 'bob', 'carol')
+    pair('alice', 'bob')
+    _act(client, 'alice', '1:dance:for-bob')
+    assert client.post('/dissolve_couple', json={'user_id': 'alice'}).status_code == 200
+    assert _resend(client, 'bob', 'alice', 1, 1).status_code == 403
+
+    pair('alice', 'carol')
+    assert _resend(client, 'carol', 'alice', 1, 10).get_json()['messages'] == []
+
+    # 序号继续递增，新情侣从 /pet_state 给出的序号开始检测缺口
+    state = client.get('/pet_state', query_string={'user_id': 'carol'}).get_json()
+    assert state['action_seqs']['alice'] == 1
+    _act(client, 'alice', '1:dance:for-carol')
+    assert [message['sender_seq'] for message in _pet_actions(client, 'carol')] == [2]
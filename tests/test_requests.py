@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友申请 / 情侣申请的测试 - 统一存储的索引、查重、分页游标
+"""
+
+from message_store import MailboxTable, RequestIndex
+
+
+def _submit(index, from_user_id, to_user_id):
+    return index.submit(from_user_id, from_user_id.upper(), to_user_id, 'hi')
+
+
+def test_record_is_shared_by_mailbox_and_indexes():
+    mailboxes = MailboxTable()
+    index = RequestIndex('friend_request', mailboxes)
+    record = _submit(index, 'alice', 'bob')
+
+    assert index.find('bob', 'alice') is record
+    assert index.pending_for('bob') == [record]
+    assert index.sent_by('alice') == [record]
+    assert mailboxes['bob'].read_after(0) == [record]
+
+    assert index.remove('bob', 'alice') is record
+    assert index.remove('bob', 'alice') is None
+    assert index.find('bob', 'alice') is None
+    assert (index.incoming, index.received, index.outgoing) == ({}, {}, {})
+
+
+def test_out_of_order_indexing_keeps_lists_sorted():
+    index = RequestIndex('friend_request', MailboxTable())
+    records = [_submit(index, f'sender_{i}', 'bob') for i in range(5)]
+    late = index.remove('bob', 'sender_1')
+    first = index.remove('bob', 'sender_0')
+    # 并发提交时先分到序号的可能后建索引
+    index._index(late)
+    index._index(first)
+    assert index.pending_for('bob') == records
+    assert index.sent_by('sender_0') == [first]
+
+
+def test_pages_follow_seq_cursor():
+    index = RequestIndex('friend_request', MailboxTable())
+    records = [_submit(index, f'sender_{i}', 'bob') for i in range(7)]
+    for i in range(7):
+        _submit(index, 'bob', f'friend_{i}')
+
+    page, more = index.pending_page('bob', 0, 3)
+    assert page == records[:3] and more
+    page, more = index.pending_page('bob', page[-1]['seq'], 3)
+    assert page == records[3:6] and more
+    page, more = index.pending_page('bob', page[-1]['seq'], 3)
+    assert page == records[6:] and not more
+
+    # 游标指向的申请被接受后，下一页不受影响
+    index.remove('bob', 'sender_3')
+    page, more = index.pending_page('bob', records[3]['seq'], 3)
+    assert page == records[4:7] and not more
+
+    sent, more = index.sent_page('bob', 0, 10)
+    assert [record['to_user_id'] for record in sent] == [f'friend_{i}' for i in range(7)] and not more
+
+
+def test_expire_stops_at_first_fresh_request():
+    index = RequestIndex('friend_request', MailboxTable())
+    old = [_submit(index, f'sender_{i}', 'bob') for i in range(3)]
+    fresh = _submit(index, 'sender_3', 'bob')
+    cutoff = fresh['timestamp']
+    for record in old:
+        record['timestamp'] = cutoff - 100
+
+    assert index.expire('bob', cutoff) == old
+    assert index.pending_for('bob') == [fresh]
+    assert 'sender_0' not in index.outgoing
+
+
+def test_request_list_endpoint_paginates(client, register):
+    register('bob', *[f'sender_{i}' for i in range(5)])
+    for i in range(5):
+        response = client.post('/send_friend_request',
+                               json={'from_user_id': f'sender_{i}', 'from_user_name': 'S', 'to_user_id': 'bob'})
+        assert response.status_code == 200
+
+    seen, cursor = [], None
+    while True:
+        params = {'user_id': 'bob', 'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        data = client.get('/friend_requests', query_string=params).get_json()
+        seen.extend(record['from_user_id'] for record in data['requests'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == [f'sender_{i}' for i in range(5)]
+
+    duplicate = client.post('/send_friend_request',
+                            json={'from_user_id': 'sender_0', 'from_user_name': 'S', 'to_user_id': 'bob'})
+    assert duplicate.status_code == 400
+
+
+def test_withdraw_removes_unread_notification_only():
+    mailboxes = MailboxTable()
+    index = RequestIndex('friend_request', mailboxes)
+    record = _submit(index, 'alice', 'bob')
+    other = _submit(index, 'carol', 'bob')
+
+    assert index.withdraw('bob', 'alice') is record
+    assert mailboxes['bob'].read_after(0) == [other]
+    assert index.withdraw('bob', 'alice') is None
+    # 通知已经被确认释放时只移除记录
+    mailboxes['bob'].ack(other['seq'])
+    assert index.withdraw('bob', 'carol') is other
+    assert len(mailboxes['bob']) == 0
+
+
+def test_removed_records_are_skipped_then_compacted():
+    index = RequestIndex('friend_request', MailboxTable())
+    records = [_submit(index, f'sender_{i}', 'bob') for i in range(6)]
+    for i in (1, 2):
+        index.remove('bob', f'sender_{i}')
+    received = index.received['bob']
+    assert len(received) == 6 and received.dead == 2  # 删除不移动列表，只计数
+    assert index.pending_page('bob', 0, 2) == ([records[0], records[3]], True)
+
+    index._index(records[1])  # 放回仍留在列表里的记录
+    assert index.pending_for('bob') == [records[0], records[1]] + records[3:]
+    for i in (0, 3, 4):
+        index.remove('bob', f'sender_{i}')
+    assert received == [records[1], records[5]] and received.dead == 0
+    assert index.pending_page('bob', records[1]['seq'], 5) == ([records[5]], False)
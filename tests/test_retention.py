@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+过期清理的测试 - 按消息类型的保留期删除、每个类别增量扫描、过期申请、后台线程的启动
+"""
+
+import importlib
+import threading
+
+from message_store import Mailbox, MailboxTable, RequestIndex
+
+
+class CountingMessage(dict):
+    """记录时间戳被读取的次数，用来确认清理没有重复扫描"""
+
+    reads = 0
+
+    def __getitem__(self, key):
+        if key == 'timestamp':
+            CountingMessage.reads += 1
+        return super().__getitem__(key)
+
+
+def _append(mailbox, message_type, timestamp):
+    mailbox.append(CountingMessage(type=message_type, timestamp=timestamp))
+
+
+def test_expire_uses_per_type_cutoffs():
+    mailbox = Mailbox()
+    for timestamp in range(10):
+        _append(mailbox, 'pet_action' if timestamp % 2 else 'chat', float(timestamp))
+
+    # pet_action 保留到 8 之前的删除，其余类型只删除 2 之前的
+    assert mailbox.expire({'pet_action': 8.0}, 2.0) == 5
+    assert [(message['type'], message['timestamp']) for message in mailbox.read_after(0)] == [
+        ('chat', 2.0), ('chat', 4.0), ('chat', 6.0), ('chat', 8.0), ('pet_action', 9.0)]
+    assert len(mailbox) == 5
+
+
+def test_expire_does_not_rescan_long_lived_messages():
+    mailbox = Mailbox()
+    for timestamp in range(1000):
+        _append(mailbox, 'chat', float(timestamp))
+    mailbox.expire({'pet_action': 2000.0}, 0.0)
+
+    # 截止时间不变时第二轮几乎不用扫描：每个类别只看停下的那一条
+    CountingMessage.reads = 0
+    assert mailbox.expire({'pet_action': 2000.0}, 0.0) == 0
+    assert CountingMessage.reads <= 2
+
+    # 截止时间后移只扫描新进入窗口的部分
+    CountingMessage.reads = 0
+    assert mailbox.expire({'pet_action': 2000.0}, 10.0) == 10
+    assert CountingMessage.reads <= 12
+
+
+def test_expire_after_ack_and_compaction():
+    mailbox = Mailbox()
+    for timestamp in range(600):
+        _append(mailbox, 'chat', float(timestamp))
+    mailbox.expire({}, 100.0)
+    mailbox.ack(mailbox.read_after(0)[300]['seq'])  # 释放前缀并压缩列表
+    assert mailbox.expire({}, 500.0) == 99
+    assert mailbox.read_after(0)[0]['timestamp'] == 500.0
+
+
+def test_stale_requests_expire_from_indexes():
+    mailboxes = MailboxTable()
+    index = RequestIndex('friend_request', mailboxes)
+    old = index.submit('alice', 'ALICE', 'bob', 'hi')
+    old['timestamp'] -= 100
+    fresh = index.submit('carol', 'CAROL', 'bob', 'hi')
+
+    assert index.expire('bob', fresh['timestamp'] - 50) == [old]
+    assert index.pending_for('bob') == [fresh]
+    assert index.sent_by('alice') == []
+
+
+def test_import_does_not_start_background_threads(server):
+    before = threading.active_count()
+    importlib.reload(server)
+    importlib.reload(server)
+    assert threading.active_count() == before
+    assert not server._background_started
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户搜索的测试 - 排名顺序、模糊匹配、改昵称的增量更新和 /search_user 的 q 分页
+"""
+
+from search_index import UserSearchIndex
+
+
+def _index(*users):
+    index = UserSearchIndex()
+    for user_id, user_name in users:
+        index.put(user_id, user_name)
+    return index
+
+
+def test_results_rank_exact_id_then_name_then_id_prefix():
+    index = _index(('xiaoming', '小明'), ('ming_2', 'Mingming'), ('ming', 'Ming'), ('u_1', 'mingyue'))
+    results, more = index.search('ming')
+    # 用户ID完全匹配、昵称前缀（完全相同的在前）、用户ID前缀；输入是完整用户ID时不做模糊匹配
+    assert results == ['ming', 'ming_2', 'u_1']
+    assert not more
+
+
+def test_fullwidth_and_case_are_ignored():
+    index = _index(('alice', 'ＡＬＩＣＥ'))
+    assert index.search('  Ali ')[0] == ['alice']
+
+
+def test_fuzzy_match_tolerates_a_typo():
+    index = _index(('u_1', 'sunshine'), ('u_2', 'moonlight'))
+    assert index.search('sunshime')[0] == ['u_1']
+    assert index.search('zzzz')[0] == []
+
+
+def test_rename_moves_user_between_prefixes():
+    index = _index(('u_1', 'apple'), ('u_2', 'apricot'))
+    index.put('u_1', 'banana')
+    assert index.search('ap')[0] == ['u_2']
+    assert index.search('ban')[0] == ['u_1']
+    assert 'app' not in index.grams and ' ap' in index.grams
+    assert len(index) == 2
+
+
+def test_offset_pages_do_not_overlap():
+    index = _index(*[(f'user_{i}', f'cat{i}') for i in range(5)])
+    first, more = index.search('cat', 0, 2)
+    second, _ = index.search('cat', 2, 2)
+    third, last_more = index.search('cat', 4, 2)
+    assert more and not last_more
+    assert first + second + third == [f'user_{i}' for i in range(5)]
+
+
+def test_search_endpoint_pages_with_cursor(client, register):
+    register(*[f'cat_{i}' for i in range(3)])
+    first = client.get('/search_user', query_string={'q': 'cat', 'limit': 2}).get_json()
+    assert [user['user_id'] for user in first['users']] == ['cat_0', 'cat_1']
+    second = client.get('/search_user', query_string={'q': 'cat', 'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert [user['user_id'] for user in second['users']] == ['cat_2']
+    assert second['next_cursor'] is None
+    assert client.get('/search_user', query_string={'q': ' '}).status_code == 400
+
+
+def test_excluded_users_do_not_take_a_rank():
+    index = _index(*[(f'user_{i}', f'cat{i}') for i in range(4)])
+    hidden = {'user_0', 'user_2'}.__contains__
+    assert index.search('cat', 0, 1, hidden) == (['user_1'], True)
+    assert index.search('cat', 1, 1, hidden) == (['user_3'], False)
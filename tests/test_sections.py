@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据分区变化的测试 - /sync 的分区版本号、WebSocket 的 section_changed 推送
+"""
+
+import pytest
+
+
+@pytest.fixture
+def pushed(server, monkeypatch):
+    """记录推送给 WebSocket 连接的帧：[(user_id, frame)]"""
+    frames = []
+    monkeypatch.setattr(server.push_gateway, 'push', lambda user_id, frame: frames.append((user_id, frame)))
+    return frames
+
+
+def _sections(pushed, user_id):
+    return [frame['section'] for recipient, frame in pushed
+            if recipient == user_id and frame['type'] == 'section_changed']
+
+
+def test_accepting_friend_pushes_friends_section(client, register, befriend, pushed):
+    register('alice', 'bob')
+    befriend('alice', 'bob')
+    assert 'friends' in _sections(pushed, 'alice')
+    assert 'friends' in _sections(pushed, 'bob')
+
+
+def test_pairing_and_dissolving_push_couple_section(client, register, pair, pushed):
+    register('alice', 'bob')
+    pair('alice', 'bob')
+    assert 'couple' in _sections(pushed, 'alice')
+    del pushed[:]
+    client.post('/dissolve_couple', json={'user_id': 'bob'})
+    assert _sections(pushed, 'alice') == ['couple']
+
+
+def test_rename_pushes_to_friends_but_presence_does_not(server, client, register, befriend, pushed):
+    register('alice', 'bob')
+    befriend('alice', 'bob')
+    del pushed[:]
+    client.post('/login_user', json={'user_id': 'alice', 'user_name': 'Alice 2'})
+    assert _sections(pushed, 'bob') == ['friends']
+
+    del pushed[:]
+    server._on_presence_change('alice', False)
+    assert _sections(pushed, 'bob') == []
+    assert [frame['type'] for _, frame in pushed] == ['presence']
+
+
+def test_sync_returns_only_changed_sections(client, register, befriend):
+    register('alice', 'bob')
+    data = client.post('/sync', json={'user_id': 'alice'}).get_json()
+    versions = {section: payload['version'] for section, payload in data['sections'].items()}
+
+    data = client.post('/sync', json={'user_id': 'alice', 'versions': versions}).get_json()
+    assert data['sections'] == {}
+    befriend('bob', 'alice')
+    data = client.post('/sync', json={'user_id': 'alice', 'versions': versions}).get_json()
+    assert set(data['sections']) == {'friends', 'friend_requests'}
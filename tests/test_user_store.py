@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户表的测试 - 并发注册时编号与 user_id 一一对应，注册接口的参数检查
+"""
+
+import threading
+
+from user_store import UserTable
+
+
+def test_concurrent_adds_keep_numbers_consistent():
+    table = UserTable()
+    barrier = threading.Barrier(8)
+    created = []
+
+    def register(worker):
+        barrier.wait()
+        for i in range(500):
+            # 每个用户ID被两个线程同时注册，只有一个成功
+            if table.add(f'user_{(worker // 2)}_{i}', 'name') is not None:
+                created.append(1)
+
+    threads = [threading.Thread(target=register, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == len(table) == 2000
+    assert len(table.user_ids) == len(table.partners) == 2000
+    for number, user_id in enumerate(table.user_ids):
+        assert table.number(user_id) == number
+
+
+def test_register_rejects_duplicates_and_non_string_ids(client, register):
+    register('alice')
+    response = client.post('/register_user', json={'user_id': 'alice', 'user_name': 'Again'})
+    assert response.status_code == 400
+    for path in ('/register_user', '/login_user'):
+        assert client.post(path, json={'user_id': 5, 'user_name': 'Five'}).status_code == 400
+        assert client.post(path, json={'user_id': ['x'], 'user_name': 'X'}).status_code == 400
+    assert client.post('/login_user', json={'user_id': 'bob', 'user_name': 'BOB'}).get_json()['user_id'] == 'bob'
+
+
+def test_non_string_user_names_are_rejected(client, register):
+    register('alice')
+    for path in ('/register_user', '/login_user'):
+        assert client.post(path, json={'user_id': 'bob', 'user_name': 5}).status_code == 400
+    assert client.post('/login_user', json={'user_id': 'alice', 'user_name': 5}).status_code == 400
+    assert client.get('/search_user', query_string={'user_id': 'bob'}).status_code == 404
+    assert client.get('/search_user', query_string={'q': 'ALICE'}).get_json()['users'][0]['user_name'] == 'ALICE'
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户表 - 紧凑的用户记录和情侣关系
+用户ID只保存一份（驻留字符串）并分配连续的内部编号，好友关系图与它共用编号
+"""
+
+import sys
+import threading
+from array import array
+
+NO_PARTNER = -1
+
+
+class UserRecord:
+    """一个用户，只有固定的几个字段（__slots__，不带每个对象的 __dict__）"""
+
+    __slots__ = ('user_id', 'user_name', 'number')
+
+    def __init__(self, user_id, user_name, number):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.number = number
+
+    def to_dict(self):
+        return {'user_id': self.user_id, 'user_name': self.user_name}
+
+
+class UserTable:
+    """全部用户
+
+    records 为 user_id -> UserRecord，user_ids 为内部编号 -> user_id；
+    user_id 在注册时驻留，请求里传来的同一个 ID 可以换成这一份（canonical），
+    好友集合、申请和消息里保存的 ID 都指向同一个字符串对象。
+    情侣关系为按编号索引的 array('i')，没有情侣时为 NO_PARTNER。
+    加入用户在锁内完成（查重、分配编号、追加），并发注册时编号与 user_id 一一对应。
+    """
+
+    def __init__(self):
+        self.records = {}  # user_id -> UserRecord
+        self.user_ids = []  # 内部编号 -> user_id
+        self.partners = array('i')  # 内部编号 -> 情侣的内部编号
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id):
+        return user_id in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, user_id):
+        return self.records[user_id]
+
+    def get(self, user_id):
+        return self.records.get(user_id)
+
+    def add(self, user_id, user_name):
+        """加入新用户，返回它的记录；user_id 已存在时不加入，返回 None"""
+        user_id = sys.intern(user_id)
+        with self._lock:
+            if user_id in self.records:
+                return None
+            record = UserRecord(user_id, user_name, len(self.user_ids))
+            self.user_ids.append(user_id)
+            self.partners.append(NO_PARTNER)
+            self.records[user_id] = record  # 最后登记，其他线程看到记录时编号已经可用
+        return record
+
+    def number(self, user_id):
+        """用户的内部编号，用户不存在时抛出 KeyError"""
+        return self.records[user_id].number
+
+    def canonical(self, user_id):
+        """已注册用户返回保存的那一份 user_id 字符串，否则原样返回"""
+        record = self.records.get(user_id)
+        return record.user_id if record is not None else user_id
+
+    def partner(self, user_id):
+        """用户的情侣 user_id，没有情侣时返回 None"""
+        record = self.records.get(user_id)
+        if record is None:
+            return None
+        partner = self.partners[record.number]
+        return self.user_ids[partner] if partner != NO_PARTNER else None
+
+    def pair(self, user_a, user_b):
+        """两人结成情侣"""
+        a, b = self.number(user_a), self.number(user_b)
+        self.partners[a] = b
+        self.partners[b] = a
+
+    def unpair(self, user_id):
+        """解除用户的情侣关系，返回原来的情侣 user_id，没有情侣时返回 None"""
+        partner_id = self.partner(user_id)
+        if partner_id is not None:
+            self.partners[self.number(user_id)] = NO_PARTNER
+            if self.partner(partner_id) == user_id:
+                self.partners[self.number(partner_id)] = NO_PARTNER
+        return partner_id
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebSocket 推送网关 - 与 Flask 应用同进程运行
+每个客户端一条长连接，复用推送宠物动作、申请通知和好友在线状态
+"""
+
+import asyncio
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
+
+import websockets
+
+
+class PushGateway:
+    """WebSocket 推送网关
+
+    网关在独立线程的事件循环里运行。Flask 线程通过 push() 投递消息帧，
+    网关把它转发到该用户的所有连接上；客户端发来的帧交给 on_frame 处理。
+
+    连接地址: ws://host:port/?user_id=<用户ID>&after=<消息序号>
+    建立连接时先补发 after 之后的信箱消息（不带 after 时 backlog 收到 None，
+    从服务器端的投递游标补发），之后实时推送。
+
+    回调:
+        user_exists(user_id) -> bool   校验用户
+        backlog(user_id, after) -> list 连接建立时需要补发的消息
+        on_frame(user_id, frame)        客户端上行帧
+        on_presence(user_id, online)    用户第一个连接建立 / 最后一个连接断开
+    """
+
+    def __init__(self, host, port, user_exists, backlog, on_frame, on_presence):
+        self.host = host
+        self.port = port
+        self.user_exists = user_exists
+        self.backlog = backlog
+        self.on_frame = on_frame
+        self.on_presence = on_presence
+        self.connections = {}  # user_id -> set of asyncio.Queue（每个连接一个发送队列）
+        self.loop = None
+        self.running = False
+
+    def start(self):
+        """在后台线程启动网关，返回是否启动成功"""
+        ready = threading.Event()
+        thread = threading.Thread(target=self._run, args=(ready,))
+        thread.daemon = True
+        thread.start()
+        ready.wait(5)
+        return self.running
+
+    def _run(self, ready):
+        """网关线程：创建事件循环并监听端口"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(websockets.serve(self._handler, self.host, self.port))
+        except OSError as e:
+            print(f"❌ WebSocket 网关启动失败: {e}")
+            ready.set()
+            return
+
+        self.running = True
+        print(f"📡 WebSocket 网关已启动: {self.host}:{self.port}")
+        ready.set()
+        self.loop.run_forever()
+
+    def push(self, user_id, frame):
+        """把一帧推送给用户的所有连接（线程安全，不在线时直接忽略）"""
+        if self.running and user_id in self.connections:
+            self.loop.call_soon_threadsafe(self._enqueue, user_id, frame)
+
+    def _enqueue(self, user_id, frame):
+        for queue in self.connections.get(user_id, ()):
+            queue.put_nowait(frame)
+
+    async def _handler(self, websocket):
+        """单个连接的生命周期"""
+        params = parse_qs(urlparse(websocket.path).query)
+        user_id = params.get('user_id', [None])[0]
+        try:
+            after = int(params['after'][0]) if 'after' in params else None
+        except ValueError:
+            after = None
+
+        if not user_id or not self.user_exists(user_id):
+            await websocket.close(code=4004, reason='user not found')
+            return
+
+        # 先登记连接再读取补发消息，两者之间没有 await，
+        # 期间新写入的消息会同时出现在补发消息和发送队列里，重复的由发送循环去掉
+        queue = asyncio.Queue()
+        first_connection = user_id not in self.connections
+        self.connections.setdefault(user_id, set()).add(queue)
+        if first_connection:
+            self.on_presence(user_id, True)
+        backlog = self.backlog(user_id, after)
+
+        sender = asyncio.ensure_future(self._send_loop(websocket, queue, backlog))
+        try:
+            async for raw in websocket:
+                try:
+                    frame = json.loads(raw)
+                except ValueError:
+                    continue
+                if isinstance(frame, dict):
+                    self.on_frame(user_id, frame)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            queues = self.connections.get(user_id, set())
+            queues.discard(queue)
+            if not queues:
+                self.connections.pop(user_id, None)
+                self.on_presence(user_id, False)
+
+    async def _send_loop(self, websocket, queue, backlog):
+        """先发补发消息，再按顺序发出队列里的帧，已经补发过的消息不再重复发送
+
+        信箱消息和好友广播来自不同线程，实时推送的序号不保证递增，
+        所以只按补发消息的序号集合去重。
+        """
+        try:
+            for message in backlog:
+                await websocket.send(json.dumps(message, ensure_ascii=False))
+            backlog_seqs = {message['seq'] for message in backlog}
+            while True:
+                frame = await queue.get()
+                if frame.get('seq') in backlog_seqs:
+                    backlog_seqs.discard(frame['seq'])
+                    continue
+                await websocket.send(json.dumps(frame, ensure_ascii=False))
+        except websockets.ConnectionClosed:
+            pass